@@ -0,0 +1,140 @@
+"""
+Controllo del tempo di avvio della CLI.
+Ogni comando viene eseguito in un processo nuovo, come lo lancerebbe un DAW,
+e si verifica che:
+  - il tempo (mediana) resti sotto la soglia indicata per il comando
+  - i comandi che non generano wavetable non importino numpy né scipy
+
+Esecuzione (dalla cartella del progetto):
+    python -m benchmarks.avvio
+    python -m benchmarks.avvio --ripetizioni 20 --soglia-lista-ms 50
+Esce con codice 1 se un controllo fallisce.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.sintetici import genera_base_fxp
+
+RADICE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI = os.path.join(RADICE, "cli.py")
+MODULI_PESANTI = ("numpy", "scipy")
+
+# Esegue cli.py nello stesso processo e riporta su stderr i moduli pesanti caricati
+_SONDA = (
+    "import sys, runpy\n"
+    "sys.argv = [sys.argv[1]] + sys.argv[2:]\n"
+    "try:\n"
+    "    runpy.run_path(sys.argv[0], run_name='__main__')\n"
+    "except SystemExit:\n"
+    "    pass\n"
+    "finally:\n"
+    "    pesanti = sorted({m.split('.')[0] for m in sys.modules} & set(%r))\n"
+    "    print('\\nMODULI_PESANTI=' + ','.join(pesanti), file=sys.stderr)\n"
+) % (MODULI_PESANTI,)
+
+
+def comandi_leggeri(base: str, cartella: str) -> dict[str, list[str]]:
+    """Comandi che non devono mai caricare numpy/scipy."""
+    parametri = ["--nome", "P", "--base", base, "--output", cartella, "--quiet",
+                 "--param", "filter_cutoff,0.4", "--mod", "LFO1,FILTER_CUTOFF,0.8",
+                 "--env", "ENV1,0.01,0.2,0.6,0.5"]
+    return {
+        "lista_sorgenti": ["--lista-sorgenti"],
+        "lista_destinazioni": ["--lista-destinazioni"],
+        "solo_validazione": parametri + ["--solo-validazione"],
+        "solo_parametri": parametri,
+    }
+
+
+def tempo_avvio(argv: list[str], ripetizioni: int) -> float:
+    """Mediana del tempo reale (s) di 'python cli.py argv' in un processo nuovo."""
+    tempi = []
+    for _ in range(ripetizioni + 1):  # la prima esecuzione scalda la cache del filesystem
+        inizio = time.perf_counter()
+        subprocess.run([sys.executable, CLI, *argv], cwd=RADICE, check=False,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        tempi.append(time.perf_counter() - inizio)
+    return statistics.median(tempi[1:])
+
+
+def tempo_avvio_interprete(ripetizioni: int) -> float:
+    """Riferimento: avvio di un interprete Python che non fa nulla."""
+    tempi = []
+    for _ in range(ripetizioni + 1):
+        inizio = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=False)
+        tempi.append(time.perf_counter() - inizio)
+    return statistics.median(tempi[1:])
+
+
+def moduli_pesanti(argv: list[str]) -> list[str]:
+    """numpy/scipy importati eseguendo cli.py con argv."""
+    r = subprocess.run([sys.executable, "-c", _SONDA, CLI, *argv], cwd=RADICE,
+                       capture_output=True, text=True, check=False)
+    for riga in r.stderr.splitlines():
+        if riga.startswith("MODULI_PESANTI="):
+            valore = riga.split("=", 1)[1]
+            return valore.split(",") if valore else []
+    raise RuntimeError(f"Sonda fallita per {argv}:\n{r.stderr}")
+
+
+def misura_avvio(cartella: str, ripetizioni: int = 10) -> dict:
+    """Tempi di avvio (stesso formato dei risultati di benchmarks.run) e moduli pesanti caricati."""
+    base = genera_base_fxp(os.path.join(cartella, "base.fxp"))
+    risultati = {}
+    vuoto = tempo_avvio_interprete(ripetizioni)
+    risultati["avvio/interprete"] = {"mediana_s": vuoto, "moduli_pesanti": [],
+                                     "ripetizioni": ripetizioni}
+    for nome, argv in comandi_leggeri(base, os.path.join(cartella, "output")).items():
+        risultati[f"avvio/{nome}"] = {
+            "mediana_s": tempo_avvio(argv, ripetizioni),
+            "moduli_pesanti": moduli_pesanti(argv),
+            "ripetizioni": ripetizioni,
+        }
+    return risultati
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="benchmarks.avvio",
+                                     description="Controlla tempo di avvio e import della CLI.")
+    parser.add_argument("--ripetizioni", type=int, default=10, metavar="N",
+                        help="Esecuzioni per comando (default: 10)")
+    parser.add_argument("--soglia-lista-ms", type=float, default=50.0, metavar="MS",
+                        help="Tempo massimo per --lista-sorgenti/--lista-destinazioni (default: 50)")
+    parser.add_argument("--output", metavar="PATH",
+                        help="Salva anche i risultati in JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cartella:
+        risultati = misura_avvio(cartella, args.ripetizioni)
+
+    falliti = []
+    for nome, r in risultati.items():
+        ms = r["mediana_s"] * 1e3
+        print(f"  {nome:<28} {ms:8.1f} ms   {', '.join(r['moduli_pesanti']) or '-'}")
+        if r["moduli_pesanti"]:
+            falliti.append(f"{nome}: importa {', '.join(r['moduli_pesanti'])}")
+        if nome.startswith("avvio/lista_") and ms > args.soglia_lista_ms:
+            falliti.append(f"{nome}: {ms:.1f} ms > {args.soglia_lista_ms:.0f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"risultati": risultati}, f, indent=2)
+
+    for f in falliti:
+        print(f"  ✗ {f}")
+    print(f"\n{'⚠' if falliti else '✅'} {len(falliti)} controlli di avvio falliti")
+    sys.exit(1 if falliti else 0)
+
+
+if __name__ == "__main__":
+    main()
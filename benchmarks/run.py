@@ -0,0 +1,268 @@
+"""
+Suite di benchmark per gli stadi della pipeline.
+Funziona offline: base .fxp e banchi .wav sono generati al momento.
+
+Esecuzione (dalla cartella del progetto):
+    python -m benchmarks.run --output risultati.json
+    python -m benchmarks.run --veloce --output risultati.json
+
+Confronto tra due esecuzioni:
+    python -m benchmarks.run confronta vecchi.json nuovi.json --soglia 0.10
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from benchmarks.sintetici import genera_base_fxp, genera_wav, espressione_armonica
+from benchmarks.avvio import misura_avvio
+from core.cache_wavetable import CACHE_WAVETABLE
+from core.console import silenzioso
+from core.espressioni import compila_espressione
+from core.wavetable import _da_funzione, _da_campioni, _da_file, _da_spettro, _da_morph
+from core.modulation import codifica_modulazioni, codifica_modulazioni_batch, codifica_parametri
+from core.validator import valida_batch
+from core.sweep import varianti_sweep
+from core.casuale import genera_batch, specs_da_batch
+from output_io.reader import leggi_cartella
+from core.anteprima import renderizza_batch
+from models.preset_batch import PresetBatch
+from core.encoder import assembla_fxp
+from core.pipeline import esegui_pipeline
+from core.spec import preset_da_spec, parse_spettro, parse_morph
+from models.input_schema import PresetInput, ModulazioneInput, ParametroInput, EnvelopeInput, AnteprimaInput
+from maps.sources import SORGENTI
+from maps.destinations import DESTINAZIONI
+
+FRAME = (1, 16, 64, 256)
+ARMONICHE = (1, 8, 32)
+WAV_FRAME = (16, 256, 1024)
+N_PRESET = (1, 100, 1000, 10000)
+
+
+def misura(f, ripetizioni: int) -> dict:
+    """Esegue f una volta a vuoto, poi ripetizioni volte; tempi in secondi."""
+    f()
+    tempi = []
+    for _ in range(ripetizioni):
+        inizio = time.perf_counter()
+        f()
+        tempi.append(time.perf_counter() - inizio)
+    return {"mediana_s": statistics.median(tempi), "min_s": min(tempi), "ripetizioni": ripetizioni}
+
+
+def _preset_completo(nome: str, base: str) -> PresetInput:
+    sorgenti, destinazioni = list(SORGENTI), list(DESTINAZIONI)
+    preset = PresetInput(
+        nome=nome,
+        base_fxp=base,
+        modulazioni=[ModulazioneInput(sorgenti[i % len(sorgenti)],
+                                      destinazioni[i % len(destinazioni)], 0.5)
+                     for i in range(16)],
+        parametri=[ParametroInput("filter_cutoff", 0.4), ParametroInput("filter_res", 0.6),
+                   ParametroInput("filter_drive", 0.2)],
+        envelopes=[EnvelopeInput(target="ENV1"), EnvelopeInput(target="ENV2")],
+    )
+    return preset
+
+
+def esegui_suite(cartella: str, veloce: bool = False) -> dict:
+    ripetizioni = 3 if veloce else 10
+    n_preset = N_PRESET[:3] if veloce else N_PRESET
+    risultati = {}
+
+    base = genera_base_fxp(os.path.join(cartella, "base.fxp"))
+
+    # ── Avvio della CLI (processi nuovi) ─────────────
+    risultati.update(misura_avvio(cartella, ripetizioni))
+
+    # ── Stadio 2: wavetable da funzione ──────────────
+    for n_arm in ARMONICHE:
+        f = compila_espressione(espressione_armonica(n_arm) + " + 0*t")
+        for n_frame in FRAME:
+            risultati[f"da_funzione/armoniche={n_arm}/frame={n_frame}"] = \
+                misura(lambda: _da_funzione(f, n_frame), ripetizioni)
+
+    # ── Stadio 2: wavetable da spettro (una irfft per tutti i frame) ──
+    for n_arm in ARMONICHE + (512,):
+        spettro = parse_spettro("(k % 2) / k * (1 - t) + t / k", limite=n_arm)
+        for n_frame in FRAME:
+            risultati[f"da_spettro/armoniche={n_arm}/frame={n_frame}"] = \
+                misura(lambda: _da_spettro(spettro, n_frame), ripetizioni)
+
+    # ── Stadio 2: wavetable da keyframe ──────────────
+    chiavi = [espressione_armonica(n) for n in (1, 4, 16, 64)]
+    for modo in ("lineare", "spettrale"):
+        morph = parse_morph(chiavi, modo)
+        for n_frame in FRAME:
+            risultati[f"da_morph/{modo}/chiavi=4/frame={n_frame}"] = \
+                misura(lambda: _da_morph(morph, n_frame), ripetizioni)
+
+    # ── Stadio 2: wavetable da campioni e da file ────
+    for n_frame in WAV_FRAME:
+        campioni = np.random.default_rng(0).standard_normal(n_frame * 2048)
+        risultati[f"da_campioni/frame={n_frame}"] = \
+            misura(lambda: _da_campioni(campioni), ripetizioni)
+        for bits in (16, 32):
+            wav = genera_wav(os.path.join(cartella, f"banco_{n_frame}_{bits}.wav"), n_frame, bits)
+            risultati[f"da_file/bits={bits}/frame={n_frame}"] = \
+                misura(lambda: _da_file(wav), ripetizioni)
+
+    # ── Stadi 3-5 ────────────────────────────────────
+    preset = _preset_completo("bench", base)
+    risultati["codifica_modulazioni/slot=16"] = \
+        misura(lambda: codifica_modulazioni(preset), ripetizioni * 100)
+    risultati["codifica_parametri"] = \
+        misura(lambda: codifica_parametri(preset), ripetizioni * 100)
+    codifica_modulazioni(preset)
+    codifica_parametri(preset)
+    risultati["assembla_fxp"] = misura(lambda: assembla_fxp(preset), ripetizioni * 100)
+
+    # ── Validazione di un manifest intero ────────────
+    presets = [_preset_completo(f"v{i}", base) for i in range(1000)]
+    risultati["valida_batch/preset=1000"] = misura(lambda: valida_batch(presets), ripetizioni)
+    colonnare = PresetBatch.da_preset(presets)
+    risultati["valida_batch/colonnare/preset=1000"] = \
+        misura(lambda: valida_batch(colonnare), ripetizioni)
+    risultati["codifica_modulazioni_batch/slot=16/preset=1000"] = \
+        misura(lambda: codifica_modulazioni_batch(colonnare), ripetizioni)
+
+    # ── Varianti di uno sweep in forma colonnare ─────
+    assi = {("param", "filter_cutoff"): [i / 99 for i in range(100)],
+            ("mod", "LFO1", "FILTER_CUTOFF"): [i / 99 for i in range(100)],
+            ("env", "ENV1", "attack"): [i / 9 for i in range(10)]}
+    risultati["varianti_sweep/varianti=100000"] = \
+        misura(lambda: varianti_sweep(preset, assi), 1 if veloce else ripetizioni)
+
+    # ── Preset casuali ───────────────────────────────
+    risultati["genera_batch/preset=100000"] = \
+        misura(lambda: genera_batch(100_000, seed=1, base=base), 1 if veloce else ripetizioni)
+    casuali = genera_batch(10_000, seed=1, base=base)
+    risultati["specs_da_batch/preset=10000"] = \
+        misura(lambda: list(specs_da_batch(casuali)), ripetizioni)
+
+    # ── Anteprime audio (100 × 2 s di audio) ─────────
+    tabelle = [_da_spettro(s, 64) for s in (parse_spettro(f"1 / k ** (1 + {i % 10} * t / 5)")
+                                           for i in range(100))]
+    risultati["anteprime/preset=100/durata=2s"] = \
+        misura(lambda: renderizza_batch(tabelle, AnteprimaInput(durata=2.0)), ripetizioni)
+
+    # ── Lettura di una libreria di .fxp ──────────────
+    libreria = os.path.join(cartella, "libreria")
+    os.makedirs(libreria)
+    dati = assembla_fxp(preset)._fxp_bytes
+    for i in range(1000):
+        with open(os.path.join(libreria, f"l{i:04d}.fxp"), "wb") as f:
+            f.write(dati)
+    risultati["leggi_cartella/preset=1000"] = misura(lambda: leggi_cartella(libreria), ripetizioni)
+
+    # ── Pipeline completa ────────────────────────────
+    specs = {
+        "parametri": lambda i: {"nome": f"p{i}", "base": base, "output": cartella,
+                                "mod": ["LFO1,FILTER_CUTOFF,0.5"],
+                                "param": [f"filter_cutoff,{(i % 100) / 100}"],
+                                "env": ["ENV1,0.01,0.2,0.6,0.5"]},
+        "funzione": lambda i: {"nome": f"f{i}", "base": base, "output": cartella,
+                               "funzione": espressione_armonica(8) + f" + {i % 7}*t*sin(2*x)",
+                               "frame": 16},
+    }
+    cartella_output = os.path.join(cartella, "output")
+    os.makedirs(cartella_output, exist_ok=True)
+    precedente = os.getcwd()
+    os.chdir(cartella)
+    try:
+        with silenzioso():
+            for tipo, spec in specs.items():
+                for n in n_preset:
+                    presets = [spec(i) for i in range(n)]
+
+                    def esegui():
+                        for s in presets:
+                            esegui_pipeline(preset_da_spec(s), verbose=False, cache=None)
+
+                    risultati[f"pipeline/{tipo}/preset={n}"] = misura(esegui, 1 if n >= 1000 else ripetizioni)
+    finally:
+        os.chdir(precedente)
+
+    return risultati
+
+
+def confronta(vecchi: dict, nuovi: dict, soglia: float) -> list[str]:
+    """Benchmark la cui mediana è peggiorata oltre la soglia (es. 0.10 = +10%)."""
+    regressioni = []
+    for nome in sorted(set(vecchi) & set(nuovi)):
+        prima, dopo = vecchi[nome]["mediana_s"], nuovi[nome]["mediana_s"]
+        if prima > 0 and dopo / prima > 1 + soglia:
+            regressioni.append(f"{nome}: {prima * 1e3:.3f} ms → {dopo * 1e3:.3f} ms "
+                               f"(+{(dopo / prima - 1) * 100:.0f}%)")
+    return regressioni
+
+
+def main_confronta(argv: list[str]):
+    parser = argparse.ArgumentParser(prog="benchmarks.run confronta",
+                                     description="Confronta due file di risultati dei benchmark.")
+    parser.add_argument("vecchi", help="Risultati di riferimento (.json)")
+    parser.add_argument("nuovi", help="Risultati da verificare (.json)")
+    parser.add_argument("--soglia", type=float, default=0.10,
+                        help="Peggioramento tollerato della mediana (default: 0.10 = 10%%)")
+    args = parser.parse_args(argv)
+
+    with open(args.vecchi) as f:
+        vecchi = json.load(f)["risultati"]
+    with open(args.nuovi) as f:
+        nuovi = json.load(f)["risultati"]
+
+    regressioni = confronta(vecchi, nuovi, args.soglia)
+    for r in regressioni:
+        print(f"  ✗ {r}")
+    print(f"\n{'⚠' if regressioni else '✅'} {len(regressioni)} regressioni "
+          f"su {len(set(vecchi) & set(nuovi))} benchmark (soglia {args.soglia:.0%})")
+    sys.exit(1 if regressioni else 0)
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "confronta":
+        main_confronta(sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(prog="benchmarks.run",
+                                     description="Esegue i benchmark degli stadi della pipeline.")
+    parser.add_argument("--output", metavar="PATH", default="benchmark.json",
+                        help="File JSON dei risultati (default: benchmark.json)")
+    parser.add_argument("--veloce", action="store_true",
+                        help="Meno ripetizioni e al massimo 1000 preset")
+    args = parser.parse_args()
+
+    # Cache disattivata: si misura il lavoro reale, non le letture dalla cache
+    CACHE_WAVETABLE.attiva = False
+
+    with tempfile.TemporaryDirectory() as cartella:
+        risultati = esegui_suite(cartella, veloce=args.veloce)
+
+    for nome, r in risultati.items():
+        print(f"  {nome:<45} {r['mediana_s'] * 1e3:10.3f} ms")
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "meta": {
+                "data": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "piattaforma": platform.platform(),
+            },
+            "risultati": risultati,
+        }, f, indent=2)
+    print(f"\n[OK] Risultati salvati: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
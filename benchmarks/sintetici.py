@@ -0,0 +1,52 @@
+"""
+Dati sintetici per i benchmark: file .fxp base e banchi .wav generati
+in modo deterministico, senza bisogno di preset reali di Serum.
+"""
+
+import struct
+
+import numpy as np
+from scipy.io import wavfile
+
+FRAME_SIZE = 2048
+
+
+def genera_base_fxp(path: str, dimensione: int = 8192, seed: int = 0) -> str:
+    """
+    Scrive un .fxp fittizio: header FXP 'CcnK'/'FPCh' seguito da un chunk
+    di bytes casuali, abbastanza grande da contenere tutti gli offset patchati.
+    """
+    rng = np.random.default_rng(seed)
+    chunk = rng.integers(0, 256, size=dimensione, dtype=np.uint8).tobytes()
+    header = struct.pack(
+        ">4sI4sIIII28sI",
+        b"CcnK", dimensione + 52, b"FPCh", 1, int.from_bytes(b"XfsX", "big"), 1, 1,
+        b"Benchmark".ljust(28, b"\0"), dimensione,
+    )
+    with open(path, "wb") as f:
+        f.write(header + chunk)
+    return path
+
+
+def genera_wav(path: str, n_frame: int, bits: int = 16, seed: int = 0) -> str:
+    """Banco .wav mono di n_frame frame: armoniche casuali diverse per ogni frame."""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 2 * np.pi, FRAME_SIZE, endpoint=False)
+    armoniche = np.arange(1, 9)
+    ampiezze = rng.random((n_frame, len(armoniche))) / armoniche
+    campioni = (ampiezze @ np.sin(np.outer(armoniche, x))).reshape(-1)
+    campioni /= np.max(np.abs(campioni))
+
+    if bits == 16:
+        dati = (campioni * 32767).astype(np.int16)
+    elif bits == 32:
+        dati = campioni.astype(np.float32)
+    else:
+        raise ValueError(f"bits non supportati: {bits}")
+    wavfile.write(path, 44100, dati)
+    return path
+
+
+def espressione_armonica(n_armoniche: int) -> str:
+    """Serie armonica dispari con n termini, es. 'sin(1*x)/1 + sin(3*x)/3 + ...'."""
+    return " + ".join(f"sin({k}*x)/{k}" for k in range(1, 2 * n_armoniche, 2))
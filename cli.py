@@ -8,6 +8,14 @@ Wavetable da funzione:
     python cli.py --nome Test --base base.fxp \
         --funzione "sin(x) + sin(3*x)/3" --frame 16
 
+Wavetable additiva (ampiezze delle armoniche in k e t, una sola FFT):
+    python cli.py --nome Quadra --base base.fxp \
+        --armoniche "(k % 2) / k * (1 - t) + t / k" --frame 256 --limite-armoniche 512
+
+Wavetable da frame chiave (morph tra poche forme):
+    python cli.py --nome Morph --base base.fxp --frame 256 --morph spettrale \
+        --keyframe "sin(x)" --keyframe "sin(x) + sin(3*x)/3" --keyframe banco.wav#7
+
 Wavetable da file .wav:
     python cli.py --nome Test --base base.fxp --wav mia_wavetable.wav
 
@@ -20,28 +28,54 @@ Con modulazioni e parametri:
         --env "ENV1,0.01,0.2,0.6,0.5" \
         --output "./miei_preset"
 
+Anteprima audio della wavetable (<nome>_anteprima.wav):
+    python cli.py --nome Test --base base.fxp --armoniche "1 / k" --anteprima 60,1.5
+
 Lista sorgenti disponibili:
     python cli.py --lista-sorgenti
 
 Lista destinazioni disponibili:
     python cli.py --lista-destinazioni
+
+Batch da manifest (JSONL o CSV, un preset per riga):
+    python cli.py batch manifest.jsonl --workers 8
+
+Sweep di parametri (prodotto cartesiano dei valori):
+    python cli.py sweep --nome Sweep --base base.fxp --funzione "sin(x)" \
+        --param "filter_cutoff,0.1:0.9:10" --mod "LFO1,FILTER_CUTOFF,0.25|0.5|1"
+
+Servizio sempre attivo (evita l'avvio a ogni preset) e client:
+    python cli.py serve &
+    python cli.py client '{"nome": "Pad", "base": "base.fxp", "funzione": "sin(x)"}'
+
+Preset casuali riproducibili (manifest JSONL o esecuzione diretta):
+    python cli.py casuale 1000 --base base.fxp --seed 7 --manifest casuali.jsonl
+
+Lettura di preset esistenti come manifest (da modificare e rieseguire con batch):
+    python cli.py leggi ./libreria --ricorsiva --manifest libreria.jsonl
+
+Anteprime audio di wavetable .wav esistenti:
+    python cli.py anteprima ./output/*_wavetable.wav --nota 60 --output ./anteprime
+
+Indice di similarità (vicini e duplicati in una libreria di preset):
+    python cli.py indice aggiorna ./output --indice ./indice
+    python cli.py indice vicini nuovo.fxp -k 10 --indice ./indice
 ═══════════════════════════════════════════════════════
 """
 
+from __future__ import annotations
+
 import sys
 import os
 sys.path.insert(0, os.path.dirname(__file__))
 
-import argparse
-import numpy as np
+import time
 
-from models.input_schema import (
-    PresetInput, WavetableInput,
-    ModulazioneInput, ParametroInput, EnvelopeInput
-)
+# Solo moduli leggeri a livello di modulo: argparse, models, spec e pipeline
+# (e con loro numpy/scipy, se servono) si importano nei comandi che li usano,
+# così le utility come --lista-sorgenti partono subito (vedi benchmarks/avvio.py)
 from maps.sources import SORGENTI
 from maps.destinations import DESTINAZIONI
-from core.pipeline import esegui_pipeline
 
 
 # ═══════════════════════════════════════════════════════
@@ -49,6 +83,7 @@ from core.pipeline import esegui_pipeline
 # ═══════════════════════════════════════════════════════
 
 def crea_parser() -> argparse.ArgumentParser:
+    import argparse
     parser = argparse.ArgumentParser(
         prog="serum-builder",
         description="Genera preset .fxp di Serum da riga di comando.",
@@ -65,12 +100,12 @@ def crea_parser() -> argparse.ArgumentParser:
     # ── Obbligatori ──────────────────────────────────
     obbligatori = parser.add_argument_group("Obbligatori")
     obbligatori.add_argument(
-        "--nome", required=True,
+        "--nome",
         metavar="NOME",
         help="Nome del preset (usato per il nome del file output)"
     )
     obbligatori.add_argument(
-        "--base", required=True,
+        "--base",
         metavar="PATH",
         help="Path al file .fxp base di partenza"
     )
@@ -83,10 +118,13 @@ def crea_parser() -> argparse.ArgumentParser:
         metavar="EXPR",
         help=(
             "Espressione matematica come stringa\n"
-            "  Variabile:  x  (da 0 a 2π per ogni frame)\n"
+            "  Variabili:  x  (da 0 a 2π per ogni frame)\n"
+            "              t  (da 0 a 1 lungo i frame)\n"
             "  Funzioni:   sin, cos, tan, sqrt, abs, log, exp\n"
             "  Costanti:   pi, e\n"
-            "  Esempio:    \"sin(x) + sin(3*x)/3 + sin(5*x)/5\""
+            "  Esempio:    \"sin(x) + sin(3*x)/3 + sin(5*x)/5\"\n"
+            "Oppure FILE.py:NOME, una funzione Python f(x) o f(x, t) definita nel file\n"
+            "  (richiede --consenti-python)"
         )
     )
     wt_group.add_argument(
@@ -94,11 +132,73 @@ def crea_parser() -> argparse.ArgumentParser:
         metavar="PATH",
         help="Path a un file .wav esistente da usare come wavetable"
     )
+    wt_group.add_argument(
+        "--armoniche",
+        metavar="EXPR",
+        help=(
+            "Ampiezza di ogni armonica, sintesi additiva con una sola FFT\n"
+            "  Variabili:  k  (indice dell'armonica: 1, 2, 3, ...)\n"
+            "              t  (da 0 a 1 lungo i frame)\n"
+            "  Esempio:    \"(k %% 2) / k\"  (onda quadra, armoniche dispari)"
+        )
+    )
+    wt_group.add_argument(
+        "--keyframe",
+        action="append",
+        metavar="EXPR|WAV",
+        help=(
+            "Frame chiave da interpolare fino a --frame frame (ripetibile)\n"
+            "  Espressione in x, oppure un .wav: banco.wav (tutti i frame),\n"
+            "  banco.wav#3 (frame 3), banco.wav#2:5 (frame da 2 a 4)\n"
+            "  Esempio:    --keyframe \"sin(x)\" --keyframe \"sin(x) + sin(3*x)/3\""
+        )
+    )
+    wt.add_argument(
+        "--morph",
+        choices=("lineare", "spettrale"), default="lineare",
+        help="Interpolazione tra i keyframe: crossfade lineare oppure\n"
+             "spettrale (modulo e fase per armonica). Default: lineare"
+    )
+    wt.add_argument(
+        "--posizioni",
+        metavar="T1,T2,...",
+        help="Posizione (0–1) di ogni keyframe lungo la wavetable (default: equispaziate)"
+    )
+    wt.add_argument(
+        "--fasi",
+        metavar="EXPR",
+        help="Fase (radianti) di ogni armonica, in k e t (solo con --armoniche)"
+    )
+    wt.add_argument(
+        "--limite-armoniche", type=int, default=None,
+        metavar="N",
+        help="Band-limit: azzera le armoniche oltre la N-esima (max 1023)"
+    )
     parser.add_argument(
         "--frame", type=int, default=8,
         metavar="N",
         help="Numero di frame della wavetable (default: 8)\n"
-             "Usato solo con --funzione. Range consigliato: 1–256"
+             "Usato con --funzione, --armoniche e --keyframe. Range consigliato: 1–256"
+    )
+    wt.add_argument(
+        "--render-workers", type=int, default=None,
+        metavar="N",
+        help="Valuta le funzioni non vettorizzabili (es. --funzione modello.py:corda)\n"
+             "su N worker, un blocco di frame ciascuno (default: in sequenza)"
+    )
+    wt.add_argument(
+        "--render-processi", action="store_true",
+        help="Con --render-workers usa processi invece di thread (funzioni in puro Python)"
+    )
+    wt.add_argument(
+        "--consenti-python", action="store_true",
+        help="Consente --funzione FILE.py:NOME: importa il file ed esegue il suo codice"
+    )
+    wt.add_argument(
+        "--anteprima", nargs="?", const="", default=None,
+        metavar="NOTA[,DURATA]",
+        help="Scrive anche <nome>_anteprima.wav: la wavetable suonata percorrendo\n"
+             "tutti i frame (default: nota MIDI 48 per 2 secondi)"
     )
 
     # ── Modulazioni ───────────────────────────────────
@@ -127,8 +227,7 @@ def crea_parser() -> argparse.ArgumentParser:
             "Parametro statico di Serum\n"
             "  Formato:  NOME,VALORE (valore tra 0.0 e 1.0)\n"
             "  Esempio:  --param \"filter_cutoff,0.4\"\n"
-            "  Nomi disponibili: filter_cutoff, filter_res, filter_drive,\n"
-            "                    master_vol, master_pan"
+            "  Nomi disponibili: filter_cutoff, filter_res, filter_drive"
         )
     )
 
@@ -141,7 +240,7 @@ def crea_parser() -> argparse.ArgumentParser:
         help=(
             "Envelope ADSR\n"
             "  Formato:  TARGET,ATTACK,DECAY,SUSTAIN,RELEASE\n"
-            "  Target:   ENV1, ENV2, ENV3\n"
+            "  Target:   ENV1, ENV2\n"
             "  A/D/R:    secondi  |  S: livello 0.0–1.0\n"
             "  Esempio:  --env \"ENV1,0.01,0.2,0.6,0.5\""
         )
@@ -155,6 +254,30 @@ def crea_parser() -> argparse.ArgumentParser:
         default="./output",
         help="Cartella di destinazione dei file generati (default: ./output)"
     )
+    out.add_argument(
+        "--indice",
+        metavar="DIR",
+        help="Aggiorna l'indice di similarità in DIR con i preset generati"
+    )
+
+    out.add_argument(
+        "--archivio",
+        metavar="PATH",
+        help="Scrive .fxp e wavetable in un archivio .zip o .tar invece che in --output\n"
+             "(wavetable identiche salvate una volta; se esiste già vi aggiunge i nuovi file)"
+    )
+
+    # ── Cache ─────────────────────────────────────────
+    cache = parser.add_argument_group("Cache")
+    cache.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Non usare la cache su disco delle wavetable\n"
+             "(default: ~/.cache/serum_builder/wavetable, o $SERUM_BUILDER_CACHE)"
+    )
+
+    # ── Metriche ──────────────────────────────────────
+    aggiungi_argomenti_metriche(parser)
 
     # ── Utility ───────────────────────────────────────
     util = parser.add_argument_group("Utility")
@@ -168,7 +291,306 @@ def crea_parser() -> argparse.ArgumentParser:
         action="store_true",
         help="Mostra tutte le destinazioni di modulazione disponibili ed esci"
     )
+    util.add_argument(
+        "--solo-validazione",
+        action="store_true",
+        help="Controlla gli argomenti e i file di input senza generare nulla"
+    )
+
+    return parser
+
+
+def crea_parser_batch() -> argparse.ArgumentParser:
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="serum-builder batch",
+        description="Genera molti preset da un manifest JSONL o CSV.",
+        formatter_class=argparse.RawTextHelpFormatter,
+        epilog="Formato riga JSONL:\n"
+               "  {\"nome\": \"Pad\", \"base\": \"base.fxp\", \"funzione\": \"sin(x)\",\n"
+               "   \"frame\": 16, \"mod\": [\"LFO1,FILTER_CUTOFF,0.8\"],\n"
+               "   \"param\": [\"filter_cutoff,0.4\"], \"env\": [\"ENV1,0.01,0.2,0.6,0.5\"],\n"
+               "   \"output\": \"./output\"}\n"
+               "Nei CSV i campi mod/param/env contengono più valori separati da ';'"
+    )
+    parser.add_argument(
+        "manifest",
+        metavar="MANIFEST",
+        help="Path al manifest (.jsonl oppure .csv)"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        metavar="N",
+        help="Numero di processi worker (default: tutti i core, 1 = nessun pool)"
+    )
+    parser.add_argument(
+        "--chunksize", type=int, default=8,
+        metavar="N",
+        help="Preset inviati a ogni worker per volta (default: 8)"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Non usare la cache su disco delle wavetable"
+    )
+    parser.add_argument(
+        "--indice",
+        metavar="DIR",
+        help="Aggiorna l'indice di similarità in DIR con i preset generati"
+    )
+    parser.add_argument(
+        "--solo-validazione",
+        action="store_true",
+        help="Valida tutto il manifest e riporta gli errori riga per riga, senza generare nulla"
+    )
+    aggiungi_argomenti_metriche(parser)
+    return parser
+
+
+def crea_parser_serve() -> argparse.ArgumentParser:
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="serum-builder serve",
+        description="Resta in ascolto e genera preset da richieste JSON-lines,\n"
+                    "senza ripagare l'avvio di Python, numpy e scipy a ogni preset.",
+        formatter_class=argparse.RawTextHelpFormatter,
+        epilog="Una richiesta per riga, con le stesse chiavi di un manifest:\n"
+               "  {\"nome\": \"Pad\", \"base\": \"base.fxp\", \"funzione\": \"sin(x)\", \"cwd\": \"/progetto\"}\n"
+               "Comandi: {\"comando\": \"stato\"}, {\"comando\": \"arresta\"}"
+    )
+    canale = parser.add_mutually_exclusive_group()
+    canale.add_argument(
+        "--socket",
+        metavar="PATH",
+        help="Socket Unix su cui ascoltare\n"
+             "(default: $SERUM_BUILDER_SOCKET o serum_builder-<uid>.sock nella cartella temporanea)"
+    )
+    canale.add_argument(
+        "--stdin",
+        action="store_true",
+        help="Legge le richieste da stdin e scrive le risposte su stdout"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        metavar="N",
+        help="Richieste eseguite in parallelo (default: min(8, core))"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Non usare la cache su disco delle wavetable"
+    )
+    return parser
+
+
+def crea_parser_client() -> argparse.ArgumentParser:
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="serum-builder client",
+        description="Invia specifiche di preset al servizio (cli.py serve).\n"
+                    "Se il servizio non è attivo le esegue direttamente.",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "spec", nargs="*",
+        metavar="SPEC",
+        help="Oggetto JSON, oppure path a un manifest .jsonl/.csv\n"
+             "(nessuno o '-' = righe JSON da stdin)"
+    )
+    parser.add_argument(
+        "--socket",
+        metavar="PATH",
+        help="Socket Unix del servizio (default come per serve)"
+    )
+    parser.add_argument(
+        "--no-fallback",
+        action="store_true",
+        help="Fallisce se il servizio non è attivo invece di eseguire in locale"
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Stampa le risposte come JSON-lines"
+    )
+    return parser
+
+
+def crea_parser_indice() -> argparse.ArgumentParser:
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="serum-builder indice",
+        description="Indice di similarità su una libreria di preset .fxp.",
+        formatter_class=argparse.RawTextHelpFormatter,
+        epilog="Esempi:\n"
+               "  python cli.py indice aggiorna ./output ./libreria --indice ./indice\n"
+               "  python cli.py indice vicini nuovo.fxp -k 10 --indice ./indice\n"
+               "  python cli.py indice duplicati --soglia 0.001 --indice ./indice"
+    )
+    parser.add_argument(
+        "azione",
+        choices=("aggiorna", "vicini", "duplicati"),
+        help="aggiorna: indicizza i .fxp nuovi o modificati nelle cartelle\n"
+             "vicini:   preset più simili ai file indicati\n"
+             "duplicati: gruppi di preset quasi identici nella libreria"
+    )
+    parser.add_argument(
+        "path", nargs="*",
+        metavar="PATH",
+        help="Cartelle (aggiorna) o file .fxp (vicini)"
+    )
+    parser.add_argument(
+        "--indice", default="./indice",
+        metavar="DIR",
+        help="Cartella dell'indice (default: ./indice)"
+    )
+    parser.add_argument(
+        "-k", type=int, default=5,
+        metavar="N",
+        help="Numero di vicini da mostrare (default: 5)"
+    )
+    parser.add_argument(
+        "--soglia", type=float, default=1e-3,
+        metavar="D",
+        help="Distanza sotto la quale due preset sono duplicati (default: 0.001)"
+    )
+    return parser
+
+
+def crea_parser_casuale() -> argparse.ArgumentParser:
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="serum-builder casuale",
+        description="Genera N preset casuali (riproducibili dal seed) come manifest JSONL,\n"
+                    "oppure li esegue subito con la pipeline batch.",
+        formatter_class=argparse.RawTextHelpFormatter,
+        epilog="Esempi:\n"
+               "  python cli.py casuale 1000 --base base.fxp --seed 7 --manifest casuali.jsonl\n"
+               "  python cli.py casuale 200 --base base.fxp --armoniche 64 --esegui --workers 8"
+    )
+    parser.add_argument(
+        "numero", type=int,
+        metavar="N",
+        help="Numero di preset da generare"
+    )
+    parser.add_argument("--base", required=True, metavar="PATH", help="Preset .fxp di partenza")
+    parser.add_argument("--seed", type=int, default=0, help="Seed del generatore (default: 0)")
+    parser.add_argument("--nome", default="Casuale",
+                        help="Prefisso dei nomi: <nome>_000000, ... (default: Casuale)")
+    parser.add_argument("--max-mod", type=int, default=8, metavar="N",
+                        help="Collegamenti per preset, da 0 a N (default: 8)")
+    parser.add_argument("--max-tempo", type=float, default=1.0, metavar="T",
+                        help="Massimo per attack, decay e release (default: 1.0)")
+    parser.add_argument("--armoniche", type=int, default=0, metavar="K",
+                        help="Aggiunge una wavetable additiva casuale di K armoniche")
+    parser.add_argument("--frame", type=int, default=8,
+                        help="Frame delle wavetable generate (default: 8)")
+    parser.add_argument("--output", default="./output", metavar="DIR",
+                        help="Cartella di output dei preset (default: ./output)")
+    destinazione = parser.add_mutually_exclusive_group()
+    destinazione.add_argument("--manifest", default="-", metavar="PATH",
+                              help="File JSONL da scrivere (default: '-' = stdout)")
+    destinazione.add_argument("--esegui", action="store_true",
+                              help="Genera subito i preset invece di scrivere il manifest")
+    parser.add_argument("--workers", type=int, default=None, metavar="N",
+                        help="Processi worker con --esegui (default: tutti i core)")
+    return parser
+
+
+def crea_parser_leggi() -> argparse.ArgumentParser:
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="serum-builder leggi",
+        description="Legge preset .fxp esistenti e li scrive come manifest JSONL:\n"
+                    "ogni riga usa il file stesso come base, quindi rieseguita con\n"
+                    "'batch' (dopo eventuali modifiche) rigenera il preset.",
+        formatter_class=argparse.RawTextHelpFormatter,
+        epilog="Esempi:\n"
+               "  python cli.py leggi output/Pad.fxp\n"
+               "  python cli.py leggi ./libreria --ricorsiva --manifest libreria.jsonl"
+    )
+    parser.add_argument("path", nargs="+", help="File .fxp o cartelle")
+    parser.add_argument("--ricorsiva", action="store_true",
+                        help="Cerca i .fxp anche nelle sottocartelle")
+    parser.add_argument("--manifest", default="-", metavar="PATH",
+                        help="File JSONL da scrivere (default: '-' = stdout)")
+    parser.add_argument("--output", metavar="DIR",
+                        help="Cartella di output da indicare in ogni riga")
+    return parser
+
 
+def crea_parser_anteprima() -> argparse.ArgumentParser:
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="serum-builder anteprima",
+        description="Renderizza l'anteprima audio di wavetable .wav esistenti:\n"
+                    "per ogni file scrive <nome>_anteprima.wav.",
+        formatter_class=argparse.RawTextHelpFormatter,
+        epilog="Esempi:\n"
+               "  python cli.py anteprima output/Pad_wavetable.wav\n"
+               "  python cli.py anteprima ./output --nota 60 --durata 1 --output ./anteprime"
+    )
+    parser.add_argument("path", nargs="+", help="File .wav o cartelle")
+    parser.add_argument("--nota", type=float, default=48.0,
+                        help="Nota MIDI suonata (default: 48)")
+    parser.add_argument("--durata", type=float, default=2.0, metavar="S",
+                        help="Durata in secondi, in cui si percorrono tutti i frame (default: 2)")
+    parser.add_argument("--rate", type=int, default=44100,
+                        help="Sample rate delle anteprime (default: 44100)")
+    parser.add_argument("--output", metavar="DIR",
+                        help="Cartella delle anteprime (default: accanto a ogni .wav)")
+    return parser
+
+
+def aggiungi_argomenti_metriche(parser: argparse.ArgumentParser):
+    met = parser.add_argument_group("Metriche")
+    met.add_argument(
+        "--quiet",
+        action="store_true",
+        help="Non stampare l'avanzamento degli stadi e le conferme [OK]"
+    )
+    met.add_argument(
+        "--metriche-jsonl",
+        metavar="PATH",
+        help="Scrive un record JSON per ogni stadio eseguito (in append)"
+    )
+    met.add_argument(
+        "--metriche-prometheus",
+        metavar="PATH",
+        help="Scrive il riepilogo per stadio (percentili) in formato Prometheus"
+    )
+    met.add_argument(
+        "--metriche-memoria",
+        action="store_true",
+        help="Misura anche il picco di memoria per stadio (tracemalloc, più lento)"
+    )
+
+
+def crea_parser_sweep() -> argparse.ArgumentParser:
+    parser = crea_parser()
+    parser.prog = "serum-builder sweep"
+    parser.description = (
+        "Genera tutte le combinazioni di valori per --mod, --param ed --env.\n"
+        "Al posto di un singolo valore ogni campo accetta:\n"
+        "  V1|V2|V3       lista di valori\n"
+        "  INIZIO:FINE:N  N valori equispaziati (estremi inclusi)"
+    )
+    parser.epilog = (
+        "Esempio:\n"
+        "  python cli.py sweep --nome Sweep --base base.fxp --funzione \"sin(x)\" \\\n"
+        "    --param \"filter_cutoff,0.1:0.9:10\" --param \"filter_res,0:0.7:8\" \\\n"
+        "    --mod \"LFO1,FILTER_CUTOFF,0.25|0.5|0.75|1\""
+    )
+    sweep = parser.add_argument_group("Sweep")
+    sweep.add_argument(
+        "--campioni", type=int, default=None,
+        metavar="N",
+        help="Genera solo N combinazioni scelte a caso invece del prodotto completo"
+    )
+    sweep.add_argument(
+        "--seed", type=int, default=0,
+        metavar="S",
+        help="Seed per la scelta delle combinazioni con --campioni (default: 0)"
+    )
     return parser
 
 
@@ -192,73 +614,431 @@ def stampa_destinazioni():
     print()
 
 
+def crea_metriche(args):
+    """Metriche richieste dagli argomenti, oppure None. Applica anche --quiet."""
+    if args.quiet:
+        from core.console import imposta_silenzioso
+        imposta_silenzioso(True)
+    if not (args.metriche_jsonl or args.metriche_prometheus):
+        return None
+    from core.metriche import Metriche, SinkJSONL
+    sink = SinkJSONL(args.metriche_jsonl) if args.metriche_jsonl else None
+    return Metriche(memoria=args.metriche_memoria, sink=sink)
+
+
+def chiudi_metriche(metriche, args):
+    if metriche is None:
+        return
+    if metriche.sink:
+        metriche.sink.chiudi()
+    if args.metriche_prometheus:
+        metriche.scrivi_prometheus(args.metriche_prometheus)
+
+
+def apri_indice(args):
+    """
+    Con --indice registra un hook che indicizza ogni .fxp scritto nel processo.
+    Restituisce l'indice (da salvare a fine esecuzione) oppure None.
+    """
+    if not args.indice:
+        return None
+    from core.indice_similarita import IndiceSimilarita
+    from output_io.writer import aggiungi_hook_fxp
+    indice = IndiceSimilarita(args.indice)
+    aggiungi_hook_fxp(indice.aggiungi)
+    return indice
+
+
+def apri_archivio(args):
+    """Con --archivio il contesto che scrive gli output nell'archivio, altrimenti un contesto vuoto."""
+    if not args.archivio:
+        from contextlib import nullcontext
+        return nullcontext()
+    from output_io.writer import scrittura_in_archivio
+    return scrittura_in_archivio(args.archivio)
+
+
+def apri_render(args):
+    """Con --render-workers il pool per le funzioni wavetable non vettorizzabili, altrimenti un contesto vuoto."""
+    if not args.render_workers:
+        from contextlib import nullcontext
+        return nullcontext()
+    from core.wavetable import rendering_parallelo
+    return rendering_parallelo(args.render_workers, "processi" if args.render_processi else "thread")
+
+
+def wavetable_da_args(args, errori: list):
+    """
+    WavetableInput dagli argomenti del gruppo Wavetable (comune a main e sweep),
+    oppure None; gli errori di formato vengono aggiunti a errori.
+    """
+    from models.input_schema import WavetableInput
+    from core.spec import parse_funzione, parse_spettro, parse_morph
+
+    try:
+        if args.funzione:
+            fn = parse_funzione(args.funzione, consenti_file=args.consenti_python)
+            return WavetableInput(funzione=fn, n_frame=args.frame)
+        if args.wav:
+            return WavetableInput(file_wav=args.wav)
+        if args.armoniche:
+            spettro = parse_spettro(args.armoniche, args.fasi, args.limite_armoniche)
+            return WavetableInput(spettro=spettro, n_frame=args.frame)
+        if args.keyframe:
+            morph = parse_morph(args.keyframe, args.morph, args.posizioni)
+            return WavetableInput(morph=morph, n_frame=args.frame)
+    except ValueError as e:
+        errori.append(str(e))
+    return None
+
+
+def controlla_obbligatori(parser: argparse.ArgumentParser, args):
+    # Non required=True in argparse: le utility (--lista-*) non li richiedono
+    mancanti = [f"--{a}" for a in ("nome", "base") if not getattr(args, a)]
+    if mancanti:
+        parser.error(f"argomenti obbligatori mancanti: {', '.join(mancanti)}")
+
+
+def imposta_cache(args):
+    if args.no_cache:
+        from core.cache_wavetable import CACHE_WAVETABLE
+        CACHE_WAVETABLE.attiva = False
+
+
 # ═══════════════════════════════════════════════════════
-# PARSING ARGOMENTI → OGGETTI
+# ENTRY POINT
 # ═══════════════════════════════════════════════════════
 
-def parse_funzione(expr: str):
-    """Converte una stringa matematica in una funzione Python/numpy."""
-    contesto = {
-        "sin": np.sin,  "cos": np.cos,  "tan": np.tan,
-        "sqrt": np.sqrt, "abs": np.abs,
-        "log": np.log,  "exp": np.exp,
-        "pi": np.pi,    "e": np.e,
-    }
+def main_batch(argv: list[str]):
+    from core.batch import esegui_manifest
+
+    args = crea_parser_batch().parse_args(argv)
+    imposta_cache(args)
+    metriche = crea_metriche(args)
+    if not os.path.exists(args.manifest):
+        print(f"\n✗ Manifest non trovato: {args.manifest}")
+        sys.exit(1)
+
+    if args.solo_validazione:
+        from core.batch import leggi_manifest, valida_manifest
+        specs = leggi_manifest(args.manifest)
+        falliti = valida_manifest((spec["_riga"], spec) for spec in specs)
+        for r in falliti:
+            print(f"  ✗ riga {r.riga} ({r.nome}): {r.errore}")
+        print(f"\n{'✅' if not falliti else '⚠'} Validazione completata: "
+              f"{len(specs) - len(falliti)}/{len(specs)} righe valide")
+        sys.exit(1 if falliti else 0)
+
+    inizio = time.perf_counter()
+    risultati = esegui_manifest(args.manifest, workers=args.workers, chunksize=args.chunksize,
+                                metriche=metriche)
+    durata = time.perf_counter() - inizio
+    chiudi_metriche(metriche, args)
+
+    # I worker scrivono in altri processi: l'indice si aggiorna dalle cartelle di output
+    if args.indice:
+        from core.batch import leggi_manifest
+        from core.indice_similarita import IndiceSimilarita
+        indice = IndiceSimilarita(args.indice)
+        cartelle = {spec.get("output") or "./output" for spec in leggi_manifest(args.manifest)}
+        aggiunti = sum(indice.aggiorna_cartella(c) for c in sorted(cartelle) if os.path.isdir(c))
+        indice.salva()
+        print(f"[OK] Indice aggiornato: {aggiunti} preset ({len(indice)} totali)")
+
+    falliti = [r for r in risultati if not r.ok]
+    for r in falliti:
+        print(f"  ✗ riga {r.riga} ({r.nome}): {r.errore}")
+    print(f"\n{'✅' if not falliti else '⚠'} Batch completato: "
+          f"{len(risultati) - len(falliti)}/{len(risultati)} preset in {durata:.2f}s")
+    sys.exit(1 if falliti else 0)
+
+
+def main_sweep(argv: list[str]):
+    from models.input_schema import PresetInput
+    from core.spec import parse_anteprima, parse_assi_sweep
+    from core.sweep import esegui_sweep
+
+    parser = crea_parser_sweep()
+    args = parser.parse_args(argv)
+    controlla_obbligatori(parser, args)
+    imposta_cache(args)
+    metriche = crea_metriche(args)
+    errori = []
+
+    wavetable = wavetable_da_args(args, errori)
+
+    try:
+        assi = parse_assi_sweep(args.mod or [], args.param or [], args.env or [])
+    except ValueError as e:
+        errori.append(str(e))
+
+    anteprima = None
+    if args.anteprima is not None:
+        try:
+            anteprima = parse_anteprima(args.anteprima)
+        except ValueError as e:
+            errori.append(str(e))
+
+    if errori:
+        print(f"\n✗ {len(errori)} errore/i negli argomenti:")
+        for e in errori:
+            print(f"  - {e}")
+        print("\nUsa sweep --help per vedere il formato corretto.")
+        sys.exit(1)
+
+    if not args.archivio:
+        os.makedirs(args.output, exist_ok=True)
+    preset = PresetInput(nome=args.nome, base_fxp=args.base, wavetable=wavetable, anteprima=anteprima)
+    preset._output_dir = args.output
+    indice = apri_indice(args)
+
+    inizio = time.perf_counter()
     try:
-        x_test = np.linspace(0, 2 * np.pi, 16)
-        eval(expr, {"__builtins__": {}}, {"x": x_test, **contesto})
-    except Exception as err:
-        raise ValueError(f"Funzione non valida '{expr}': {err}")
+        with apri_archivio(args), apri_render(args):
+            varianti = esegui_sweep(preset, assi, campioni=args.campioni, seed=args.seed,
+                                    metriche=metriche)
+    except Exception as e:
+        print(f"\n✗ Sweep fallito: {e}")
+        sys.exit(1)
+    finally:
+        chiudi_metriche(metriche, args)
+        if indice is not None:
+            indice.salva()
+    print(f"\n✅ Sweep completato: {len(varianti)} varianti in {time.perf_counter() - inizio:.2f}s")
 
-    return lambda x: eval(expr, {"__builtins__": {}}, {"x": x, **contesto})
 
+def main_serve(argv: list[str]):
+    from core.servizio import servi_socket, servi_stdin
 
-def parse_mod(raw: str) -> ModulazioneInput:
-    parti = [p.strip() for p in raw.split(",")]
-    if len(parti) != 3:
-        raise ValueError(f"--mod '{raw}': formato atteso SRC,DST,QTY  (es. LFO1,FILTER_CUTOFF,0.8)")
-    src, dst, qty_str = parti
+    args = crea_parser_serve().parse_args(argv)
+    imposta_cache(args)
     try:
-        qty = float(qty_str)
-    except ValueError:
-        raise ValueError(f"--mod '{raw}': quantità '{qty_str}' non è un numero valido")
-    return ModulazioneInput(sorgente=src, destinazione=dst, quantita=qty)
+        if args.stdin:
+            servi_stdin(workers=args.workers)
+        else:
+            servi_socket(args.socket, workers=args.workers)
+    except RuntimeError as e:
+        print(f"\n✗ {e}")
+        sys.exit(1)
+
+
+def main_client(argv: list[str]):
+    import json
+    from core.servizio import esegui
 
+    args = crea_parser_client().parse_args(argv)
+    specs = []
+    try:
+        for voce in args.spec or ["-"]:
+            if voce == "-":
+                specs += [json.loads(r) for r in sys.stdin if r.strip()]
+            elif voce.lstrip().startswith("{"):
+                specs.append(json.loads(voce))
+            elif voce.lower().endswith(".csv"):
+                from core.batch import leggi_manifest
+                specs += leggi_manifest(voce)
+            else:
+                with open(voce, encoding="utf-8") as f:
+                    specs += [json.loads(r) for r in f if r.strip() and not r.startswith("#")]
+    except (OSError, ValueError) as e:
+        print(f"\n✗ Specifica non valida: {e}")
+        sys.exit(1)
 
-def parse_param(raw: str) -> ParametroInput:
-    parti = [p.strip() for p in raw.split(",")]
-    if len(parti) != 2:
-        raise ValueError(f"--param '{raw}': formato atteso NOME,VALORE  (es. filter_cutoff,0.4)")
-    nome, val_str = parti
     try:
-        valore = float(val_str)
-    except ValueError:
-        raise ValueError(f"--param '{raw}': valore '{val_str}' non è un numero valido")
-    return ParametroInput(nome=nome, valore=valore)
+        risposte, remoto = esegui(specs, args.socket, fallback=not args.no_fallback)
+    except OSError as e:
+        print(f"\n✗ Servizio non raggiungibile: {e}")
+        sys.exit(1)
+
+    preset = 0
+    for spec, r in zip(specs, risposte):
+        if args.json:
+            print(json.dumps(r, ensure_ascii=False))
+        elif "comando" in spec:
+            # Risposte ai comandi (stato, arresta): nessun nome né output
+            dettagli = {k: v for k, v in r.items() if k not in ("id", "ok", "errore")}
+            esito = json.dumps(dettagli, ensure_ascii=False) if r["ok"] else r.get("errore")
+            print(f"  {'✓' if r['ok'] else '✗'} {spec['comando']}" + (f": {esito}" if esito and esito != "{}" else ""))
+        elif r["ok"]:
+            preset += 1
+            print(f"  ✓ {r['nome']} ({r['durata_s'] * 1e3:.1f} ms): {', '.join(r['output'])}")
+        else:
+            print(f"  ✗ {r.get('nome')}: {r['errore']}")
+    n_preset = sum("comando" not in spec for spec in specs)
+    if not args.json and n_preset:
+        print(f"\n{'servizio' if remoto else 'in locale'}: {preset}/{n_preset} preset")
+    sys.exit(0 if all(r["ok"] for r in risposte) else 1)
 
 
-def parse_env(raw: str) -> EnvelopeInput:
-    parti = [p.strip() for p in raw.split(",")]
-    if len(parti) != 5:
-        raise ValueError(f"--env '{raw}': formato atteso TARGET,A,D,S,R  (es. ENV1,0.01,0.2,0.6,0.5)")
-    target, a, d, s, r = parti
+def main_indice(argv: list[str]):
+    from core.indice_similarita import IndiceSimilarita
+
+    args = crea_parser_indice().parse_args(argv)
+    indice = IndiceSimilarita(args.indice)
+
+    if args.azione == "aggiorna":
+        cartelle = args.path or ["./output"]
+        inizio = time.perf_counter()
+        aggiunti = 0
+        for cartella in cartelle:
+            if not os.path.isdir(cartella):
+                print(f"[WARN] Cartella non trovata: {cartella}", file=sys.stderr)
+                continue
+            aggiunti += indice.aggiorna_cartella(cartella)
+        indice.salva()
+        print(f"\n✅ Indice aggiornato: {aggiunti} preset nuovi o modificati "
+              f"({len(indice)} totali) in {time.perf_counter() - inizio:.2f}s")
+
+    elif args.azione == "vicini":
+        if not args.path:
+            print("\n✗ Indicare almeno un file .fxp")
+            sys.exit(1)
+        for path in args.path:
+            with open(path, "rb") as f:
+                dati = f.read()
+            print(f"\nPreset più simili a {path}:")
+            for vicino, distanza in indice.vicini(dati, k=args.k):
+                segno = "=" if distanza <= args.soglia else " "
+                print(f"  {segno} {distanza:10.4f}  {vicino}")
+
+    else:
+        gruppi = indice.duplicati(soglia=args.soglia)
+        for gruppo in gruppi:
+            print(f"\n  {len(gruppo)} duplicati:")
+            for path in gruppo:
+                print(f"    {path}")
+        print(f"\n{len(gruppi)} gruppi di duplicati su {len(indice)} preset")
+
+
+def main_casuale(argv: list[str]):
+    from core.casuale import genera_batch, specs_da_batch, scrivi_manifest
+
+    args = crea_parser_casuale().parse_args(argv)
     try:
-        return EnvelopeInput(
-            attack=float(a), decay=float(d),
-            sustain=float(s), release=float(r),
-            target=target
-        )
-    except ValueError as err:
-        raise ValueError(f"--env '{raw}': {err}")
+        batch = genera_batch(args.numero, seed=args.seed, nome=args.nome, base=args.base,
+                             max_mod=args.max_mod, max_tempo=args.max_tempo,
+                             armoniche=args.armoniche, frame=args.frame, output=args.output)
+    except ValueError as e:
+        print(f"\n✗ {e}", file=sys.stderr)
+        sys.exit(1)
+    specs = specs_da_batch(batch)
 
+    if not args.esegui:
+        if args.manifest == "-":
+            scrivi_manifest(specs, sys.stdout)
+        else:
+            with open(args.manifest, "w", encoding="utf-8") as f:
+                n = scrivi_manifest(specs, f)
+            print(f"[OK] {n} preset casuali (seed {args.seed}) in {args.manifest}")
+        return
+
+    from core.batch import esegui_batch
+    inizio = time.perf_counter()
+    risultati = esegui_batch(specs, workers=args.workers)
+    falliti = [r for r in risultati if not r.ok]
+    for r in falliti:
+        print(f"  ✗ {r.nome}: {r.errore}")
+    print(f"\n{'✅' if not falliti else '⚠'} {len(risultati) - len(falliti)}/{len(risultati)} "
+          f"preset casuali (seed {args.seed}) in {time.perf_counter() - inizio:.2f}s")
+    sys.exit(1 if falliti else 0)
+
+
+def main_leggi(argv: list[str]):
+    from output_io.reader import leggi_batch, trova_fxp
+    from core.casuale import specs_da_batch, scrivi_manifest
+
+    args = crea_parser_leggi().parse_args(argv)
+    paths = []
+    for path in args.path:
+        if os.path.isdir(path):
+            paths.extend(sorted(trova_fxp(path, args.ricorsiva)))
+        elif os.path.isfile(path):
+            paths.append(path)
+        else:
+            print(f"[WARN] Path non trovato: {path}", file=sys.stderr)
+
+    inizio = time.perf_counter()
+    batch = leggi_batch(paths)
+    batch.output_dir = [args.output] * len(batch)
+    if args.manifest == "-":
+        scrivi_manifest(specs_da_batch(batch), sys.stdout)
+        return
+    with open(args.manifest, "w", encoding="utf-8") as f:
+        n = scrivi_manifest(specs_da_batch(batch), f)
+    print(f"[OK] {n} preset letti in {time.perf_counter() - inizio:.2f}s → {args.manifest}")
+
+
+def main_anteprima(argv: list[str]):
+    from models.input_schema import AnteprimaInput
+    from core.validator import valida_anteprima
+
+    args = crea_parser_anteprima().parse_args(argv)
+    impostazioni = AnteprimaInput(nota=args.nota, durata=args.durata, rate=args.rate)
+    errori = valida_anteprima(impostazioni)
+    if errori:
+        print(f"\n✗ {'; '.join(errori)}")
+        sys.exit(1)
+
+    paths = []
+    for path in args.path:
+        if os.path.isdir(path):
+            paths.extend(sorted(os.path.join(path, f) for f in os.listdir(path)
+                                if f.lower().endswith(".wav") and not f.endswith("_anteprima.wav")))
+        elif os.path.isfile(path):
+            paths.append(path)
+        else:
+            print(f"[WARN] Path non trovato: {path}", file=sys.stderr)
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    from core.anteprima import anteprime_da_file
+    from output_io.writer import ScrittoreAsincrono
+
+    inizio = time.perf_counter()
+    n = 0
+    with ScrittoreAsincrono(fsync=False) as scrittore:
+        for path, audio in anteprime_da_file(paths, impostazioni):
+            radice = os.path.splitext(os.path.basename(path))[0].removesuffix("_wavetable")
+            destinazione = os.path.join(args.output or os.path.dirname(path), f"{radice}_anteprima.wav")
+            scrittore.invia_wav(destinazione, audio, impostazioni.rate)
+            n += 1
+    durata = time.perf_counter() - inizio
+    audio_s = n * impostazioni.durata
+    print(f"[OK] {n} anteprime ({audio_s:.0f}s di audio) in {durata:.2f}s"
+          + (f", {audio_s / durata:.0f}× il tempo reale" if n and durata > 0 else ""))
+
+
+COMANDI = {
+    "batch": main_batch,
+    "sweep": main_sweep,
+    "indice": main_indice,
+    "serve": main_serve,
+    "client": main_client,
+    "casuale": main_casuale,
+    "leggi": main_leggi,
+    "anteprima": main_anteprima,
+}
+
+
+UTILITY = {
+    "--lista-sorgenti": stampa_sorgenti,
+    "--lista-destinazioni": stampa_destinazioni,
+}
 
-# ═══════════════════════════════════════════════════════
-# ENTRY POINT
-# ═══════════════════════════════════════════════════════
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMANDI:
+        COMANDI[sys.argv[1]](sys.argv[2:])
+        return
+
+    # Utility da sola: nessun parser da costruire
+    if len(sys.argv) == 2 and sys.argv[1] in UTILITY:
+        UTILITY[sys.argv[1]]()
+        sys.exit(0)
+
     parser = crea_parser()
     args = parser.parse_args()
+    imposta_cache(args)
 
     # Comandi utility — escono subito
     if args.lista_sorgenti:
@@ -267,19 +1047,15 @@ def main():
     if args.lista_destinazioni:
         stampa_destinazioni()
         sys.exit(0)
+    controlla_obbligatori(parser, args)
+
+    from models.input_schema import PresetInput
+    from core.spec import parse_mod, parse_param, parse_env, parse_anteprima
 
     errori = []
 
     # Wavetable
-    wavetable = None
-    if args.funzione:
-        try:
-            fn = parse_funzione(args.funzione)
-            wavetable = WavetableInput(funzione=fn, n_frame=args.frame)
-        except ValueError as e:
-            errori.append(str(e))
-    elif args.wav:
-        wavetable = WavetableInput(file_wav=args.wav)
+    wavetable = wavetable_da_args(args, errori)
 
     # Modulazioni
     modulazioni = []
@@ -305,6 +1081,14 @@ def main():
         except ValueError as e:
             errori.append(str(e))
 
+    # Anteprima audio
+    anteprima = None
+    if args.anteprima is not None:
+        try:
+            anteprima = parse_anteprima(args.anteprima)
+        except ValueError as e:
+            errori.append(str(e))
+
     # Mostra tutti gli errori insieme
     if errori:
         print(f"\n✗ {len(errori)} errore/i negli argomenti:")
@@ -313,9 +1097,6 @@ def main():
         print("\nUsa --help per vedere il formato corretto.")
         sys.exit(1)
 
-    # Imposta cartella output
-    os.makedirs(args.output, exist_ok=True)
-
     # Costruisce PresetInput e avvia pipeline
     preset = PresetInput(
         nome=args.nome,
@@ -324,15 +1105,40 @@ def main():
         modulazioni=modulazioni,
         parametri=parametri,
         envelopes=envelopes,
+        anteprima=anteprima,
     )
 
     preset._output_dir = args.output
 
+    if args.solo_validazione:
+        from core.validator import valida_input
+        try:
+            valida_input(preset)
+        except ValueError as e:
+            print(f"\n✗ {e}")
+            sys.exit(1)
+        print("✅ Input validi.")
+        sys.exit(0)
+
+    # Imposta cartella output
+    if not args.archivio:
+        os.makedirs(args.output, exist_ok=True)
+
+    # La pipeline (e numpy/scipy, solo se servono) si carica solo qui
+    from core.pipeline import esegui_pipeline
+
+    metriche = crea_metriche(args)
+    indice = apri_indice(args)
     try:
-        esegui_pipeline(preset)
+        with apri_archivio(args), apri_render(args):
+            esegui_pipeline(preset, verbose=not args.quiet, metriche=metriche)
     except Exception as e:
         print(f"\n✗ Pipeline fallita: {e}")
         sys.exit(1)
+    finally:
+        chiudi_metriche(metriche, args)
+        if indice is not None:
+            indice.salva()
 
 
 if __name__ == "__main__":
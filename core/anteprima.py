@@ -0,0 +1,149 @@
+"""
+Anteprima audio delle wavetable, per ascoltare un batch senza aprire Serum.
+Un oscillatore wavetable suona la nota richiesta per la durata indicata,
+percorrendo i frame dal primo all'ultimo. Per ogni campione di uscita:
+  - fase   = n · f / rate (mod 1), in forma chiusa su tutto il vettore
+  - frame  = posizione lungo la durata, interpolata tra due frame vicini
+  - valore = interpolazione lineare nella fase su entrambi i frame, poi crossfade
+Prima della lettura ogni frame è limitato in banda (una irfft per tabella)
+alle armoniche sotto Nyquist alla frequenza suonata, per evitare aliasing.
+Nessun ciclo per campione: gli indici sono calcolati una volta per durata
+e nota, poi applicati a blocchi di tabelle con lo stesso numero di frame.
+"""
+
+from typing import Iterable, Iterator, Optional, Sequence
+
+import numpy as np
+
+from models.input_schema import PresetInput, AnteprimaInput
+from core.memo import stadio
+from core.metriche import conta
+from core.wavetable import FRAME_SIZE, _da_file
+
+DISSOLVENZA_S = 0.005   # fade-in/out contro i click
+PICCO = 0.9             # ampiezza massima dell'anteprima
+BLOCCO_TABELLE = 16     # tabelle interpolate insieme (limita la memoria temporanea)
+BLOCCO_FILE = 256       # wavetable .wav tenute in memoria insieme da anteprime_da_file
+
+
+@stadio(dipende_da=("wavetable", "anteprima"), produce=("_anteprima",))
+def renderizza_anteprima(preset: PresetInput) -> PresetInput:
+    """
+    Stadio 2b della pipeline (solo con preset.anteprima).
+    Dai frame prodotti da risolvi_wavetable calcola l'anteprima audio
+    e la salva in preset._anteprima; la scrive scrivi_output.
+    """
+    if preset.anteprima is None or preset.wavetable is None or preset.wavetable.campioni is None:
+        return preset
+    preset._anteprima = renderizza_batch([preset.wavetable.campioni], preset.anteprima)[0]
+    return preset
+
+
+def frequenza_nota(nota: float) -> float:
+    """Frequenza in Hz di una nota MIDI (69 = A4 = 440 Hz)."""
+    return 440.0 * 2.0 ** ((nota - 69.0) / 12.0)
+
+
+def renderizza_batch(tabelle: Sequence[np.ndarray],
+                     impostazioni: Optional[AnteprimaInput] = None) -> list[np.ndarray]:
+    """
+    Anteprime (float32 mono) di molte wavetable con le stesse impostazioni.
+    Ogni tabella è un vettore di n_frame · FRAME_SIZE campioni (come
+    WavetableInput.campioni); le tabelle con lo stesso numero di frame
+    vengono renderizzate insieme.
+    """
+    impostazioni = impostazioni or AnteprimaInput()
+    frequenza = frequenza_nota(impostazioni.nota)
+    n_campioni = max(1, int(round(impostazioni.durata * impostazioni.rate)))
+    max_armonica = max(1, min(FRAME_SIZE // 2, int(impostazioni.rate / 2 // frequenza)))
+    fase = _fase(n_campioni, frequenza, impostazioni.rate)
+    inviluppo = _inviluppo(n_campioni, impostazioni.rate)
+
+    gruppi: dict[int, list[int]] = {}
+    for i, tabella in enumerate(tabelle):
+        gruppi.setdefault(len(tabella) // FRAME_SIZE, []).append(i)
+
+    risultati: list = [None] * len(tabelle)
+    for n_frame, indici in gruppi.items():
+        posizioni = _posizioni(n_frame, fase, n_campioni)
+        for inizio in range(0, len(indici), BLOCCO_TABELLE):
+            blocco = indici[inizio:inizio + BLOCCO_TABELLE]
+            frames = np.stack([np.asarray(tabelle[i], dtype=np.float32)[:n_frame * FRAME_SIZE]
+                               for i in blocco]).reshape(len(blocco), n_frame, FRAME_SIZE)
+            audio = _leggi(_limita_banda(frames, max_armonica), posizioni)
+            audio *= inviluppo
+            picchi = np.max(np.abs(audio), axis=1, keepdims=True)
+            audio *= PICCO / np.maximum(picchi, PICCO)  # riduce solo ciò che supera PICCO
+            for i, riga in zip(blocco, audio):
+                risultati[i] = riga
+    conta("campioni_anteprima", n_campioni * len(tabelle))
+    return risultati
+
+
+def anteprime_da_file(paths: Iterable[str],
+                      impostazioni: Optional[AnteprimaInput] = None) -> Iterator[tuple[str, np.ndarray]]:
+    """
+    (path, anteprima) per ogni wavetable .wav, letta come fa risolvi_wavetable.
+    I file sono caricati e renderizzati a gruppi di BLOCCO_FILE.
+    """
+    paths = list(paths)
+    for inizio in range(0, len(paths), BLOCCO_FILE):
+        gruppo = paths[inizio:inizio + BLOCCO_FILE]
+        yield from zip(gruppo, renderizza_batch([_da_file(p) for p in gruppo], impostazioni))
+
+
+def _fase(n_campioni: int, frequenza: float, rate: int) -> np.ndarray:
+    """Fase (0 – 1) di ogni campione: l'accumulo n · f/rate calcolato in un colpo."""
+    return np.mod(np.arange(n_campioni, dtype=np.float64) * (frequenza / rate), 1.0)
+
+
+def _posizioni(n_frame: int, fase: np.ndarray, n_campioni: int) -> tuple:
+    """
+    Indici e pesi di lettura, uguali per tutte le tabelle con n_frame frame:
+    (indici nella tabella appiattita dei 4 punti, peso nella fase, peso tra i frame).
+    """
+    posizione = np.linspace(0.0, n_frame - 1, n_campioni) if n_campioni > 1 else np.zeros(1)
+    frame_a = np.minimum(posizione.astype(np.intp), max(n_frame - 2, 0))
+    frame_b = np.minimum(frame_a + 1, n_frame - 1)
+    peso_frame = (posizione - frame_a).astype(np.float32)
+
+    indice = fase * FRAME_SIZE
+    campione_a = indice.astype(np.intp) % FRAME_SIZE
+    campione_b = (campione_a + 1) % FRAME_SIZE
+    peso_fase = (indice - np.floor(indice)).astype(np.float32)
+
+    punti = (frame_a * FRAME_SIZE + campione_a, frame_a * FRAME_SIZE + campione_b,
+             frame_b * FRAME_SIZE + campione_a, frame_b * FRAME_SIZE + campione_b)
+    return punti, peso_fase, peso_frame
+
+
+def _leggi(frames: np.ndarray, posizioni: tuple) -> np.ndarray:
+    """Lettura interpolata (bilineare: fase × frame) di un blocco di tabelle."""
+    (aa, ab, ba, bb), peso_fase, peso_frame = posizioni
+    piatte = frames.reshape(len(frames), -1)
+    a = piatte[:, aa]
+    a += peso_fase * (piatte[:, ab] - a)
+    b = piatte[:, ba]
+    b += peso_fase * (piatte[:, bb] - b)
+    a += peso_frame * (b - a)
+    return a
+
+
+def _limita_banda(frames: np.ndarray, max_armonica: int) -> np.ndarray:
+    """Azzera le armoniche oltre max_armonica in tutti i frame (una sola rfft/irfft)."""
+    if max_armonica >= FRAME_SIZE // 2:
+        return frames
+    spettri = np.fft.rfft(frames, axis=-1)
+    spettri[..., max_armonica + 1:] = 0.0
+    return np.fft.irfft(spettri, n=FRAME_SIZE, axis=-1).astype(np.float32)
+
+
+def _inviluppo(n_campioni: int, rate: int) -> np.ndarray:
+    """1 ovunque, con rampe lineari di DISSOLVENZA_S all'inizio e alla fine."""
+    inviluppo = np.ones(n_campioni, dtype=np.float32)
+    n = min(int(DISSOLVENZA_S * rate), n_campioni // 2)
+    if n > 0:
+        rampa = np.linspace(0.0, 1.0, n, endpoint=False, dtype=np.float32)
+        inviluppo[:n] = rampa
+        inviluppo[n_campioni - n:] = rampa[::-1]
+    return inviluppo
@@ -0,0 +1,199 @@
+"""
+Esecuzione batch della pipeline.
+Legge un manifest (JSONL o CSV) di specifiche di preset e le distribuisce
+su un ProcessPoolExecutor, a blocchi di chunksize righe. In ogni blocco la
+scrittura su disco avviene in background, in parallelo al calcolo dei preset
+successivi. Un errore su una riga non ferma il batch: ogni preset produce il
+proprio RisultatoBatch.
+Prima di creare il pool l'intero manifest viene validato in un colpo solo
+(valida_batch): le righe non valide falliscono subito, senza arrivare ai worker,
+e le altre saltano lo stadio valida_input.
+"""
+
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Iterable, Optional
+
+from core.spec import preset_da_spec
+from core.cache_base import CACHE_BASE
+from core.pipeline import esegui_stadi, PIPELINE
+from core.memo import CACHE_STADI
+from core.validator import valida_input, valida_batch
+from core.metriche import Metriche
+from core.console import silenzioso
+from output_io.writer import scrittura_in_background
+
+# Stadi eseguiti nei worker: la validazione è già avvenuta nel processo principale
+_STADI_VALIDATI = [s for s in PIPELINE if s is not valida_input]
+
+
+@dataclass
+class RisultatoBatch:
+    """Esito dell'esecuzione di una singola riga del manifest."""
+    riga: int                              # numero di riga nel manifest (da 1)
+    nome: str
+    ok: bool
+    errore: Optional[str] = None
+    durata: float = 0.0                    # secondi
+    metriche: list[dict] = field(default_factory=list)  # record per stadio, se richiesti
+
+
+def leggi_manifest(path: str) -> list[dict]:
+    """
+    Legge un manifest di preset.
+    - .jsonl / .json: un oggetto JSON per riga (righe vuote e '#' ignorate)
+    - .csv: intestazione con le chiavi della specifica; i campi ripetibili
+      (mod, param, env) contengono più valori separati da ';'
+    Ogni specifica riceve in "_riga" il suo numero di riga nel file, usato
+    da esegui_batch per i RisultatoBatch.
+    """
+    _, ext = os.path.splitext(path)
+    if ext.lower() == ".csv":
+        with open(path, newline="", encoding="utf-8") as f:
+            lettore = csv.DictReader(f)
+            return [dict({k: v for k, v in riga.items() if v not in (None, "")}, _riga=lettore.line_num)
+                    for riga in lettore]
+
+    specs = []
+    with open(path, encoding="utf-8") as f:
+        for n, riga in enumerate(f, 1):
+            riga = riga.strip()
+            if not riga or riga.startswith("#"):
+                continue
+            try:
+                spec = json.loads(riga)
+            except json.JSONDecodeError as err:
+                # La riga resta nel batch e fallirà con un errore leggibile
+                specs.append({"_errore": f"JSON non valido alla riga {n}: {err}", "_riga": n})
+                continue
+            if not isinstance(spec, dict):
+                specs.append({"_errore": f"Riga {n}: atteso un oggetto JSON, trovato {type(spec).__name__}",
+                              "_riga": n})
+                continue
+            spec["_riga"] = n
+            specs.append(spec)
+    return specs
+
+
+def esegui_batch(specs: Iterable[dict], workers: Optional[int] = None,
+                 chunksize: int = 8, metriche: Optional[Metriche] = None) -> list[RisultatoBatch]:
+    """
+    Esegue la pipeline per ogni specifica.
+    workers=None usa tutti i core disponibili, workers=1 esegue nel processo corrente.
+    I risultati sono restituiti nello stesso ordine del manifest.
+    Con metriche, i record per stadio misurati nei worker vengono raccolti lì.
+    """
+    # Numero di riga dal manifest (leggi_manifest), altrimenti la posizione nella sequenza
+    lavori = [(spec.get("_riga", i), spec) for i, spec in enumerate(specs, 1)]
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    _precarica_basi(spec for _, spec in lavori)
+    scartati = {r.riga: r for r in valida_manifest(lavori)}
+    lavori = [lavoro for lavoro in lavori if lavoro[0] not in scartati]
+
+    chunksize = max(1, chunksize)
+    blocchi = [lavori[i:i + chunksize] for i in range(0, len(lavori), chunksize)]
+    esegui = partial(_esegui_blocco, misura=metriche is not None,
+                     memoria=metriche is not None and metriche.memoria)
+    if workers <= 1 or len(blocchi) <= 1:
+        risultati = [r for blocco in blocchi for r in esegui(blocco)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            risultati = [r for parziali in pool.map(esegui, blocchi) for r in parziali]
+    if scartati:
+        risultati = sorted(risultati + list(scartati.values()), key=lambda r: r.riga)
+
+    if metriche is not None:
+        for r in risultati:
+            metriche.aggiungi(r.metriche)
+    return risultati
+
+
+def esegui_manifest(path: str, workers: Optional[int] = None, chunksize: int = 8,
+                    metriche: Optional[Metriche] = None) -> list[RisultatoBatch]:
+    """Scorciatoia: leggi_manifest + esegui_batch."""
+    return esegui_batch(leggi_manifest(path), workers=workers, chunksize=chunksize,
+                        metriche=metriche)
+
+
+def valida_manifest(lavori: Iterable[tuple[int, dict]]) -> list[RisultatoBatch]:
+    """
+    Valida tutte le righe (numero di riga, specifica) insieme e restituisce
+    un RisultatoBatch fallito per ogni riga non valida, senza eseguire nulla.
+    """
+    falliti, presets, righe = [], [], []
+    for riga, spec in lavori:
+        nome = str(spec.get("nome", f"riga_{riga}"))
+        try:
+            if "_errore" in spec:
+                raise ValueError(spec["_errore"])
+            presets.append(preset_da_spec(spec))
+            righe.append((riga, nome))
+        except Exception as e:
+            falliti.append(RisultatoBatch(riga, nome, False, str(e)))
+
+    for i, errori in valida_batch(presets).items():
+        riga, nome = righe[i]
+        falliti.append(RisultatoBatch(riga, nome, False, "Errori di validazione:\n"
+                                      + "\n".join(f"  - {e}" for e in errori)))
+    return sorted(falliti, key=lambda r: r.riga)
+
+
+def _precarica_basi(specs: Iterable[dict]):
+    """
+    Legge ogni file base una volta nel processo principale, prima di creare il pool:
+    i worker (fork) ereditano la cache già piena invece di rileggere i file.
+    """
+    for base in {spec.get("base") for spec in specs if isinstance(spec.get("base"), str)}:
+        try:
+            CACHE_BASE.leggi(base)
+        except OSError:
+            pass  # l'errore verrà riportato dalla validazione della riga
+
+
+def _esegui_blocco(blocco: list[tuple[int, dict]], misura: bool = False,
+                   memoria: bool = False) -> list[RisultatoBatch]:
+    """
+    Eseguito nei processi worker: calcola i preset del blocco mentre i thread
+    di scrittura salvano quelli già pronti. Non propaga mai eccezioni.
+    """
+    esiti = []
+    with silenzioso(), scrittura_in_background():
+        for lavoro in blocco:
+            esiti.append(_esegui_spec(lavoro, misura, memoria))
+
+    # Le scritture sono terminate: un errore di I/O rende fallita la riga
+    risultati = []
+    for risultato, scritture in esiti:
+        for futura in scritture:
+            errore = futura.exception()
+            if errore is not None and risultato.ok:
+                risultato.ok = False
+                risultato.errore = f"scrittura fallita: {errore}"
+        risultati.append(risultato)
+    return risultati
+
+
+def _esegui_spec(lavoro: tuple[int, dict], misura: bool = False,
+                 memoria: bool = False) -> tuple[RisultatoBatch, list]:
+    riga, spec = lavoro
+    nome = str(spec.get("nome", f"riga_{riga}"))
+    metriche = Metriche(memoria=memoria) if misura else None
+    inizio = time.perf_counter()
+    try:
+        if "_errore" in spec:
+            raise ValueError(spec["_errore"])
+        # La riga è già stata validata da valida_manifest
+        preset = esegui_stadi(preset_da_spec(spec), _STADI_VALIDATI, cache=CACHE_STADI,
+                              metriche=metriche)
+    except Exception as e:
+        return RisultatoBatch(riga, nome, False, str(e), time.perf_counter() - inizio,
+                              metriche.record if metriche else []), []
+    return RisultatoBatch(riga, nome, True, None, time.perf_counter() - inizio,
+                          metriche.record if metriche else []), preset._scritture
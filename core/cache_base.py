@@ -0,0 +1,74 @@
+"""
+Cache in memoria dei file .fxp base.
+Ogni base viene letta una sola volta e indicizzata per (path, mtime, dimensione):
+se il file cambia su disco la voce vecchia non viene più usata.
+Ogni preset riceve una copia bytearray da modificare, la versione in cache
+resta immutabile. Le voci meno usate vengono scartate oltre max_bytes.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from core.metriche import conta
+
+
+class CacheBase:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hit = 0
+        self.miss = 0
+        self._voci: OrderedDict[tuple, bytes] = OrderedDict()
+        self._occupati = 0
+        self._lock = threading.Lock()
+
+    def leggi(self, path: str) -> bytes:
+        """Restituisce il contenuto (immutabile) del file base."""
+        st = os.stat(path)
+        chiave = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+        with self._lock:
+            dati = self._voci.get(chiave)
+            if dati is not None:
+                self._voci.move_to_end(chiave)
+                self.hit += 1
+                return dati
+
+        with open(path, "rb") as f:
+            dati = f.read()
+        conta("bytes_letti", len(dati))
+
+        with self._lock:
+            self.miss += 1
+            self._scarta_versioni(chiave[0])
+            self._voci[chiave] = dati
+            self._occupati += len(dati)
+            self._libera()
+        return dati
+
+    def copia(self, path: str) -> bytearray:
+        """Copia modificabile del file base, da patchare per un singolo preset."""
+        return bytearray(self.leggi(path))
+
+    def svuota(self):
+        with self._lock:
+            self._voci.clear()
+            self._occupati = 0
+
+    def __len__(self) -> int:
+        return len(self._voci)
+
+    def _scarta_versioni(self, path_assoluto: str):
+        """Rimuove le versioni precedenti dello stesso file (mtime/size diversi)."""
+        for chiave in [k for k in self._voci if k[0] == path_assoluto]:
+            self._occupati -= len(self._voci.pop(chiave))
+
+    def _libera(self):
+        # Tiene sempre almeno la voce appena inserita, anche se supera il limite
+        while self._occupati > self.max_bytes and len(self._voci) > 1:
+            _, dati = self._voci.popitem(last=False)
+            self._occupati -= len(dati)
+
+
+# Cache condivisa dal processo: la usano assembla_fxp e le esecuzioni batch
+CACHE_BASE = CacheBase()
@@ -0,0 +1,150 @@
+"""
+Cache su disco delle wavetable risolte, indicizzata per contenuto della sorgente:
+  - espressione compilata (testo normalizzato) + n_frame
+  - hash del file .wav
+  - ampiezze/fasi dello spettro (matrici o testo delle espressioni) + n_frame
+  - frame chiave del morph (espressioni, array, hash dei .wav) + modo + n_frame
+  - hash dell'array di campioni
+I frame sono salvati come .npy e riletti tramite memory-map.
+Oltre max_bytes vengono eliminati i file usati meno di recente (mtime).
+"""
+
+import hashlib
+import os
+import uuid
+from typing import Optional
+
+import numpy as np
+
+from models.input_schema import WavetableInput
+from core.memo import _aggiorna
+
+# Da incrementare se cambia il modo in cui i frame vengono calcolati
+VERSIONE_FORMATO = 1
+
+CARTELLA_DEFAULT = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+    "serum_builder", "wavetable",
+)
+
+
+class CacheWavetable:
+    def __init__(self, cartella: Optional[str] = None, max_bytes: int = 512 * 1024 * 1024,
+                 attiva: bool = True):
+        self.cartella = cartella or os.environ.get("SERUM_BUILDER_CACHE", CARTELLA_DEFAULT)
+        self.max_bytes = max_bytes
+        self.attiva = attiva and not os.environ.get("SERUM_BUILDER_NO_CACHE")
+        self.hit = 0
+        self.miss = 0
+        self._hash_file: dict[tuple, str] = {}
+
+    def chiave(self, wt: WavetableInput, frame_size: int) -> Optional[str]:
+        """
+        Hash del contenuto della sorgente, oppure None se la sorgente non è
+        identificabile (es. una lambda Python qualsiasi) e quindi non va in cache.
+        """
+        h = hashlib.sha256(f"v{VERSIONE_FORMATO}:{frame_size}:".encode())
+        if wt.funzione is not None:
+            testo = getattr(wt.funzione, "testo", None)
+            if testo is None:
+                return None
+            h.update(f"funzione:{testo}:{wt.n_frame}".encode())
+        elif wt.campioni is not None:
+            campioni = np.ascontiguousarray(wt.campioni)
+            h.update(f"campioni:{campioni.dtype.str}:{campioni.shape}:".encode())
+            h.update(memoryview(campioni).cast("B"))
+        elif wt.file_wav:
+            h.update(f"wav:{self._hash_wav(wt.file_wav)}".encode())
+        elif wt.spettro is not None:
+            h.update(f"spettro:{wt.n_frame}:".encode())
+            if not _aggiorna(h, wt.spettro):
+                return None
+        elif wt.morph is not None:
+            h.update(f"morph:{wt.n_frame}:{wt.morph.modo}:".encode())
+            if not _aggiorna(h, wt.morph.posizioni):
+                return None
+            for chiave in wt.morph.chiavi:
+                if isinstance(chiave, str):  # riferimento a un .wav: conta il contenuto
+                    path, _, selezione = chiave.partition("#")
+                    h.update(f"wav:{self._hash_wav(path)}#{selezione};".encode())
+                elif not _aggiorna(h, chiave):
+                    return None
+        else:
+            return None
+        return h.hexdigest()
+
+    def leggi(self, chiave: str) -> Optional[np.ndarray]:
+        if not self.attiva:
+            return None
+        path = self._path(chiave)
+        try:
+            frames = np.load(path, mmap_mode="r")
+            os.utime(path)  # aggiorna il "recente" per l'LRU
+        except (OSError, ValueError):
+            self.miss += 1
+            return None
+        self.hit += 1
+        return frames
+
+    def scrivi(self, chiave: str, frames: np.ndarray):
+        if not self.attiva:
+            return
+        os.makedirs(self.cartella, exist_ok=True)
+        path = self._path(chiave)
+        temporaneo = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temporaneo, "wb") as f:
+                np.save(f, frames)
+            os.replace(temporaneo, path)  # atomico: nessun lettore vede un file a metà
+        except OSError:
+            if os.path.exists(temporaneo):
+                os.remove(temporaneo)
+            return
+        self._libera()
+
+    def svuota(self):
+        for voce in self._voci():
+            try:
+                os.remove(voce.path)
+            except OSError:
+                pass
+
+    def _path(self, chiave: str) -> str:
+        return os.path.join(self.cartella, f"{chiave}.npy")
+
+    def _hash_wav(self, path: str) -> str:
+        """Hash del file, memorizzato per (path, mtime, dimensione) nel processo."""
+        st = os.stat(path)
+        chiave = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+        if chiave not in self._hash_file:
+            h = hashlib.sha256()
+            with open(path, "rb") as f:
+                for blocco in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(blocco)
+            self._hash_file[chiave] = h.hexdigest()
+        return self._hash_file[chiave]
+
+    def _voci(self) -> list:
+        try:
+            return [v for v in os.scandir(self.cartella)
+                    if v.is_file() and v.name.endswith(".npy")]
+        except OSError:
+            return []
+
+    def _libera(self):
+        voci = [(v, v.stat()) for v in self._voci()]
+        occupati = sum(st.st_size for _, st in voci)
+        if occupati <= self.max_bytes:
+            return
+        for voce, st in sorted(voci, key=lambda x: x[1].st_mtime):
+            try:
+                os.remove(voce.path)
+            except OSError:
+                continue
+            occupati -= st.st_size
+            if occupati <= self.max_bytes:
+                break
+
+
+# Cache condivisa dal processo, usata da risolvi_wavetable
+CACHE_WAVETABLE = CacheWavetable()
@@ -0,0 +1,164 @@
+"""
+Generatore di preset casuali, per esplorare il suono e per collaudare la
+pipeline con input sempre diversi.
+Tutte le estrazioni avvengono su array interi da un numpy.random.Generator
+con seed, in un ordine fisso: a parità di argomenti lo stesso seed produce
+sempre gli stessi preset. Per ogni preset:
+  - da 0 a max_mod collegamenti sorgente→destinazione, senza coppie ripetute
+  - ogni parametro mappato nel layout, con valore in [0, 1]
+  - ogni envelope mappato, con attack/decay/release in [0, max_tempo] e sustain in [0, 1]
+  - con armoniche=K, una wavetable additiva di K armoniche (decadimento 1/k^p casuale)
+I range sono quelli controllati da core/validator.py: i preset sono sempre validi.
+"""
+
+import json
+from typing import Iterable, Iterator, Optional, TextIO
+
+import numpy as np
+
+from models.input_schema import WavetableInput, SpettroInput
+from models.preset_batch import (
+    PresetBatch, Vocabolario, DTYPE_MODULAZIONI, DTYPE_PARAMETRI, DTYPE_ENVELOPES,
+)
+from maps.sources import SORGENTI
+from maps.destinations import DESTINAZIONI
+from core.modulation import MAX_SLOT, OFFSET_PARAMETRI, OFFSET_ENVELOPE
+from core.wavetable import MAX_ARMONICHE
+
+NOMI_SORGENTI = list(SORGENTI)
+NOMI_DESTINAZIONI = list(DESTINAZIONI)
+NOMI_PARAMETRI = sorted(OFFSET_PARAMETRI)
+TARGET_ENVELOPE = sorted(OFFSET_ENVELOPE)
+N_COPPIE = len(NOMI_SORGENTI) * len(NOMI_DESTINAZIONI)
+
+
+def genera_batch(n: int, seed: int = 0, nome: str = "Casuale", base: str = "base.fxp",
+                 max_mod: int = 8, max_tempo: float = 1.0, armoniche: int = 0,
+                 frame: int = 8, output: Optional[str] = None) -> PresetBatch:
+    """N preset casuali come PresetBatch (nomi '<nome>_000000', '<nome>_000001', ...)."""
+    if not 0 <= max_mod <= min(MAX_SLOT, N_COPPIE):
+        raise ValueError(f"max_mod deve essere tra 0 e {min(MAX_SLOT, N_COPPIE)} (ricevuto {max_mod})")
+    if max_tempo < 0:
+        raise ValueError(f"max_tempo non può essere negativo (ricevuto {max_tempo})")
+    if not 0 <= armoniche <= MAX_ARMONICHE:
+        raise ValueError(f"armoniche deve essere tra 0 e {MAX_ARMONICHE} (ricevuto {armoniche})")
+    if armoniche and not 1 <= frame <= 256:
+        raise ValueError(f"frame deve essere tra 1 e 256 (ricevuto {frame})")
+    rng = np.random.default_rng(seed)
+    indici = np.arange(n, dtype=np.int32)
+
+    # Vocabolario fisso (i target degli envelope sono anche sorgenti: stesso codice)
+    voc = Vocabolario()
+    codici_sorgente, codici_destinazione, codici_parametro, codici_target = (
+        np.array([voc.codice(x) for x in nomi], dtype=np.int32)
+        for nomi in (NOMI_SORGENTI, NOMI_DESTINAZIONI, NOMI_PARAMETRI, TARGET_ENVELOPE))
+
+    # Modulazioni: le prime n_mod[i] coppie distinte di ogni preset
+    n_mod = rng.integers(0, max_mod + 1, size=n)
+    coppie = _coppie_distinte(rng, n, max_mod)
+    usate = np.arange(max_mod) < n_mod[:, None]
+    coppie = coppie[usate]
+    mod = np.empty(len(coppie), dtype=DTYPE_MODULAZIONI)
+    mod["preset"] = np.repeat(indici, n_mod)
+    mod["sorgente"] = codici_sorgente[coppie // len(NOMI_DESTINAZIONI)]
+    mod["destinazione"] = codici_destinazione[coppie % len(NOMI_DESTINAZIONI)]
+    mod["quantita"] = rng.uniform(-1.0, 1.0, size=len(coppie))
+    mod["aux"] = 0
+
+    # Parametri: tutti quelli mappati, per ogni preset
+    par = np.empty(n * len(NOMI_PARAMETRI), dtype=DTYPE_PARAMETRI)
+    par["preset"] = np.repeat(indici, len(NOMI_PARAMETRI))
+    par["nome"] = np.tile(codici_parametro, n)
+    par["valore"] = rng.random(len(par))
+
+    # Envelope: attack, decay, release in [0, max_tempo], sustain in [0, 1]
+    env = np.empty(n * len(TARGET_ENVELOPE), dtype=DTYPE_ENVELOPES)
+    env["preset"] = np.repeat(indici, len(TARGET_ENVELOPE))
+    env["target"] = np.tile(codici_target, n)
+    adsr = rng.random((len(env), 4))
+    env["attack"], env["decay"], env["release"] = (adsr[:, :3] * max_tempo).T
+    env["sustain"] = adsr[:, 3]
+
+    wavetable = [None] * n
+    if armoniche:
+        ampiezze = _spettri(rng, n, armoniche)
+        wavetable = [WavetableInput(spettro=SpettroInput(ampiezze=a), n_frame=frame) for a in ampiezze]
+
+    return PresetBatch(
+        nomi=[f"{nome}_{i:06d}" for i in range(n)],
+        basi=[base] * n,
+        modulazioni=mod,
+        parametri=par,
+        envelopes=env,
+        vocabolario=voc,
+        wavetable=wavetable,
+        output_dir=[output] * n,
+    )
+
+
+def specs_da_batch(batch: PresetBatch) -> Iterator[dict]:
+    """
+    Righe di manifest (stesse chiavi di core.spec.preset_da_spec) per ogni preset del batch.
+    mod, param ed env sono nella forma a dizionario (nessuna stringa da formattare
+    né da rileggere); in JSON i float mantengono tutte le cifre, quindi rileggendo
+    il manifest si ottengono gli stessi valori.
+    """
+    nomi = batch.vocabolario.nomi
+    mod = [{"sorgente": nomi[s], "destinazione": nomi[d], "quantita": q, "aux": nomi[a]}
+           for _, s, d, q, a in batch.modulazioni.tolist()]
+    par = [{"nome": nomi[p], "valore": v} for _, p, v in batch.parametri.tolist()]
+    env = [{"target": nomi[t], "attack": a, "decay": d, "sustain": s, "release": r}
+           for _, t, a, d, s, r in batch.envelopes.tolist()]
+    inizi = [np.concatenate([[0], np.cumsum(batch.conteggi(t))]).tolist()
+             for t in ("modulazioni", "parametri", "envelopes")]
+
+    for i in range(len(batch)):
+        spec = {"nome": batch.nomi[i], "base": batch.basi[i]}
+        wt = batch.wavetable[i]
+        if wt is not None and wt.spettro is not None:
+            spec["armoniche"] = np.asarray(wt.spettro.ampiezze).tolist()
+            spec["frame"] = wt.n_frame
+        spec["mod"] = mod[inizi[0][i]:inizi[0][i + 1]]
+        spec["param"] = par[inizi[1][i]:inizi[1][i + 1]]
+        spec["env"] = env[inizi[2][i]:inizi[2][i + 1]]
+        if batch.output_dir[i]:
+            spec["output"] = batch.output_dir[i]
+        yield spec
+
+
+def scrivi_manifest(specs: Iterable[dict], f: TextIO) -> int:
+    """Scrive le specifiche come JSONL; restituisce quante righe."""
+    codifica = json.JSONEncoder(ensure_ascii=False, check_circular=False).encode
+    n = 0
+    for spec in specs:
+        f.write(codifica(spec) + "\n")
+        n += 1
+    return n
+
+
+def _coppie_distinte(rng: np.random.Generator, n: int, k: int) -> np.ndarray:
+    """
+    (n, k) indici di coppia sorgente×destinazione, distinti in ogni riga.
+    Si estrae con ripetizione e si riestraggono solo i doppioni: con k molto
+    minore di N_COPPIE bastano pochi giri, tutti vettoriali.
+    """
+    scelte = rng.integers(0, N_COPPIE, size=(n, k))
+    while k > 1:
+        ordine = np.argsort(scelte, axis=1, kind="stable")
+        ordinate = np.take_along_axis(scelte, ordine, axis=1)
+        doppie = np.zeros(scelte.shape, dtype=bool)
+        np.put_along_axis(doppie, ordine[:, 1:], ordinate[:, 1:] == ordinate[:, :-1], axis=1)
+        quante = int(doppie.sum())
+        if not quante:
+            break
+        scelte[doppie] = rng.integers(0, N_COPPIE, size=quante)
+    return scelte
+
+
+def _spettri(rng: np.random.Generator, n: int, armoniche: int) -> np.ndarray:
+    """(n, armoniche) ampiezze: fondamentale 1, poi u_k / k^p con p in [0.5, 2]."""
+    k = np.arange(1, armoniche + 1, dtype=np.float64)
+    esponenti = rng.uniform(0.5, 2.0, size=(n, 1))
+    ampiezze = rng.random((n, armoniche)) / k ** esponenti
+    ampiezze[:, 0] = 1.0
+    return ampiezze
@@ -0,0 +1,33 @@
+"""
+Output decorativo su console (avanzamento, conferme [OK]).
+In modalità silenziosa viene soppresso: nei batch grandi la stampa
+costa tempo e nasconde gli errori. Gli avvisi [WARN] non sono decorativi:
+usano print(..., file=sys.stderr) direttamente, così non finiscono mai
+nell'output dei comandi che scrivono dati su stdout (manifest, JSON).
+"""
+
+from contextlib import contextmanager
+
+SILENZIOSO = False
+
+
+def stampa(*args, **kwargs):
+    if not SILENZIOSO:
+        print(*args, **kwargs)
+
+
+def imposta_silenzioso(attivo: bool = True):
+    global SILENZIOSO
+    SILENZIOSO = attivo
+
+
+@contextmanager
+def silenzioso():
+    """Sopprime l'output decorativo per la durata del blocco."""
+    global SILENZIOSO
+    precedente = SILENZIOSO
+    SILENZIOSO = True
+    try:
+        yield
+    finally:
+        SILENZIOSO = precedente
@@ -0,0 +1,114 @@
+"""
+Motore per le espressioni matematiche passate come stringa (es. --funzione).
+L'espressione viene analizzata una sola volta: l'AST è controllato contro una
+whitelist di nodi, nomi e funzioni, poi compilato in un code object.
+Le espressioni compilate sono in cache LRU, indicizzate sia per testo originale
+sia per testo normalizzato.
+"""
+
+import ast
+from functools import lru_cache
+
+import numpy as np
+
+FUNZIONI = {
+    "sin": np.sin,  "cos": np.cos,  "tan": np.tan,
+    "sqrt": np.sqrt, "abs": np.abs,
+    "log": np.log,  "exp": np.exp,
+}
+
+COSTANTI = {
+    "pi": np.pi,    "e": np.e,
+}
+
+VARIABILI = ("x", "t")   # x: fase da 0 a 2π nel frame, t: posizione del frame da 0 a 1
+VARIABILI_SPETTRO = ("k", "t")   # k: indice dell'armonica (1, 2, ...), t come sopra
+
+_OPERATORI = (
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.UAdd, ast.USub,
+)
+
+_GLOBALI = {"__builtins__": {}, **FUNZIONI, **COSTANTI}
+
+
+class Espressione:
+    """
+    Espressione compilata, chiamabile come f(x) oppure f(x, t).
+    Con variabili=VARIABILI_SPETTRO il primo argomento è k invece di x.
+    """
+
+    __slots__ = ("testo", "codice", "usa_t", "variabili")
+
+    def __init__(self, testo: str, codice, usa_t: bool, variabili: tuple = VARIABILI):
+        self.testo = testo
+        self.codice = codice
+        self.usa_t = usa_t
+        self.variabili = variabili
+
+    def __call__(self, x, t=0.0):
+        return eval(self.codice, _GLOBALI, {self.variabili[0]: x, self.variabili[1]: t})
+
+    def __reduce__(self):
+        # I code object non sono serializzabili: si ricompila dal testo
+        return (compila_espressione, (self.testo, self.variabili))
+
+    def __repr__(self):
+        return f"Espressione({self.testo!r})"
+
+
+def normalizza_espressione(expr: str) -> str:
+    """Testo canonico dell'espressione (spaziature e parentesi superflue uniformate)."""
+    try:
+        return ast.unparse(ast.parse(expr.strip(), mode="eval"))
+    except SyntaxError as err:
+        raise ValueError(f"Funzione non valida '{expr}': {err.msg}")
+
+
+@lru_cache(maxsize=1024)
+def compila_espressione(expr: str, variabili: tuple = VARIABILI) -> Espressione:
+    """
+    Restituisce l'espressione compilata, dalla cache se già vista.
+    Testi diversi con la stessa forma normalizzata condividono la stessa Espressione.
+    Lancia ValueError se l'espressione non è valida o usa costrutti non ammessi.
+    """
+    return _compila(normalizza_espressione(expr), variabili)
+
+
+@lru_cache(maxsize=1024)
+def _compila(testo: str, variabili: tuple = VARIABILI) -> Espressione:
+    albero = ast.parse(testo, mode="eval")
+
+    nomi = set()
+    for nodo in ast.walk(albero):
+        errore = _controlla_nodo(nodo, variabili)
+        if errore:
+            raise ValueError(f"Funzione non valida '{testo}': {errore}")
+        if isinstance(nodo, ast.Name):
+            nomi.add(nodo.id)
+
+    codice = compile(albero, "<espressione>", "eval")
+    return Espressione(testo, codice, "t" in nomi, variabili)
+
+
+def _controlla_nodo(nodo, variabili: tuple = VARIABILI) -> str:
+    """Restituisce un messaggio d'errore se il nodo non è nella whitelist."""
+    if isinstance(nodo, (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Load)):
+        return ""
+    if isinstance(nodo, _OPERATORI):
+        return ""
+    if isinstance(nodo, ast.Constant):
+        if isinstance(nodo.value, (int, float)) and not isinstance(nodo.value, bool):
+            return ""
+        return f"costante non ammessa {nodo.value!r}"
+    if isinstance(nodo, ast.Name):
+        if nodo.id in variabili or nodo.id in FUNZIONI or nodo.id in COSTANTI:
+            return ""
+        return f"nome sconosciuto '{nodo.id}'"
+    if isinstance(nodo, ast.Call):
+        if not isinstance(nodo.func, ast.Name) or nodo.func.id not in FUNZIONI:
+            return "sono ammesse solo le funzioni " + ", ".join(FUNZIONI)
+        if len(nodo.args) != 1 or nodo.keywords:
+            return f"{nodo.func.id}() accetta un solo argomento"
+        return ""
+    return f"costrutto non ammesso ({type(nodo).__name__})"
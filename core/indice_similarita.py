@@ -0,0 +1,248 @@
+"""
+Indice di similarità su una libreria di preset .fxp.
+Per ogni preset estrae, con gli offset di core/modulation.py:
+  - parametri statici      (OFFSET_PARAMETRI)
+  - campi degli envelope   (OFFSET_ENVELOPE)
+  - mod matrix             (32 slot da OFFSET_MOD_MATRIX), come matrice
+                           quantità per coppia sorgente×destinazione
+Le tre famiglie di colonne sono salvate in file .npy separati, aperti in
+memory-map, più un meta.json con i path indicizzati. L'indice si aggiorna
+in modo incrementale e risponde a query k-nearest-neighbour e di duplicati
+con operazioni vettoriali su tutta la libreria.
+"""
+
+import json
+import os
+from typing import Iterable, Optional
+
+import numpy as np
+
+from core.modulation import (
+    OFFSET_PARAMETRI, OFFSET_ENVELOPE, OFFSET_MOD_MATRIX, MAX_SLOT, SLOT_SIZE,
+)
+from maps.sources import SORGENTI
+from maps.destinations import DESTINAZIONI
+
+VERSIONE_INDICE = 1
+
+COLONNE_PARAMETRI = sorted(OFFSET_PARAMETRI)
+COLONNE_ENVELOPE = [f"{t}.{c}" for t in sorted(OFFSET_ENVELOPE) for c in sorted(OFFSET_ENVELOPE[t])]
+_OFFSET_FLOAT = np.array(
+    [OFFSET_PARAMETRI[n] for n in COLONNE_PARAMETRI]
+    + [OFFSET_ENVELOPE[c.split(".")[0]][c.split(".")[1]] for c in COLONNE_ENVELOPE],
+    dtype=np.int64,
+)
+
+_NOMI_SORGENTI = list(SORGENTI)
+_NOMI_DESTINAZIONI = list(DESTINAZIONI)
+N_MOD = len(_NOMI_SORGENTI) * len(_NOMI_DESTINAZIONI)
+
+# Indice Serum → colonna (o -1 se sconosciuto), per la decodifica della mod matrix
+_COLONNA_SORGENTE = np.full(256, -1, dtype=np.int64)
+_COLONNA_SORGENTE[list(SORGENTI.values())] = np.arange(len(SORGENTI))
+_COLONNA_DESTINAZIONE = np.full(256, -1, dtype=np.int64)
+_COLONNA_DESTINAZIONE[list(DESTINAZIONI.values())] = np.arange(len(DESTINAZIONI))
+
+# Valori (righe × colonne) sottratti insieme nel calcolo delle distanze: ~16 MB di temporanei
+VALORI_PER_BLOCCO = 1 << 22
+
+FAMIGLIE = {
+    "parametri": len(COLONNE_PARAMETRI),
+    "envelope": len(COLONNE_ENVELOPE),
+    "mod": N_MOD,
+}
+
+
+def estrai_caratteristiche(dati: bytes) -> dict[str, np.ndarray]:
+    """Vettori float32 delle tre famiglie di colonne per un singolo .fxp."""
+    u8 = np.frombuffer(dati, dtype=np.uint8)
+    n = len(u8)
+
+    # Parametri ed envelope: gather di tutti i float big-endian in un colpo
+    floats = np.zeros(len(_OFFSET_FLOAT), dtype=np.float32)
+    validi = _OFFSET_FLOAT + 4 <= n
+    if validi.any():
+        indici = _OFFSET_FLOAT[validi, None] + np.arange(4)
+        floats[validi] = u8[indici].copy().view(">f4").reshape(-1)
+    np.nan_to_num(floats, copy=False, nan=0.0, posinf=0.0, neginf=0.0)  # file estranei/corrotti
+
+    # Mod matrix: slot (src, dst, qty, aux) → quantità in [-1, 1] per coppia src×dst
+    mod = np.zeros(N_MOD, dtype=np.float32)
+    fine = OFFSET_MOD_MATRIX + MAX_SLOT * SLOT_SIZE
+    if fine <= n:
+        slot = np.frombuffer(dati, dtype=">f4", count=MAX_SLOT * 4,
+                             offset=OFFSET_MOD_MATRIX).reshape(MAX_SLOT, 4)
+        slot = np.nan_to_num(slot, nan=255.0, posinf=255.0, neginf=255.0)
+        src = np.clip(slot[:, 0], 0, 255).astype(np.int64)
+        dst = np.clip(slot[:, 1], 0, 255).astype(np.int64)
+        col_src, col_dst = _COLONNA_SORGENTE[src], _COLONNA_DESTINAZIONE[dst]
+        usati = (slot[:, 0] != 255.0) & (col_src >= 0) & (col_dst >= 0)
+        mod[col_src[usati] * len(_NOMI_DESTINAZIONI) + col_dst[usati]] = slot[usati, 2] * 2.0 - 1.0
+
+    n_par = len(COLONNE_PARAMETRI)
+    return {"parametri": floats[:n_par], "envelope": floats[n_par:], "mod": mod}
+
+
+class IndiceSimilarita:
+    def __init__(self, cartella: str):
+        self.cartella = cartella
+        os.makedirs(cartella, exist_ok=True)
+        self._meta_path = os.path.join(cartella, "meta.json")
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("versione") != VERSIONE_INDICE or meta.get("famiglie") != FAMIGLIE:
+                raise ValueError(f"Indice in {cartella} creato con un layout diverso: ricostruirlo")
+            self.paths: list[str] = meta["paths"]
+            self._stato: dict[str, list] = meta["stato"]
+        else:
+            self.paths, self._stato = [], {}
+        self._riga = {p: i for i, p in enumerate(self.paths)}
+        self._colonne = {nome: self._apri(nome, dim) for nome, dim in FAMIGLIE.items()}
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    # ── Aggiornamento ──────────────────────────────────
+
+    def aggiungi(self, path: str, dati: Optional[bytes] = None):
+        """Indicizza (o reindicizza) un preset; dati=None lo legge dal disco."""
+        if dati is None:
+            with open(path, "rb") as f:
+                dati = f.read()
+        path = os.path.abspath(path)
+        riga = self._riga.get(path)
+        if riga is None:
+            riga = len(self.paths)
+            self._garantisci_capacita(riga + 1)
+            self.paths.append(path)
+            self._riga[path] = riga
+        for nome, valori in estrai_caratteristiche(dati).items():
+            self._colonne[nome][riga] = valori
+        try:
+            st = os.stat(path)
+            self._stato[path] = [st.st_mtime_ns, st.st_size]
+        except OSError:
+            self._stato[path] = [0, len(dati)]
+
+    def aggiorna_cartella(self, cartella: str) -> int:
+        """Indicizza i .fxp nuovi o modificati nella cartella; restituisce quanti."""
+        aggiunti = 0
+        for voce in os.scandir(cartella):
+            if not (voce.is_file() and voce.name.lower().endswith(".fxp")):
+                continue
+            st = voce.stat()
+            path = os.path.abspath(voce.path)
+            if self._stato.get(path) == [st.st_mtime_ns, st.st_size]:
+                continue
+            self.aggiungi(path)
+            aggiunti += 1
+        return aggiunti
+
+    def salva(self):
+        for colonna in self._colonne.values():
+            colonna.flush()
+        temporaneo = self._meta_path + ".tmp"
+        with open(temporaneo, "w", encoding="utf-8") as f:
+            json.dump({"versione": VERSIONE_INDICE, "famiglie": FAMIGLIE,
+                       "paths": self.paths, "stato": self._stato}, f)
+        os.replace(temporaneo, self._meta_path)
+
+    # ── Query ──────────────────────────────────────────
+
+    def vicini(self, dati: bytes, k: int = 5,
+               pesi: Optional[dict[str, float]] = None) -> list[tuple[str, float]]:
+        """I k preset più vicini (distanza euclidea pesata per famiglia)."""
+        if not self.paths:
+            return []
+        distanze = self._distanze(estrai_caratteristiche(dati), pesi)
+        k = min(k, len(distanze))
+        migliori = np.argpartition(distanze, k - 1)[:k]
+        migliori = migliori[np.argsort(distanze[migliori])]
+        return [(self.paths[i], float(np.sqrt(distanze[i]))) for i in migliori]
+
+    def e_duplicato(self, dati: bytes, soglia: float = 1e-3) -> Optional[str]:
+        """Path di un preset a distanza ≤ soglia, se esiste."""
+        vicini = self.vicini(dati, k=1)
+        if vicini and vicini[0][1] <= soglia:
+            return vicini[0][0]
+        return None
+
+    def duplicati(self, soglia: float = 1e-3) -> list[list[str]]:
+        """
+        Gruppi di preset quasi identici in tutta la libreria: le righe vengono
+        quantizzate con passo soglia e raggruppate per valore esatto.
+        Approssimato: due preset a cavallo di un gradino finiscono in gruppi diversi.
+        """
+        n = len(self.paths)
+        if n == 0:
+            return []
+        limite = float(2 ** 62)
+        quantizzate = np.concatenate(
+            [np.clip(np.round(np.asarray(self._colonne[nome][:n], dtype=np.float64) / soglia),
+                     -limite, limite).astype(np.int64)
+             for nome in FAMIGLIE], axis=1)
+        _, inverso, conteggi = np.unique(quantizzate, axis=0, return_inverse=True,
+                                         return_counts=True)
+        inverso = inverso.reshape(-1)
+        gruppi = []
+        for gruppo in np.flatnonzero(conteggi > 1):
+            gruppi.append([self.paths[i] for i in np.flatnonzero(inverso == gruppo)])
+        return gruppi
+
+    # ── Interni ────────────────────────────────────────
+
+    def _distanze(self, query: dict[str, np.ndarray], pesi: Optional[dict[str, float]]) -> np.ndarray:
+        n = len(self.paths)
+        totale = np.zeros(n, dtype=np.float64)
+        for nome in FAMIGLIE:
+            peso = (pesi or {}).get(nome, 1.0)
+            if peso == 0 or FAMIGLIE[nome] == 0:
+                continue
+            x = self._colonne[nome]
+            q = query[nome]
+            # ||x - q||² dalla differenza diretta (una copia identica dà esattamente 0,
+            # l'espansione ||x||² - 2 x·q + ||q||² in float32 no), a blocchi di righe
+            # per limitare le matrici temporanee, con somma in float64
+            righe = max(1, VALORI_PER_BLOCCO // max(1, FAMIGLIE[nome]))
+            for inizio in range(0, n, righe):
+                fine = min(inizio + righe, n)
+                diff = x[inizio:fine] - q
+                totale[inizio:fine] += peso * np.einsum("ij,ij->i", diff, diff, dtype=np.float64)
+        return totale
+
+    def _path_colonna(self, nome: str) -> str:
+        return os.path.join(self.cartella, f"{nome}.npy")
+
+    def _apri(self, nome: str, dim: int) -> np.memmap:
+        path = self._path_colonna(nome)
+        if os.path.exists(path):
+            return np.load(path, mmap_mode="r+")
+        return np.lib.format.open_memmap(path, mode="w+", dtype=np.float32,
+                                         shape=(max(1024, len(self.paths)), dim))
+
+    def _garantisci_capacita(self, righe: int):
+        for nome, colonna in list(self._colonne.items()):
+            if righe <= colonna.shape[0]:
+                continue
+            capacita = max(righe, colonna.shape[0] * 2)
+            path = self._path_colonna(nome)
+            temporaneo = path + ".tmp.npy"
+            nuova = np.lib.format.open_memmap(temporaneo, mode="w+", dtype=np.float32,
+                                              shape=(capacita, colonna.shape[1]))
+            nuova[:colonna.shape[0]] = colonna
+            nuova.flush()
+            del nuova, colonna
+            self._colonne[nome] = None
+            os.replace(temporaneo, path)
+            self._colonne[nome] = np.load(path, mmap_mode="r+")
+
+
+def indicizza(indice: IndiceSimilarita, paths: Iterable[str]) -> int:
+    """Aggiunge più file all'indice e lo salva; restituisce quanti."""
+    n = 0
+    for path in paths:
+        indice.aggiungi(path)
+        n += 1
+    indice.salva()
+    return n
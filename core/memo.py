@@ -0,0 +1,153 @@
+"""
+Memoizzazione degli stadi della pipeline.
+Ogni stadio dichiara con @stadio quali campi del preset legge (dipende_da)
+e quali scrive (produce). La pipeline calcola un'impronta dei campi letti:
+se uno stadio è già stato eseguito con gli stessi input, i campi prodotti
+vengono ripristinati dalla cache invece di rieseguire lo stadio.
+"""
+
+import copy
+import dataclasses
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+# Campi che contengono un path: nell'impronta entra anche lo stato del file
+CAMPI_FILE = ("base_fxp",)
+# Campi delle dataclass annidate con riferimenti a .wav ("banco.wav" o "banco.wav#3"):
+# WavetableInput.file_wav e le chiavi stringa di MorphInput.chiavi
+CAMPI_WAV = ("file_wav", "chiavi")
+
+
+def stadio(dipende_da: Optional[tuple] = None, produce: tuple = ()):
+    """
+    Dichiara le dipendenze di uno stadio.
+    dipende_da=None indica uno stadio con effetti collaterali, eseguito sempre.
+    """
+    def decora(f):
+        f.dipende_da = dipende_da
+        f.produce = produce
+        return f
+    return decora
+
+
+def impronta(preset, campi: tuple) -> Optional[str]:
+    """
+    Hash dei campi indicati, oppure None se uno dei valori non ha
+    un'identità stabile (es. una funzione Python qualsiasi).
+    """
+    h = hashlib.blake2b(digest_size=20)
+    for campo in campi:
+        h.update(f"|{campo}=".encode())
+        valore = getattr(preset, campo, None)
+        if campo in CAMPI_FILE and isinstance(valore, str):
+            _aggiorna_file(h, valore)
+        elif not _aggiorna(h, valore):
+            return None
+    return h.hexdigest()
+
+
+def _aggiorna_file(h, path: str):
+    """Path, mtime e dimensione del file: un file modificato cambia l'impronta."""
+    try:
+        st = os.stat(path)
+        h.update(f"{os.path.abspath(path)}:{st.st_mtime_ns}:{st.st_size}".encode())
+    except OSError:
+        h.update(f"{path}:assente".encode())
+
+
+def _aggiorna_wav(h, valore) -> bool:
+    """Riferimenti a .wav (uno o una lista): stato del file più l'eventuale selezione '#...'."""
+    if isinstance(valore, str):
+        path, _, selezione = valore.partition("#")
+        _aggiorna_file(h, path)
+        h.update(f"#{selezione};".encode())
+        return True
+    if isinstance(valore, (list, tuple)):
+        h.update(f"[{len(valore)}:".encode())
+        return all(_aggiorna_wav(h, v) if isinstance(v, str) else _aggiorna(h, v) for v in valore)
+    return _aggiorna(h, valore)
+
+
+def _e_ndarray(valore) -> bool:
+    # Senza importare numpy per ogni valore: un ndarray ha il tipo definito in numpy,
+    # e solo allora l'import (completo, mai un modulo a metà inizializzazione) è certo
+    if not type(valore).__module__.startswith("numpy"):
+        return False
+    import numpy as np
+    return isinstance(valore, np.ndarray)
+
+
+def _aggiorna(h, valore) -> bool:
+    if valore is None or isinstance(valore, (bool, int, float, str)):
+        h.update(f"{type(valore).__name__}:{valore!r};".encode())
+    elif isinstance(valore, (bytes, bytearray, memoryview)):
+        h.update(b"b:")
+        h.update(valore)
+    elif _e_ndarray(valore):
+        import numpy as np
+        valore = np.ascontiguousarray(valore)
+        h.update(f"nd:{valore.dtype.str}:{valore.shape}:".encode())
+        h.update(memoryview(valore).cast("B"))
+    elif isinstance(valore, (list, tuple)):
+        h.update(f"[{len(valore)}:".encode())
+        return all(_aggiorna(h, v) for v in valore)
+    elif isinstance(valore, dict):
+        h.update(f"{{{len(valore)}:".encode())
+        for k in sorted(valore, key=repr):
+            if not (_aggiorna(h, k) and _aggiorna(h, valore[k])):
+                return False
+    elif dataclasses.is_dataclass(valore):
+        h.update(f"{type(valore).__name__}(".encode())
+        for f in dataclasses.fields(valore):
+            h.update(f"{f.name}=".encode())
+            aggiorna = _aggiorna_wav if f.name in CAMPI_WAV else _aggiorna
+            if not aggiorna(h, getattr(valore, f.name)):
+                return False
+    elif callable(valore) and hasattr(valore, "testo"):
+        # Espressione compilata: identificata dal testo normalizzato
+        h.update(f"expr:{valore.testo};".encode())
+    else:
+        return False
+    return True
+
+
+class CacheStadi:
+    """Risultati degli stadi indicizzati per (nome stadio, impronta degli input)."""
+
+    def __init__(self, max_voci: int = 64):
+        self.max_voci = max_voci
+        self._voci: OrderedDict[tuple, tuple] = OrderedDict()
+        self._lock = threading.Lock()  # condivisa tra le richieste concorrenti del servizio
+
+    def leggi(self, nome: str, chiave: str) -> Optional[tuple]:
+        with self._lock:
+            valori = self._voci.get((nome, chiave))
+            if valori is not None:
+                self._voci.move_to_end((nome, chiave))
+        return valori
+
+    def salva(self, nome: str, chiave: str, preset, campi: tuple):
+        valori = tuple(copy.copy(getattr(preset, c, None)) for c in campi)
+        with self._lock:
+            self._voci[(nome, chiave)] = valori
+            while len(self._voci) > self.max_voci:
+                self._voci.popitem(last=False)
+
+    @staticmethod
+    def ripristina(preset, campi: tuple, valori: tuple):
+        for campo, valore in zip(campi, valori):
+            setattr(preset, campo, copy.copy(valore))
+
+    def svuota(self):
+        with self._lock:
+            self._voci.clear()
+
+    def __len__(self) -> int:
+        return len(self._voci)
+
+
+# Cache condivisa dal processo, usata di default da esegui_pipeline
+CACHE_STADI = CacheStadi()
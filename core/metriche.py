@@ -0,0 +1,148 @@
+"""
+Metriche per stadio della pipeline.
+Per ogni esecuzione di uno stadio registra tempo reale, tempo CPU, picco di
+memoria (opzionale, tramite tracemalloc) e i contatori aggiornati dagli stadi
+con conta(): bytes letti/scritti, frame renderizzati, patch applicate.
+I record possono essere scritti su un file JSON-lines e aggregati in
+percentili per stadio, esportabili in formato testo Prometheus.
+"""
+
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Optional
+
+QUANTILI = (0.5, 0.9, 0.99)
+
+# Contatori dello stadio in esecuzione (None se nessuna misura è attiva)
+_CONTATORI: Optional[dict] = None
+
+
+def conta(nome: str, valore: int = 1):
+    """Aggiunge valore al contatore dello stadio in corso; no-op senza metriche attive."""
+    if _CONTATORI is not None:
+        _CONTATORI[nome] = _CONTATORI.get(nome, 0) + valore
+
+
+class SinkJSONL:
+    """Scrive un record JSON per riga, in append."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+
+    def scrivi(self, record: dict):
+        self._file.write(json.dumps(record) + "\n")
+
+    def chiudi(self):
+        self._file.close()
+
+
+class Metriche:
+    def __init__(self, memoria: bool = False, sink: Optional[SinkJSONL] = None):
+        self.memoria = memoria
+        self.sink = sink
+        self.record: list[dict] = []
+
+    @contextmanager
+    def misura(self, preset: str, stadio: str):
+        global _CONTATORI
+        record = {"preset": preset, "stadio": stadio, "saltato": False, "contatori": {}}
+        precedenti = _CONTATORI
+        _CONTATORI = record["contatori"]
+
+        traccia_avviata = False
+        if self.memoria:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                traccia_avviata = True
+            tracemalloc.reset_peak()
+            base_memoria = tracemalloc.get_traced_memory()[0]
+
+        inizio_wall = time.perf_counter()
+        inizio_cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            record["wall_s"] = time.perf_counter() - inizio_wall
+            record["cpu_s"] = time.process_time() - inizio_cpu
+            if self.memoria:
+                record["picco_memoria_bytes"] = tracemalloc.get_traced_memory()[1] - base_memoria
+                if traccia_avviata:
+                    tracemalloc.stop()
+            _CONTATORI = precedenti
+            self.aggiungi([record])
+
+    def aggiungi(self, records: list[dict]):
+        """Aggiunge record già misurati (es. restituiti dai worker di un batch)."""
+        self.record.extend(records)
+        if self.sink:
+            for r in records:
+                self.sink.scrivi(r)
+
+    def riepilogo(self) -> dict[str, dict]:
+        """Per ogni stadio: numero di esecuzioni, saltati, percentili e totali dei contatori."""
+        import numpy as np
+
+        per_stadio: dict[str, list[dict]] = {}
+        for r in self.record:
+            per_stadio.setdefault(r["stadio"], []).append(r)
+
+        riepilogo = {}
+        for stadio, records in per_stadio.items():
+            voce = {
+                "esecuzioni": len(records),
+                "saltati": sum(r["saltato"] for r in records),
+                "contatori": {},
+            }
+            for misura in ("wall_s", "cpu_s", "picco_memoria_bytes"):
+                valori = np.array([r[misura] for r in records
+                                   if misura in r and not r["saltato"]], dtype=np.float64)
+                if len(valori):
+                    voce[misura] = {
+                        "quantili": dict(zip(QUANTILI, np.quantile(valori, QUANTILI).tolist())),
+                        "somma": float(valori.sum()),
+                    }
+            for r in records:
+                for nome, valore in r["contatori"].items():
+                    voce["contatori"][nome] = voce["contatori"].get(nome, 0) + valore
+            riepilogo[stadio] = voce
+        return riepilogo
+
+    def prometheus(self, prefisso: str = "serum_builder") -> str:
+        """Riepilogo in formato testo Prometheus (summary per le durate, counter per i contatori)."""
+        riepilogo = self.riepilogo()
+        righe = []
+        for misura, descrizione in (("wall_s", "Tempo reale per stadio in secondi"),
+                                    ("cpu_s", "Tempo CPU per stadio in secondi"),
+                                    ("picco_memoria_bytes", "Picco di memoria per stadio in bytes")):
+            nome = f"{prefisso}_stadio_{misura}"
+            voci = [(s, v) for s, v in riepilogo.items() if misura in v]
+            if not voci:
+                continue
+            righe.append(f"# HELP {nome} {descrizione}")
+            righe.append(f"# TYPE {nome} summary")
+            for stadio, voce in voci:
+                for q, valore in voce[misura]["quantili"].items():
+                    righe.append(f'{nome}{{stadio="{stadio}",quantile="{q}"}} {valore:.9g}')
+                righe.append(f'{nome}_sum{{stadio="{stadio}"}} {voce[misura]["somma"]:.9g}')
+                righe.append(f'{nome}_count{{stadio="{stadio}"}} {voce["esecuzioni"] - voce["saltati"]}')
+
+        nome = f"{prefisso}_stadio_saltati_total"
+        righe.append(f"# TYPE {nome} counter")
+        for stadio, voce in riepilogo.items():
+            righe.append(f'{nome}{{stadio="{stadio}"}} {voce["saltati"]}')
+
+        contatori = sorted({c for v in riepilogo.values() for c in v["contatori"]})
+        for contatore in contatori:
+            nome = f"{prefisso}_{contatore}_total"
+            righe.append(f"# TYPE {nome} counter")
+            for stadio, voce in riepilogo.items():
+                if contatore in voce["contatori"]:
+                    righe.append(f'{nome}{{stadio="{stadio}"}} {voce["contatori"][contatore]}')
+        return "\n".join(righe) + "\n"
+
+    def scrivi_prometheus(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
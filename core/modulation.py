@@ -1,36 +1,95 @@
 import struct
+import sys
+from typing import TYPE_CHECKING
+
 from models.input_schema import PresetInput, ModulazioneInput, EnvelopeInput
 from maps.sources import SORGENTI
 from maps.destinations import DESTINAZIONI
+from core.memo import stadio
+from core.patch_plan import piano_predefinito
+
+if TYPE_CHECKING:  # numpy si carica solo con codifica_modulazioni_batch
+    import numpy as np
+    from models.preset_batch import PresetBatch
 
-# Offset della mod matrix nel file .fxp (da verificare con hex editor)
-OFFSET_MOD_MATRIX = 0x2A0
+# Offset nel file .fxp, dal layout compilato (maps/layout_v1.json)
+PIANO = piano_predefinito()
+OFFSET_MOD_MATRIX = PIANO.offset_mod_matrix
 SLOT_SIZE = 16        # byte per slot (4 float × 4 byte)
-MAX_SLOT = 32         # Serum ha 32 slot nella mod matrix
+MAX_SLOT = PIANO.dimensione_mod_matrix // SLOT_SIZE   # Serum ha 32 slot nella mod matrix
+OFFSET_PARAMETRI = PIANO.parametri      # nome parametro → offset
+OFFSET_ENVELOPE = PIANO.envelope        # target → campo → offset
+_ENVELOPE_IN_CONFLITTO = frozenset(c.split(".")[0] for c in PIANO.conflitti if "." in c)
 
+SLOT_VUOTO = (255.0, 255.0, 0.5, 255.0)  # sorgente, destinazione, quantità, aux
+_SLOT_VUOTO_BYTES = struct.pack(">ffff", *SLOT_VUOTO)
 
+
+@stadio(dipende_da=("modulazioni",), produce=("_mod_bytes",))
 def codifica_modulazioni(preset: PresetInput) -> PresetInput:
     """
     Stadio 3 della pipeline.
     Converte ogni ModulazioneInput in bytes pronti per il file .fxp.
-    Aggiunge i bytes come attributo _mod_bytes al preset.
+    Scrive i bytes nel campo _mod_bytes del preset.
     """
     if len(preset.modulazioni) > MAX_SLOT:
         raise ValueError(f"Troppi collegamenti: massimo {MAX_SLOT}, ricevuti {len(preset.modulazioni)}")
 
-    slots = []
-    for mod in preset.modulazioni:
-        slots.append(_codifica_slot(mod))
-
-    # Pad con slot vuoti fino a MAX_SLOT
-    slot_vuoto = struct.pack(">ffff", 255.0, 255.0, 0.5, 255.0)
-    while len(slots) < MAX_SLOT:
-        slots.append(slot_vuoto)
+    slots = [_codifica_slot(mod) for mod in preset.modulazioni]
+    slots += [_SLOT_VUOTO_BYTES] * (MAX_SLOT - len(slots))  # pad con slot vuoti
 
     preset._mod_bytes = b"".join(slots)
     return preset
 
 
+def codifica_modulazioni_batch(batch: "PresetBatch") -> tuple["np.ndarray", list[memoryview]]:
+    """
+    Stadio 3 per un intero PresetBatch, senza un struct.pack per slot.
+    Riempie un array (n_preset, MAX_SLOT, 4) di float32 big-endian, inizializzato
+    con lo slot vuoto, con un solo assegnamento vettoriale; i nomi diventano
+    indici Serum tramite tabelle costruite una volta sul vocabolario del batch.
+    Restituisce l'array e, per ogni preset, una memoryview dei suoi
+    MAX_SLOT * SLOT_SIZE byte (nessuna copia), da usare come _mod_bytes.
+    I bytes sono identici a quelli di codifica_modulazioni.
+    """
+    import numpy as np
+
+    n = len(batch)
+    conteggi = batch.conteggi("modulazioni")
+    if n and conteggi.max() > MAX_SLOT:
+        i = int(np.argmax(conteggi))
+        raise ValueError(f"Troppi collegamenti in '{batch.nomi[i]}': massimo {MAX_SLOT}, "
+                         f"ricevuti {conteggi[i]}")
+
+    # Codice del vocabolario → indice Serum (-1 = nome sconosciuto, codice 0 = nessuno)
+    nomi = batch.vocabolario.nomi
+    indice_sorgente = np.array([SORGENTI.get(x, -1) for x in nomi], dtype=np.float64)
+    indice_destinazione = np.array([DESTINAZIONI.get(x, -1) for x in nomi], dtype=np.float64)
+    indice_aux = indice_sorgente.copy()
+    indice_aux[0] = SLOT_VUOTO[3]
+
+    m = batch.modulazioni
+    colonne = np.column_stack([
+        indice_sorgente[m["sorgente"]],
+        indice_destinazione[m["destinazione"]],
+        (m["quantita"] + 1.0) / 2.0,  # da [-1,1] a [0,1]
+        indice_aux[m["aux"]],
+    ])
+    sconosciuti = np.flatnonzero((colonne[:, [0, 1, 3]] < 0).any(axis=1))
+    if len(sconosciuti):
+        _, src, dst, _, aux = m[sconosciuti[0]].tolist()
+        raise ValueError(f"Modulazione {nomi[src]}→{nomi[dst]}"
+                         + (f" (aux {nomi[aux]})" if aux else "") + ": nome sconosciuto")
+
+    matrice = np.empty((n, MAX_SLOT, 4), dtype=">f4")
+    matrice[...] = SLOT_VUOTO
+    matrice[m["preset"], batch.posizioni("modulazioni")] = colonne
+
+    byte = memoryview(matrice.reshape(-1).view(np.uint8))
+    passo = MAX_SLOT * SLOT_SIZE
+    return matrice, [byte[i * passo:(i + 1) * passo] for i in range(n)]
+
+
 def _codifica_slot(mod: ModulazioneInput) -> bytes:
     src_idx = float(SORGENTI[mod.sorgente])
     dst_idx = float(DESTINAZIONI[mod.destinazione])
@@ -40,42 +99,36 @@ def _codifica_slot(mod: ModulazioneInput) -> bytes:
     return struct.pack(">ffff", src_idx, dst_idx, qty_norm, aux_idx)
 
 
+@stadio(dipende_da=("parametri", "envelopes"), produce=("_param_patch",))
 def codifica_parametri(preset: PresetInput) -> PresetInput:
     """
     Stadio 4 della pipeline.
-    Converte parametri statici ed envelopes in una mappa offset→bytes.
+    Converte parametri statici ed envelopes in una mappa offset→valore float,
+    usando gli offset del PatchPlan compilato dal layout.
     """
-    # Mappa nome parametro → offset nel file (da verificare/estendere)
-    OFFSET_PARAMETRI: dict[str, int] = {
-        "filter_cutoff": 0x1A4,
-        "filter_res":    0x1A8,
-        "filter_drive":  0x1AC,
-        "master_vol":    0x3F0,
-        "master_pan":    0x3F4,
-    }
-
-    OFFSET_ENVELOPE: dict[str, dict[str, int]] = {
-        "ENV1": {"attack": 0x280, "decay": 0x284, "sustain": 0x288, "release": 0x28C},
-        "ENV2": {"attack": 0x290, "decay": 0x294, "sustain": 0x298, "release": 0x29C},
-        "ENV3": {"attack": 0x2A0, "decay": 0x2A4, "sustain": 0x2A8, "release": 0x2AC},
-    }
-
-    patch: dict[int, bytes] = {}
+    patch: dict[int, float] = {}
 
     for par in preset.parametri:
-        if par.nome in OFFSET_PARAMETRI:
-            offset = OFFSET_PARAMETRI[par.nome]
-            patch[offset] = struct.pack(">f", par.valore)
+        offset = OFFSET_PARAMETRI.get(par.nome)
+        if offset is not None:
+            patch[offset] = par.valore
+        elif par.nome in PIANO.motivi:
+            print(f"[WARN] Parametro '{par.nome}' escluso dal layout ({PIANO.motivi[par.nome]}), ignorato.",
+                  file=sys.stderr)
         else:
-            print(f"[WARN] Parametro '{par.nome}' non mappato, ignorato.")
+            print(f"[WARN] Parametro '{par.nome}' non mappato, ignorato.", file=sys.stderr)
 
     for env in preset.envelopes:
-        if env.target in OFFSET_ENVELOPE:
-            offsets = OFFSET_ENVELOPE[env.target]
-            patch[offsets["attack"]]  = struct.pack(">f", env.attack)
-            patch[offsets["decay"]]   = struct.pack(">f", env.decay)
-            patch[offsets["sustain"]] = struct.pack(">f", env.sustain)
-            patch[offsets["release"]] = struct.pack(">f", env.release)
+        offsets = OFFSET_ENVELOPE.get(env.target)
+        if env.target in _ENVELOPE_IN_CONFLITTO:
+            esclusi = [c for c in PIANO.conflitti if c.startswith(f"{env.target}.")]
+            print(f"[WARN] Envelope {env.target}: campi esclusi dal layout, ignorati "
+                  f"({PIANO.motivi[esclusi[0]]}).", file=sys.stderr)
+        if offsets is None:
+            continue
+        for campo in ("attack", "decay", "sustain", "release"):
+            if campo in offsets:
+                patch[offsets[campo]] = getattr(env, campo)
 
     preset._param_patch = patch
     return preset
@@ -0,0 +1,140 @@
+"""
+Piano di patch compilato dal layout degli offset del file .fxp.
+Il layout (maps/layout_v1.json, oppure $SERUM_BUILDER_LAYOUT) viene letto e
+compilato una volta sola in un PatchPlan immutabile, che:
+  - rileva le sovrapposizioni tra campi e con la mod matrix
+  - applica tutte le patch float in un solo passaggio con struct.pack_into
+"""
+
+import json
+import os
+import struct
+import sys
+from dataclasses import dataclass, field
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Mapping, Optional
+
+VERSIONI_SUPPORTATE = (1,)
+LAYOUT_DEFAULT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              "maps", "layout_v1.json")
+
+_F32 = struct.Struct(">f")
+
+
+@dataclass(frozen=True)
+class PatchPlan:
+    versione: int
+    parametri: Mapping[str, int]                    # nome → offset
+    envelope: Mapping[str, Mapping[str, int]]       # target → campo → offset
+    offset_mod_matrix: int
+    dimensione_mod_matrix: int
+    conflitti: tuple[str, ...] = ()                 # campi esclusi perché sovrapposti
+    motivi: Mapping[str, str] = field(default_factory=lambda: MappingProxyType({}))  # campo → sovrapposizione
+
+    def applica(self, data: bytearray, valori: Mapping[int, float],
+                mod_bytes: Optional[bytes | memoryview] = None) -> int:
+        """
+        Scrive i float (offset → valore, big-endian) e la mod matrix su data.
+        Restituisce il numero di patch applicate; quelle fuori dal file sono ignorate.
+        """
+        applicate = 0
+        lunghezza = len(data)
+        if valori:
+            if max(valori) + 4 <= lunghezza:
+                # Caso comune: nessun controllo per singolo offset
+                pack_into = _F32.pack_into
+                for offset, valore in valori.items():
+                    pack_into(data, offset, valore)
+                applicate += len(valori)
+            else:
+                for offset, valore in valori.items():
+                    if offset + 4 <= lunghezza:
+                        _F32.pack_into(data, offset, valore)
+                        applicate += 1
+                    else:
+                        print(f"[WARN] Offset 0x{offset:X} fuori dal file, ignorato.", file=sys.stderr)
+
+        if mod_bytes is not None:
+            fine = self.offset_mod_matrix + len(mod_bytes)
+            if fine <= lunghezza:
+                data[self.offset_mod_matrix:fine] = mod_bytes
+                applicate += 1
+            else:
+                print("[WARN] Mod matrix fuori dal file, ignorata.", file=sys.stderr)
+        return applicate
+
+
+def carica_layout(path: Optional[str] = None) -> dict:
+    path = path or os.environ.get("SERUM_BUILDER_LAYOUT", LAYOUT_DEFAULT)
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compila_layout(layout: dict, rigoroso: bool = False) -> PatchPlan:
+    """
+    Compila il layout in un PatchPlan.
+    Ogni campo occupa 4 byte; due campi che si sovrappongono, o un campo dentro
+    la mod matrix (che verrebbe sovrascritto a ogni preset), sono un conflitto:
+    con rigoroso=True si lancia ValueError, altrimenti i campi in conflitto
+    vengono esclusi dal piano (con il motivo in PatchPlan.motivi). Nessun
+    avviso qui: lo stampa codifica_parametri solo se un preset usa quei campi.
+    """
+    versione = layout.get("versione")
+    if versione not in VERSIONI_SUPPORTATE:
+        raise ValueError(f"Versione di layout non supportata: {versione} "
+                         f"(supportate: {VERSIONI_SUPPORTATE})")
+
+    mm = layout["mod_matrix"]
+    offset_mm = _offset(mm["offset"])
+    dimensione_mm = int(mm["slot"]) * int(mm["slot_size"])
+
+    campi: list[tuple[str, int]] = []
+    for nome, off in layout.get("parametri", {}).items():
+        campi.append((nome, _offset(off)))
+    for target, offsets in layout.get("envelope", {}).items():
+        for campo, off in offsets.items():
+            campi.append((f"{target}.{campo}", _offset(off)))
+
+    conflitti = {}
+    for nome, off in campi:
+        if off < offset_mm + dimensione_mm and offset_mm < off + 4:
+            conflitti[nome] = f"{nome} (0x{off:X}) è dentro la mod matrix " \
+                              f"(0x{offset_mm:X}–0x{offset_mm + dimensione_mm - 1:X})"
+    ordinati = sorted(campi, key=lambda c: c[1])
+    for (nome_a, off_a), (nome_b, off_b) in zip(ordinati, ordinati[1:]):
+        if off_b < off_a + 4:
+            for nome in (nome_a, nome_b):
+                conflitti.setdefault(nome, f"{nome_a} (0x{off_a:X}) e {nome_b} (0x{off_b:X}) si sovrappongono")
+
+    if conflitti and rigoroso:
+        messaggi = sorted(set(conflitti.values()))
+        raise ValueError("Layout con sovrapposizioni:\n" + "\n".join(f"  - {m}" for m in messaggi))
+
+    parametri = {n: o for n, o in campi if "." not in n and n not in conflitti}
+    envelope: dict[str, dict[str, int]] = {}
+    for nome, off in campi:
+        if "." in nome and nome not in conflitti:
+            target, campo = nome.split(".", 1)
+            envelope.setdefault(target, {})[campo] = off
+
+    return PatchPlan(
+        versione=versione,
+        parametri=MappingProxyType(parametri),
+        envelope=MappingProxyType({t: MappingProxyType(o) for t, o in envelope.items()}),
+        offset_mod_matrix=offset_mm,
+        dimensione_mod_matrix=dimensione_mm,
+        conflitti=tuple(sorted(conflitti)),
+        motivi=MappingProxyType(dict(sorted(conflitti.items()))),
+    )
+
+
+@lru_cache(maxsize=1)
+def piano_predefinito() -> PatchPlan:
+    """PatchPlan del layout predefinito, compilato alla prima richiesta."""
+    return compila_layout(carica_layout())
+
+
+def _offset(valore) -> int:
+    """Accetta offset interi o stringhe esadecimali ('0x2A0')."""
+    return int(valore, 0) if isinstance(valore, str) else int(valore)
@@ -1,33 +1,114 @@
 import sys, os
+from contextlib import nullcontext
+from typing import Optional
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from models.input_schema import PresetInput
 from core.validator import valida_input
-from core.wavetable import risolvi_wavetable
 from core.modulation import codifica_modulazioni, codifica_parametri
 from core.encoder import assembla_fxp
 from output_io.writer import scrivi_output
+from core.memo import CacheStadi, CACHE_STADI, impronta, stadio
+from core.metriche import Metriche
+from core.console import stampa
+
+@stadio(dipende_da=("wavetable",), produce=("wavetable",))
+def risolvi_wavetable(preset: PresetInput) -> PresetInput:
+    """
+    Stadio 2 — delega a core.wavetable, importato (con numpy) solo se il preset
+    ha una wavetable: i preset di soli parametri non caricano numpy né scipy.
+    """
+    if not preset.wavetable:
+        return preset
+    from core.wavetable import risolvi_wavetable as risolvi
+    return risolvi(preset)
+
+
+@stadio(dipende_da=("wavetable", "anteprima"), produce=("_anteprima",))
+def renderizza_anteprima(preset: PresetInput) -> PresetInput:
+    """
+    Stadio 2b — anteprima audio della wavetable, solo se richiesta con
+    preset.anteprima; core.anteprima (numpy) si importa solo in quel caso.
+    """
+    if preset.anteprima is None or not preset.wavetable:
+        return preset
+    from core.anteprima import renderizza_anteprima as renderizza
+    return renderizza(preset)
+
 
 PIPELINE = [
     valida_input,
     risolvi_wavetable,
+    renderizza_anteprima,
     codifica_modulazioni,
     codifica_parametri,
     assembla_fxp,
     scrivi_output,
 ]
 
-def esegui_pipeline(preset: PresetInput) -> PresetInput:
-    print(f"\n▶ Avvio pipeline per preset: '{preset.nome}'")
-    print(f"  Stadi totali: {len(PIPELINE)}\n")
-    for i, stadio in enumerate(PIPELINE, 1):
+def esegui_pipeline(preset: PresetInput, verbose: bool = True,
+                    cache: Optional[CacheStadi] = CACHE_STADI,
+                    metriche: Optional[Metriche] = None) -> PresetInput:
+    """
+    Esegue gli stadi di PIPELINE in sequenza.
+    Uno stadio i cui input (dichiarati con @stadio) non sono cambiati rispetto
+    a un'esecuzione precedente viene saltato e i suoi risultati ripristinati
+    dalla cache; i nomi degli stadi saltati finiscono in preset._stadi_saltati.
+    Con cache=None tutti gli stadi vengono sempre eseguiti.
+    Con verbose=False non stampa l'avanzamento né le conferme [OK] di
+    scrivi_output (preset._silenzioso; usato dalle esecuzioni batch).
+    Con metriche, ogni stadio viene misurato e registrato.
+    """
+    log = stampa if verbose else _silenzio
+    preset._silenzioso = not verbose
+    log(f"\n▶ Avvio pipeline per preset: '{preset.nome}'")
+    log(f"  Stadi totali: {len(PIPELINE)}\n")
+    preset = esegui_stadi(preset, PIPELINE, log, cache, metriche)
+    saltati = preset._stadi_saltati
+    log(f"\n✅ Pipeline completata."
+        + (f" Stadi saltati: {', '.join(saltati)}" if saltati else "") + "\n")
+    return preset
+
+
+def esegui_stadi(preset: PresetInput, stadi: list, log=None,
+                 cache: Optional[CacheStadi] = None,
+                 metriche: Optional[Metriche] = None) -> PresetInput:
+    """Esegue una sequenza qualsiasi di stadi (usata anche da sweep e batch)."""
+    log = log or _silenzio
+    saltati = []
+    for i, stadio in enumerate(stadi, 1):
         nome_stadio = stadio.__name__
+        misura = metriche.misura(preset.nome, nome_stadio) if metriche else nullcontext({})
         try:
-            print(f"  [{i}/{len(PIPELINE)}] {nome_stadio}...")
-            preset = stadio(preset)
-            print(f"         ✓ completato")
+            log(f"  [{i}/{len(stadi)}] {nome_stadio}...")
+            with misura as record:
+                chiave = _chiave_stadio(stadio, preset, cache)
+                valori = cache.leggi(nome_stadio, chiave) if chiave else None
+                if valori is not None:
+                    cache.ripristina(preset, stadio.produce, valori)
+                    record["saltato"] = True
+                else:
+                    preset = stadio(preset)
+                    if chiave:
+                        cache.salva(nome_stadio, chiave, preset, stadio.produce)
+            if valori is not None:
+                saltati.append(nome_stadio)
+                log(f"         ↷ input invariati, saltato")
+            else:
+                log(f"         ✓ completato")
         except Exception as e:
-            print(f"         ✗ ERRORE in {nome_stadio}:\n           {e}")
+            log(f"         ✗ ERRORE in {nome_stadio}:\n           {e}")
             raise
-    print(f"\n✅ Pipeline completata.\n")
+    preset._stadi_saltati = saltati
     return preset
+
+
+def _chiave_stadio(stadio, preset: PresetInput, cache: Optional[CacheStadi]) -> Optional[str]:
+    dipende_da = getattr(stadio, "dipende_da", None)
+    if cache is None or dipende_da is None:
+        return None
+    return impronta(preset, dipende_da)
+
+
+def _silenzio(*args, **kwargs):
+    pass
@@ -0,0 +1,332 @@
+"""
+Modalità servizio: un processo sempre attivo che riceve specifiche di preset
+in JSON-lines, su un socket Unix locale oppure su stdin/stdout.
+numpy, scipy, le basi .fxp lette e le espressioni compilate restano in memoria
+tra una richiesta e l'altra, così ogni preset costa solo il lavoro della pipeline.
+
+Richiesta (una riga JSON): le stesse chiavi di una riga di manifest
+    {"id": 1, "cwd": "/progetto", "nome": "Pad", "base": "base.fxp", "funzione": "sin(x)"}
+"cwd" è la cartella rispetto a cui risolvere i path relativi (base, wav, output,
+i keyframe .wav e il file di un riferimento FILE.py:NOME).
+Comandi speciali: {"comando": "stato"} e {"comando": "arresta"}.
+
+Risposta (una riga JSON per richiesta, nell'ordine di completamento):
+    {"id": 1, "ok": true, "nome": "Pad", "output": [...], "durata_s": 0.004,
+     "stadi_saltati": [...], "errore": null}
+
+Il client (invia / esegui) non importa numpy: se il servizio non è attivo
+esegue le richieste nel proprio processo.
+"""
+
+import json
+import os
+import re
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Optional
+
+# Chiavi della specifica che contengono path da risolvere rispetto a "cwd"
+CHIAVI_PATH = ("base", "wav", "output")
+# Riferimento a un file Python in "funzione" (rifiutato da preset_da_spec, ma
+# risolto comunque: servizio e fallback locale devono dare lo stesso errore)
+_FUNZIONE_DA_FILE = re.compile(r"^(?P<file>.+\.py)(?P<nome>:[A-Za-z_]\w*)$")
+
+
+def percorso_socket() -> str:
+    """Path del socket: $SERUM_BUILDER_SOCKET, altrimenti uno per utente nella cartella temporanea."""
+    utente = os.getuid() if hasattr(os, "getuid") else os.getlogin()
+    return os.environ.get("SERUM_BUILDER_SOCKET",
+                          os.path.join(tempfile.gettempdir(), f"serum_builder-{utente}.sock"))
+
+
+# ═══════════════════════════════════════════════════════
+# SERVIZIO
+# ═══════════════════════════════════════════════════════
+
+def esegui_richiesta(richiesta: dict) -> dict:
+    """Esegue la pipeline per una richiesta e restituisce la risposta (mai un'eccezione)."""
+    from core.spec import preset_da_spec
+    from core.pipeline import esegui_pipeline
+
+    spec = _risolvi_path(richiesta)
+    risposta = {"id": richiesta.get("id"), "ok": False, "nome": spec.get("nome"),
+                "output": [], "durata_s": 0.0, "stadi_saltati": [], "errore": None}
+    inizio = time.perf_counter()
+    try:
+        preset = esegui_pipeline(preset_da_spec(spec), verbose=False)
+    except Exception as e:
+        risposta["errore"] = str(e)
+    else:
+        risposta["ok"] = True
+        risposta["output"] = _file_scritti(preset)
+        risposta["stadi_saltati"] = preset._stadi_saltati
+    risposta["durata_s"] = round(time.perf_counter() - inizio, 6)
+    return risposta
+
+
+class Servizio:
+    """
+    Stato condiviso del processo servizio: pool di thread per le richieste
+    concorrenti e contatori per il comando "stato".
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        self._arresto = threading.Event()
+        self._lock = threading.Lock()
+        self.avvio = time.time()
+        self.richieste = 0
+        self.errori = 0
+
+    def riscalda(self):
+        """
+        Importa subito la pipeline e i moduli pesanti (numpy, scipy) che gli
+        stadi caricano solo quando servono: la prima richiesta non paga l'avvio
+        e le prime richieste concorrenti non importano numpy in parallelo.
+        """
+        from core.console import imposta_silenzioso
+        import core.pipeline  # noqa: F401
+        import core.spec  # noqa: F401
+        import core.wavetable  # noqa: F401
+        import core.espressioni  # noqa: F401
+        import scipy.io.wavfile  # noqa: F401
+        imposta_silenzioso(True)
+
+    def servi_righe(self, righe: Iterable[str], scrivi_riga: Callable[[str], None]):
+        """
+        Legge richieste JSON-lines e scrive le risposte appena pronte.
+        Le richieste di uno stesso flusso vengono eseguite in parallelo;
+        ritorna quando tutte le risposte sono state scritte.
+        """
+        lock_scrittura = threading.Lock()
+        in_corso = []
+
+        def rispondi(risposta: dict):
+            with lock_scrittura:
+                scrivi_riga(json.dumps(risposta, ensure_ascii=False))
+
+        for riga in righe:
+            riga = riga.strip()
+            if not riga:
+                continue
+            try:
+                richiesta = json.loads(riga)
+                if not isinstance(richiesta, dict):
+                    raise ValueError("la richiesta deve essere un oggetto JSON")
+            except ValueError as e:
+                rispondi({"id": None, "ok": False, "errore": f"Richiesta non valida: {e}"})
+                continue
+
+            comando = richiesta.get("comando")
+            if comando is not None:
+                rispondi(self._comando(comando, richiesta))
+                if comando == "arresta":
+                    break
+                continue
+
+            # La risposta è scritta dal worker stesso: a futura completata è già inviata
+            in_corso.append(self._pool.submit(lambda r=richiesta: rispondi(self._esegui(r))))
+
+        for futura in in_corso:
+            futura.result()
+
+    def arrestato(self) -> bool:
+        return self._arresto.is_set()
+
+    def chiudi(self):
+        self._pool.shutdown(wait=True)
+
+    def _esegui(self, richiesta: dict) -> dict:
+        risposta = esegui_richiesta(richiesta)
+        with self._lock:
+            self.richieste += 1
+            self.errori += not risposta["ok"]
+        return risposta
+
+    def _comando(self, comando: str, richiesta: dict) -> dict:
+        if comando == "stato":
+            from core.cache_base import CACHE_BASE
+            from core.memo import CACHE_STADI
+            return {"id": richiesta.get("id"), "ok": True, "pid": os.getpid(),
+                    "attivo_da_s": round(time.time() - self.avvio, 3),
+                    "workers": self.workers, "richieste": self.richieste, "errori": self.errori,
+                    "cache_base": {"hit": CACHE_BASE.hit, "miss": CACHE_BASE.miss},
+                    "cache_stadi": len(CACHE_STADI)}
+        if comando == "arresta":
+            self._arresto.set()
+            return {"id": richiesta.get("id"), "ok": True}
+        return {"id": richiesta.get("id"), "ok": False, "errore": f"Comando sconosciuto: '{comando}'"}
+
+
+def servi_socket(path: Optional[str] = None, workers: Optional[int] = None):
+    """Servizio su socket Unix: una connessione per client, più client in parallelo."""
+    if not hasattr(socket, "AF_UNIX"):
+        raise RuntimeError("Socket Unix non disponibili su questa piattaforma: usare --stdin")
+    path = path or percorso_socket()
+    if os.path.exists(path):
+        if _attivo(path):
+            raise RuntimeError(f"Servizio già attivo su {path}")
+        os.remove(path)  # socket rimasto da un processo terminato
+
+    servizio = Servizio(workers)
+    servizio.riscalda()
+
+    class Gestore(socketserver.StreamRequestHandler):
+        def handle(self):
+            def scrivi_riga(riga: str):
+                self.wfile.write(riga.encode("utf-8") + b"\n")
+                self.wfile.flush()
+
+            righe = (r.decode("utf-8") for r in self.rfile)
+            servizio.servi_righe(righe, scrivi_riga)
+            if servizio.arrestato():
+                threading.Thread(target=server.shutdown, daemon=True).start()
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    server = Server(path, Gestore)
+    os.chmod(path, 0o600)
+    print(f"[OK] Servizio in ascolto su {path} (pid {os.getpid()}, {servizio.workers} worker)",
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        servizio.chiudi()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def servi_stdin(workers: Optional[int] = None):
+    """
+    Servizio su stdin/stdout, per chi avvia il processo come figlio.
+    stdout è riservato alle risposte: ogni altra stampa va su stderr.
+    """
+    uscita = sys.stdout
+    sys.stdout = sys.stderr
+    servizio = Servizio(workers)
+    servizio.riscalda()
+
+    def scrivi_riga(riga: str):
+        uscita.write(riga + "\n")
+        uscita.flush()
+
+    try:
+        servizio.servi_righe(sys.stdin, scrivi_riga)
+    finally:
+        servizio.chiudi()
+        sys.stdout = uscita
+
+
+# ═══════════════════════════════════════════════════════
+# CLIENT
+# ═══════════════════════════════════════════════════════
+
+def invia(richieste: list[dict], path: Optional[str] = None,
+          timeout: Optional[float] = None) -> list[dict]:
+    """
+    Invia le richieste al servizio e restituisce le risposte nell'ordine delle richieste.
+    Lancia OSError (es. FileNotFoundError, ConnectionRefusedError) se il servizio non è attivo.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        raise OSError("Socket Unix non disponibili")
+    richieste = [dict(r, id=i) for i, r in enumerate(richieste)]
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(path or percorso_socket())
+        s.sendall("".join(json.dumps(r) + "\n" for r in richieste).encode("utf-8"))
+        s.shutdown(socket.SHUT_WR)
+        with s.makefile("r", encoding="utf-8") as f:
+            risposte = [json.loads(riga) for riga in f if riga.strip()]
+
+    per_id = {r.get("id"): r for r in risposte}
+    return [per_id.get(i, {"id": i, "ok": False, "errore": "Nessuna risposta dal servizio"})
+            for i in range(len(richieste))]
+
+
+def esegui(specs: list[dict], path: Optional[str] = None,
+           fallback: bool = True) -> tuple[list[dict], bool]:
+    """
+    Esegue le specifiche tramite il servizio, oppure nel processo corrente se
+    il servizio non risponde (e fallback=True).
+    Restituisce (risposte, eseguito_dal_servizio).
+    """
+    cwd = os.getcwd()
+    richieste = [dict(spec, cwd=spec.get("cwd", cwd)) for spec in specs]
+    try:
+        return invia(richieste, path), True
+    except OSError:
+        if not fallback:
+            raise
+    from core.console import silenzioso
+    with silenzioso():
+        return [dict(_esegui_in_locale(r), id=i) for i, r in enumerate(richieste)], False
+
+
+def _esegui_in_locale(richiesta: dict) -> dict:
+    # I comandi riguardano il processo servizio: senza servizio non c'è nulla da interrogare
+    if "comando" in richiesta:
+        return {"ok": False, "errore": f"Servizio non attivo: comando '{richiesta['comando']}' non eseguito"}
+    return esegui_richiesta(richiesta)
+
+
+# ═══════════════════════════════════════════════════════
+# INTERNI
+# ═══════════════════════════════════════════════════════
+
+def _attivo(path: str) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(path)
+        except OSError:
+            return False
+    return True
+
+
+def _risolvi_path(richiesta: dict) -> dict:
+    spec = {k: v for k, v in richiesta.items() if k not in ("id", "cwd")}
+    cwd = richiesta.get("cwd")
+    if cwd:
+        spec.setdefault("output", "./output")
+        for chiave in CHIAVI_PATH:
+            valore = spec.get(chiave)
+            if isinstance(valore, str) and valore:
+                spec[chiave] = _assoluto(valore, cwd)
+        if spec.get("keyframe") not in (None, ""):
+            spec["keyframe"] = _risolvi_keyframe(spec["keyframe"], cwd)
+        riferimento = isinstance(spec.get("funzione"), str) and _FUNZIONE_DA_FILE.match(spec["funzione"].strip())
+        if riferimento:
+            spec["funzione"] = _assoluto(riferimento["file"], cwd) + riferimento["nome"]
+    return spec
+
+
+def _assoluto(path: str, cwd: str) -> str:
+    return path if os.path.isabs(path) else os.path.normpath(os.path.join(cwd, path))
+
+
+def _risolvi_keyframe(valore, cwd: str) -> list:
+    """Keyframe come lista, con i riferimenti .wav ('banco.wav#3') resi assoluti."""
+    # Stessa divisione di core.spec._come_lista: nei manifest CSV le chiavi sono separate da ';'
+    chiavi = [k for k in (p.strip() for p in valore.split(";")) if k] if isinstance(valore, str) else valore
+    return [_assoluto(k, cwd) if isinstance(k, str) and ".wav" in k.lower() else k for k in chiavi]
+
+
+def _file_scritti(preset) -> list[str]:
+    cartella = preset._output_dir or "output"
+    scritti = []
+    if preset.wavetable and preset.wavetable.campioni is not None:
+        scritti.append(os.path.abspath(os.path.join(cartella, f"{preset.nome}_wavetable.wav")))
+    if preset._anteprima is not None:
+        scritti.append(os.path.abspath(os.path.join(cartella, f"{preset.nome}_anteprima.wav")))
+    if preset._fxp_bytes is not None:
+        scritti.append(os.path.abspath(os.path.join(cartella, f"{preset.nome}.fxp")))
+    return scritti
@@ -0,0 +1,353 @@
+"""
+Conversione da specifiche testuali (argomenti CLI, righe di manifest)
+agli oggetti di input della pipeline.
+"""
+
+import os
+import re
+import sys
+
+from models.input_schema import (
+    PresetInput, WavetableInput, SpettroInput, MorphInput,
+    ModulazioneInput, ParametroInput, EnvelopeInput, AnteprimaInput
+)
+
+# Riferimento a una funzione Python in un file: "modello.py:corda"
+_RIFERIMENTO_PY = re.compile(r"^(?P<file>.+\.py):(?P<nome>[A-Za-z_]\w*)$")
+
+
+def parse_funzione(expr: str, consenti_file: bool = False):
+    """
+    Converte una stringa matematica in una funzione Python/numpy.
+    L'espressione è compilata una volta sola e condivisa tramite cache.
+    Con consenti_file=True un riferimento 'file.py:nome' carica invece la
+    funzione f(x) o f(x, t) definita nel file (es. modelli campione per
+    campione non vettorizzabili). Importare il file esegue codice arbitrario:
+    lo consente solo la CLI con --consenti-python, mai manifest o servizio.
+    """
+    riferimento = _RIFERIMENTO_PY.match(expr.strip())
+    if riferimento:
+        if not consenti_file:
+            raise ValueError(f"Funzione da file Python '{expr}' non consentita: "
+                             f"usare --consenti-python da riga di comando "
+                             f"(non ammessa nei manifest né nelle richieste al servizio)")
+        return carica_funzione(riferimento["file"], riferimento["nome"])
+    from core.espressioni import compila_espressione  # importa numpy
+    return compila_espressione(expr)
+
+
+def carica_funzione(path: str, nome: str):
+    """
+    Funzione nome dal file Python path. Il file è importato come modulo (la sua
+    cartella entra in sys.path), così la funzione resta serializzabile per
+    riferimento e può essere valutata anche dal render su processi.
+    """
+    import importlib
+    if not os.path.isfile(path):
+        raise ValueError(f"File della funzione non trovato: '{path}'")
+    cartella = os.path.dirname(os.path.abspath(path))
+    nome_modulo = os.path.splitext(os.path.basename(path))[0]
+    if cartella not in sys.path:
+        sys.path.insert(0, cartella)
+    try:
+        modulo = importlib.import_module(nome_modulo)
+    except Exception as e:
+        raise ValueError(f"Impossibile importare '{path}': {e}")
+    if os.path.abspath(getattr(modulo, "__file__", "") or "") != os.path.abspath(path):
+        raise ValueError(f"'{path}': il nome '{nome_modulo}' è già usato da un altro modulo")
+    funzione = getattr(modulo, nome, None)
+    if not callable(funzione):
+        raise ValueError(f"'{path}' non definisce una funzione '{nome}'")
+    return funzione
+
+
+def parse_spettro(ampiezze, fasi=None, limite=None) -> SpettroInput:
+    """
+    Spettro armonico da specifica testuale. Ampiezze e fasi possono essere:
+      - un'espressione in k (indice dell'armonica) e t, es. "1/k" o "(k % 2)/k * (1 - t)"
+      - una lista di espressioni in t, una per armonica, es. ["1", "0.5*t", "1/3"]
+      - numeri: una lista (uguale per ogni frame) o una lista di liste (frame × armoniche)
+    """
+    try:
+        limite = int(limite) if limite not in (None, "") else None
+    except ValueError:
+        raise ValueError(f"limite armoniche '{limite}' non è un intero valido")
+    return SpettroInput(
+        ampiezze=_valori_spettro(ampiezze),
+        fasi=_valori_spettro(fasi) if fasi not in (None, "") else None,
+        limite=limite,
+    )
+
+
+def _valori_spettro(valori):
+    from core.espressioni import compila_espressione, VARIABILI_SPETTRO  # importa numpy
+    if isinstance(valori, str):
+        return compila_espressione(valori, VARIABILI_SPETTRO)
+    if isinstance(valori, (list, tuple)) and any(isinstance(v, str) for v in valori):
+        return [compila_espressione(v, VARIABILI_SPETTRO) if isinstance(v, str) else v
+                for v in valori]
+    return valori
+
+
+def parse_morph(chiavi, modo: str = "lineare", posizioni=None) -> MorphInput:
+    """
+    Frame chiave da specifica testuale: ogni chiave è un'espressione in x
+    oppure un riferimento a un .wav ('banco.wav', 'banco.wav#3', 'banco.wav#2:5').
+    posizioni: lista di numeri o stringa '0,0.25,1'.
+    """
+    from core.espressioni import compila_espressione  # importa numpy
+    risolte = []
+    for chiave in _come_lista(chiavi):
+        if isinstance(chiave, str) and ".wav" in chiave.lower():
+            risolte.append(chiave)
+        elif isinstance(chiave, str):
+            risolte.append(compila_espressione(chiave))
+        else:
+            risolte.append(chiave)
+    if isinstance(posizioni, str):
+        try:
+            posizioni = [float(p) for p in posizioni.split(",")]
+        except ValueError:
+            raise ValueError(f"posizioni '{posizioni}': formato atteso T1,T2,...  (es. 0,0.3,1)")
+    return MorphInput(chiavi=risolte, posizioni=posizioni, modo=modo or "lineare")
+
+
+def parse_mod(raw: str) -> ModulazioneInput:
+    parti = [p.strip() for p in raw.split(",")]
+    if len(parti) != 3:
+        raise ValueError(f"--mod '{raw}': formato atteso SRC,DST,QTY  (es. LFO1,FILTER_CUTOFF,0.8)")
+    src, dst, qty_str = parti
+    try:
+        qty = float(qty_str)
+    except ValueError:
+        raise ValueError(f"--mod '{raw}': quantità '{qty_str}' non è un numero valido")
+    return ModulazioneInput(sorgente=src, destinazione=dst, quantita=qty)
+
+
+def parse_param(raw: str) -> ParametroInput:
+    parti = [p.strip() for p in raw.split(",")]
+    if len(parti) != 2:
+        raise ValueError(f"--param '{raw}': formato atteso NOME,VALORE  (es. filter_cutoff,0.4)")
+    nome, val_str = parti
+    try:
+        valore = float(val_str)
+    except ValueError:
+        raise ValueError(f"--param '{raw}': valore '{val_str}' non è un numero valido")
+    return ParametroInput(nome=nome, valore=valore)
+
+
+def parse_env(raw: str) -> EnvelopeInput:
+    parti = [p.strip() for p in raw.split(",")]
+    if len(parti) != 5:
+        raise ValueError(f"--env '{raw}': formato atteso TARGET,A,D,S,R  (es. ENV1,0.01,0.2,0.6,0.5)")
+    target, a, d, s, r = parti
+    try:
+        return EnvelopeInput(
+            attack=float(a), decay=float(d),
+            sustain=float(s), release=float(r),
+            target=target
+        )
+    except ValueError as err:
+        raise ValueError(f"--env '{raw}': {err}")
+
+
+def parse_anteprima(raw) -> AnteprimaInput:
+    """
+    Impostazioni dell'anteprima audio:
+      True / "" / "si"    → valori di default (nota 48, 2 secondi)
+      "NOTA,DURATA"       → es. "60,1.5"
+      {"nota": .., "durata": .., "rate": ..}
+    """
+    if isinstance(raw, dict):
+        try:
+            return AnteprimaInput(**raw)
+        except TypeError as e:
+            raise ValueError(f"anteprima: {e}")
+    if raw is True or (isinstance(raw, str) and raw.strip().lower() in ("", "si", "sì", "true", "1")):
+        return AnteprimaInput()
+    parti = [p.strip() for p in str(raw).split(",")]
+    if len(parti) > 2:
+        raise ValueError(f"--anteprima '{raw}': formato atteso NOTA[,DURATA]  (es. 60,1.5)")
+    try:
+        valori = [float(p) for p in parti]
+    except ValueError:
+        raise ValueError(f"--anteprima '{raw}': formato atteso NOTA[,DURATA]  (es. 60,1.5)")
+    return AnteprimaInput(*valori)
+
+
+# ═══════════════════════════════════════════════════════
+# SPECIFICHE (dict) → PresetInput
+# ═══════════════════════════════════════════════════════
+
+def _come_lista(valore) -> list:
+    """Accetta una stringa singola, una lista o None (campi ripetibili)."""
+    if valore is None or valore == "":
+        return []
+    if isinstance(valore, str):
+        # Nei manifest CSV più valori stanno nella stessa cella, separati da ';'
+        return [v for v in (p.strip() for p in valore.split(";")) if v]
+    return list(valore)
+
+
+SORGENTI_WAVETABLE = ("funzione", "wav", "armoniche", "keyframe")
+
+
+def preset_da_spec(spec: dict) -> PresetInput:
+    """
+    Costruisce un PresetInput da un dizionario con le stesse chiavi
+    degli argomenti CLI: nome, base, funzione | wav | armoniche (+ fasi,
+    limite_armoniche) | keyframe (+ morph, posizioni), frame, mod, param, env,
+    anteprima, output.
+    I campi ripetibili accettano stringhe nel formato CLI oppure liste.
+    Lancia ValueError con tutti gli errori trovati.
+    """
+    errori = []
+
+    for chiave in ("nome", "base"):
+        if not spec.get(chiave):
+            errori.append(f"campo obbligatorio mancante: '{chiave}'")
+
+    if sum(spec.get(k) not in (None, "") for k in SORGENTI_WAVETABLE) > 1:
+        errori.append("specifica solo uno tra " + ", ".join(f"'{k}'" for k in SORGENTI_WAVETABLE))
+
+    wavetable = None
+    n_frame = int(spec.get("frame") or 8)
+    if spec.get("funzione"):
+        try:
+            wavetable = WavetableInput(funzione=parse_funzione(spec["funzione"]), n_frame=n_frame)
+        except ValueError as e:
+            errori.append(str(e))
+    elif spec.get("wav"):
+        wavetable = WavetableInput(file_wav=spec["wav"])
+    elif spec.get("armoniche") not in (None, ""):
+        try:
+            spettro = parse_spettro(spec["armoniche"], spec.get("fasi"), spec.get("limite_armoniche"))
+            wavetable = WavetableInput(spettro=spettro, n_frame=n_frame)
+        except ValueError as e:
+            errori.append(str(e))
+    elif spec.get("keyframe") not in (None, ""):
+        try:
+            morph = parse_morph(spec["keyframe"], spec.get("morph"), spec.get("posizioni"))
+            wavetable = WavetableInput(morph=morph, n_frame=n_frame)
+        except ValueError as e:
+            errori.append(str(e))
+
+    modulazioni = []
+    for raw in _come_lista(spec.get("mod")):
+        try:
+            if isinstance(raw, dict):
+                modulazioni.append(ModulazioneInput(**raw))
+            else:
+                modulazioni.append(parse_mod(raw))
+        except (ValueError, TypeError) as e:
+            errori.append(str(e))
+
+    parametri = []
+    for raw in _come_lista(spec.get("param")):
+        try:
+            if isinstance(raw, dict):
+                parametri.append(ParametroInput(**raw))
+            else:
+                parametri.append(parse_param(raw))
+        except (ValueError, TypeError) as e:
+            errori.append(str(e))
+
+    envelopes = []
+    for raw in _come_lista(spec.get("env")):
+        try:
+            if isinstance(raw, dict):
+                envelopes.append(EnvelopeInput(**raw))
+            else:
+                envelopes.append(parse_env(raw))
+        except (ValueError, TypeError) as e:
+            errori.append(str(e))
+
+    anteprima = None
+    if spec.get("anteprima") not in (None, False, "", "no"):
+        try:
+            anteprima = parse_anteprima(spec["anteprima"])
+        except ValueError as e:
+            errori.append(str(e))
+
+    if errori:
+        raise ValueError("; ".join(errori))
+
+    preset = PresetInput(
+        nome=spec["nome"],
+        base_fxp=spec["base"],
+        wavetable=wavetable,
+        modulazioni=modulazioni,
+        parametri=parametri,
+        envelopes=envelopes,
+        anteprima=anteprima,
+    )
+    preset._output_dir = spec.get("output") or "./output"
+    return preset
+
+
+# ═══════════════════════════════════════════════════════
+# ASSI DI SWEEP
+# ═══════════════════════════════════════════════════════
+
+def parse_valori(raw: str) -> list[float]:
+    """
+    Valori di un asse di sweep:
+      "0.4"            → un solo valore
+      "0.1|0.5|0.9"    → lista
+      "0.1:0.9:5"      → 5 valori equispaziati da 0.1 a 0.9 inclusi
+    """
+    raw = raw.strip()
+    try:
+        if ":" in raw:
+            inizio, fine, n = raw.split(":")
+            inizio, fine, n = float(inizio), float(fine), int(n)
+            if n < 1:
+                raise ValueError("il numero di valori deve essere almeno 1")
+            if n == 1:
+                return [inizio]
+            passo = (fine - inizio) / (n - 1)
+            return [inizio + passo * i for i in range(n)]
+        return [float(v) for v in raw.split("|")]
+    except ValueError as err:
+        raise ValueError(f"valori '{raw}' non validi (usa V, V1|V2|V3 oppure INIZIO:FINE:N): {err}")
+
+
+def parse_assi_sweep(mod: list[str], param: list[str], env: list[str]) -> dict[tuple, list[float]]:
+    """Converte gli argomenti --mod/--param/--env di uno sweep negli assi di core.sweep."""
+    assi: dict[tuple, list[float]] = {}
+    errori = []
+
+    for raw in mod:
+        parti = [p.strip() for p in raw.split(",")]
+        if len(parti) != 3:
+            errori.append(f"--mod '{raw}': formato atteso SRC,DST,VALORI")
+            continue
+        try:
+            assi[("mod", parti[0], parti[1])] = parse_valori(parti[2])
+        except ValueError as e:
+            errori.append(f"--mod '{raw}': {e}")
+
+    for raw in param:
+        parti = [p.strip() for p in raw.split(",")]
+        if len(parti) != 2:
+            errori.append(f"--param '{raw}': formato atteso NOME,VALORI")
+            continue
+        try:
+            assi[("param", parti[0])] = parse_valori(parti[1])
+        except ValueError as e:
+            errori.append(f"--param '{raw}': {e}")
+
+    for raw in env:
+        parti = [p.strip() for p in raw.split(",")]
+        if len(parti) != 5:
+            errori.append(f"--env '{raw}': formato atteso TARGET,A,D,S,R")
+            continue
+        for campo, valori in zip(("attack", "decay", "sustain", "release"), parti[1:]):
+            try:
+                assi[("env", parti[0], campo)] = parse_valori(valori)
+            except ValueError as e:
+                errori.append(f"--env '{raw}' ({campo}): {e}")
+
+    if errori:
+        raise ValueError("; ".join(errori))
+    return assi
@@ -0,0 +1,242 @@
+"""
+Sweep di parametri: genera tutte le combinazioni (o un sottoinsieme campionato)
+di valori per parametri statici, quantità di modulazione e campi degli envelope.
+Gli stadi costosi (validazione, wavetable, lettura della base) vengono eseguiti
+una sola volta; per ogni variante si ripetono solo codifica, assemblaggio e scrittura.
+
+Gli assi sono indicati con tuple:
+    ("param", "filter_cutoff")            → valore del parametro
+    ("mod", "LFO1", "FILTER_CUTOFF")      → quantità del collegamento
+    ("env", "ENV1", "attack")             → campo dell'envelope
+"""
+
+import itertools
+import math
+import random
+from dataclasses import replace
+from typing import TYPE_CHECKING, Iterator, Optional
+
+from models.input_schema import PresetInput, ModulazioneInput, ParametroInput, EnvelopeInput
+from core.validator import valida_input, _valida_parametro, _valida_modulazione, _valida_envelope
+from core.modulation import codifica_modulazioni, codifica_modulazioni_batch, codifica_parametri
+from core.encoder import assembla_fxp
+from core.cache_base import CACHE_BASE
+from output_io.writer import scrivi_output, in_archivio
+from core.pipeline import esegui_stadi, risolvi_wavetable, renderizza_anteprima
+from core.metriche import Metriche
+
+if TYPE_CHECKING:
+    import numpy as np
+    from models.preset_batch import PresetBatch
+
+CAMPI_ENVELOPE = ("attack", "decay", "sustain", "release")
+
+# Stadi ripetuti per ogni variante
+STADI_VARIANTE = [
+    codifica_modulazioni,
+    codifica_parametri,
+    assembla_fxp,
+    scrivi_output,
+]
+
+
+def espandi_sweep(assi: dict[tuple, list[float]], campioni: Optional[int] = None,
+                  seed: int = 0) -> Iterator[dict[tuple, float]]:
+    """
+    Genera le combinazioni degli assi come dizionari asse → valore.
+    Con campioni=N restituisce N combinazioni distinte scelte a caso (riproducibili
+    dal seed) senza materializzare il prodotto cartesiano completo.
+    """
+    chiavi = list(assi)
+    valori = [list(assi[k]) for k in chiavi]
+    totale = math.prod(len(v) for v in valori)
+
+    if campioni is None or campioni >= totale:
+        for combinazione in itertools.product(*valori):
+            yield dict(zip(chiavi, combinazione))
+        return
+
+    for indice in sorted(random.Random(seed).sample(range(totale), campioni)):
+        combinazione = []
+        for v in reversed(valori):
+            indice, resto = divmod(indice, len(v))
+            combinazione.append(v[resto])
+        yield dict(zip(chiavi, reversed(combinazione)))
+
+
+def applica_variante(preset: PresetInput, variante: dict[tuple, float], nome: str) -> PresetInput:
+    """Copia del preset con i valori della variante applicati (il preset originale non cambia)."""
+    parametri = list(preset.parametri)
+    modulazioni = list(preset.modulazioni)
+    envelopes = list(preset.envelopes)
+
+    for asse, valore in variante.items():
+        tipo = asse[0]
+        if tipo == "param":
+            nome_par = asse[1]
+            i = next((i for i, p in enumerate(parametri) if p.nome == nome_par), None)
+            if i is None:
+                parametri.append(ParametroInput(nome_par, valore))
+            else:
+                parametri[i] = replace(parametri[i], valore=valore)
+        elif tipo == "mod":
+            src, dst = asse[1], asse[2]
+            i = next((i for i, m in enumerate(modulazioni)
+                      if m.sorgente == src and m.destinazione == dst), None)
+            if i is None:
+                modulazioni.append(ModulazioneInput(src, dst, valore))
+            else:
+                modulazioni[i] = replace(modulazioni[i], quantita=valore)
+        elif tipo == "env":
+            target, campo = asse[1], asse[2]
+            i = next((i for i, e in enumerate(envelopes) if e.target == target), None)
+            if i is None:
+                envelopes.append(EnvelopeInput(target=target, **{campo: valore}))
+            else:
+                envelopes[i] = replace(envelopes[i], **{campo: valore})
+        else:
+            raise ValueError(f"Asse di sweep sconosciuto: {asse}")
+
+    variante_preset = replace(preset, nome=nome, parametri=parametri,
+                              modulazioni=modulazioni, envelopes=envelopes)
+    variante_preset._output_dir = preset._output_dir  # non è un campo di init: replace non lo copia
+    return variante_preset
+
+
+def matrice_sweep(assi: dict[tuple, list[float]], campioni: Optional[int] = None,
+                  seed: int = 0) -> "np.ndarray":
+    """
+    Le stesse combinazioni di espandi_sweep, nello stesso ordine, come matrice
+    float64 (varianti × assi) calcolata senza un dizionario per variante.
+    """
+    import numpy as np
+
+    valori = [np.asarray(list(assi[k]), dtype=np.float64) for k in assi]
+    dimensioni = [len(v) for v in valori]
+    totale = math.prod(dimensioni)
+    if campioni is None or campioni >= totale:
+        indici = np.arange(totale)
+    else:
+        indici = np.array(sorted(random.Random(seed).sample(range(totale), campioni)), dtype=np.int64)
+    if not valori:
+        return np.empty((len(indici), 0))
+    # Ordine C: l'ultimo asse varia più in fretta, come itertools.product
+    coordinate = np.unravel_index(indici, dimensioni)
+    return np.column_stack([v[c] for v, c in zip(valori, coordinate)])
+
+
+def varianti_sweep(preset: PresetInput, assi: dict[tuple, list[float]],
+                   campioni: Optional[int] = None, seed: int = 0) -> "PresetBatch":
+    """
+    Tutte le varianti dello sweep come PresetBatch colonnare.
+    La struttura delle righe è la stessa per ogni variante (dipende solo dagli
+    assi): si ricava una volta con applica_variante, poi si replica per tutte le
+    varianti e si scrivono i valori degli assi colonna per colonna.
+    """
+    import numpy as np
+    from models.preset_batch import PresetBatch
+
+    matrice = matrice_sweep(assi, campioni, seed)
+    n = len(matrice)
+    modello = applica_variante(preset, {asse: valori[0] for asse, valori in assi.items()}, preset.nome)
+    unico = PresetBatch.da_preset([modello])
+
+    tabelle = {}
+    for nome in ("modulazioni", "parametri", "envelopes"):
+        righe = getattr(unico, nome)
+        tabella = np.tile(righe, n)
+        tabella["preset"] = np.repeat(np.arange(n, dtype=np.int32), len(righe))
+        tabelle[nome] = tabella
+
+    for k, asse in enumerate(assi):
+        nome, riga, colonna = _cella_asse(modello, asse)
+        passo = len(getattr(unico, nome))
+        tabelle[nome][colonna][riga::passo] = matrice[:, k]
+
+    return PresetBatch(
+        nomi=[f"{preset.nome}_{i:04d}" for i in range(n)],
+        basi=[preset.base_fxp] * n,
+        vocabolario=unico.vocabolario,
+        wavetable=[preset.wavetable] * n,
+        output_dir=[preset._output_dir] * n,
+        **tabelle,
+    )
+
+
+def _cella_asse(modello: PresetInput, asse: tuple) -> tuple[str, int, str]:
+    """(tabella, riga, colonna) in cui applica_variante scrive il valore dell'asse."""
+    tipo = asse[0]
+    if tipo == "param":
+        riga = next(i for i, p in enumerate(modello.parametri) if p.nome == asse[1])
+        return "parametri", riga, "valore"
+    if tipo == "mod":
+        riga = next(i for i, m in enumerate(modello.modulazioni)
+                    if m.sorgente == asse[1] and m.destinazione == asse[2])
+        return "modulazioni", riga, "quantita"
+    riga = next(i for i, e in enumerate(modello.envelopes) if e.target == asse[1])
+    return "envelopes", riga, asse[2]
+
+
+def valida_assi(assi: dict[tuple, list[float]]) -> list[str]:
+    """Controlla una volta sola tutti i valori di ogni asse."""
+    errori = []
+    for asse, valori in assi.items():
+        if not valori:
+            errori.append(f"Asse {asse}: nessun valore")
+        tipo = asse[0]
+        for v in valori:
+            if tipo == "param":
+                errori += _valida_parametro(ParametroInput(asse[1], v))
+            elif tipo == "mod":
+                errori += _valida_modulazione(ModulazioneInput(asse[1], asse[2], v))
+            elif tipo == "env":
+                if asse[2] not in CAMPI_ENVELOPE:
+                    errori.append(f"Asse {asse}: campo envelope sconosciuto '{asse[2]}'")
+                    break
+                errori += _valida_envelope(EnvelopeInput(target=asse[1], **{asse[2]: v}))
+            else:
+                errori.append(f"Asse di sweep sconosciuto: {asse}")
+                break
+    return errori
+
+
+def esegui_sweep(preset: PresetInput, assi: dict[tuple, list[float]],
+                 campioni: Optional[int] = None, seed: int = 0,
+                 scrivi: bool = True, metriche: Optional[Metriche] = None) -> list[PresetInput]:
+    """
+    Esegue lo sweep a partire da un preset base.
+    Le varianti si chiamano '<nome>_0000', '<nome>_0001', ...
+    La wavetable, uguale per tutte le varianti, viene scritta una sola volta
+    come '<nome>_wavetable.wav' (e l'anteprima, se richiesta, come
+    '<nome>_anteprima.wav'). Dentro scrittura_in_archivio() ogni variante
+    conserva wavetable e anteprima, così la sua riga di indice punta
+    all'unica copia nell'archivio. Con scrivi=False non scrive nulla su disco e restituisce
+    le varianti con i bytes .fxp in memoria.
+    """
+    errori = valida_assi(assi)
+    if errori:
+        raise ValueError("Errori negli assi di sweep:\n" + "\n".join(f"  - {e}" for e in errori))
+
+    # Stadi condivisi: una sola volta per tutto lo sweep
+    preset = esegui_stadi(preset, [valida_input, risolvi_wavetable, renderizza_anteprima],
+                          metriche=metriche)
+    CACHE_BASE.leggi(preset.base_fxp)
+    archivio = scrivi and in_archivio()
+    if scrivi and preset.wavetable is not None and not archivio:
+        esegui_stadi(preset, [scrivi_output], metriche=metriche)
+
+    # La mod matrix di tutte le varianti viene codificata in un colpo solo
+    stadi = [s for s in STADI_VARIANTE if s is not codifica_modulazioni]
+    stadi = stadi if scrivi else stadi[:-1]
+    varianti = varianti_sweep(preset, assi, campioni, seed)
+    _, mod_bytes = codifica_modulazioni_batch(varianti)
+    risultati = []
+    for i in range(len(varianti)):
+        corrente = varianti[i]
+        if not archivio:
+            corrente.wavetable = None  # già scritta una volta sola
+        else:
+            corrente._anteprima = preset._anteprima
+        corrente._mod_bytes = mod_bytes[i]
+        risultati.append(esegui_stadi(corrente, stadi, metriche=metriche))
+    return risultati
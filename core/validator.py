@@ -1,9 +1,29 @@
 import os
-from models.input_schema import PresetInput, WavetableInput, ModulazioneInput, ParametroInput
+from functools import lru_cache
+from typing import TYPE_CHECKING, Callable, Iterable, Union
+
+from models.input_schema import (
+    PresetInput, WavetableInput, SpettroInput, MorphInput, ModulazioneInput, ParametroInput, AnteprimaInput,
+)
 from maps.sources import SORGENTI
 from maps.destinations import DESTINAZIONI
+from core.memo import stadio
+
+if TYPE_CHECKING:  # numpy si carica solo con valida_batch
+    from models.preset_batch import PresetBatch
+
+MAX_ARMONICHE = 1023  # FRAME_SIZE // 2 - 1 (core/wavetable.py, non importato: usa numpy)
+MODI_MORPH = ("lineare", "spettrale")
+DURATA_MAX_ANTEPRIMA = 60.0  # secondi
 
+# Insiemi e messaggi dei nomi validi, costruiti una volta sola
+NOMI_SORGENTI = frozenset(SORGENTI)
+NOMI_DESTINAZIONI = frozenset(DESTINAZIONI)
+_ELENCO_SORGENTI = str(list(SORGENTI))
+_ELENCO_DESTINAZIONI = str(list(DESTINAZIONI))
 
+
+@stadio(dipende_da=("base_fxp", "wavetable", "modulazioni", "parametri", "envelopes", "anteprima"))
 def valida_input(preset: PresetInput) -> PresetInput:
     """
     Stadio 1 della pipeline.
@@ -20,6 +40,10 @@ def valida_input(preset: PresetInput) -> PresetInput:
     if preset.wavetable:
         errori += _valida_wavetable(preset.wavetable)
 
+    # Controlla anteprima
+    if preset.anteprima is not None:
+        errori += valida_anteprima(preset.anteprima)
+
     # Controlla modulazioni
     for mod in preset.modulazioni:
         errori += _valida_modulazione(mod)
@@ -38,42 +62,224 @@ def valida_input(preset: PresetInput) -> PresetInput:
     return preset  # passa allo stadio successivo
 
 
-def _valida_wavetable(wt: WavetableInput) -> list[str]:
+def valida_batch(presets: Union[Iterable[PresetInput], "PresetBatch"]) -> dict[int, list[str]]:
+    """
+    Valida molti preset in un colpo solo, con gli stessi controlli e messaggi di valida_input.
+    Accetta un PresetBatch o una sequenza di PresetInput (convertita in PresetBatch).
+    Non lancia eccezioni: restituisce {indice del preset: errori} solo per i preset non validi.
+    - ogni path (base, wav, keyframe) viene controllato su disco una volta sola
+    - ogni nome del vocabolario del batch viene cercato una volta sola
+    - quantità, parametri ed envelope sono confrontati con i range colonna per colonna
+    """
+    import numpy as np
+    from models.preset_batch import PresetBatch
+
+    batch = presets if isinstance(presets, PresetBatch) else PresetBatch.da_preset(presets)
+    nomi = batch.vocabolario.nomi
+    esiste = _esiste_in_cache()
+    # (preset, gruppo, elemento, ordine, messaggio): ordinando si ritrova
+    # la sequenza in cui valida_input riporterebbe gli errori
     errori = []
-    fonti = [wt.funzione, wt.campioni, wt.file_wav]
+
+    for i, base in enumerate(batch.basi):
+        if not esiste(base):
+            errori.append((i, 0, 0, 0, f"File base non trovato: {base}"))
+    for i, wt in enumerate(batch.wavetable):
+        if wt:
+            errori += [(i, 1, 0, j, e) for j, e in enumerate(_valida_wavetable(wt, esiste))]
+
+    # Modulazioni: validità di ogni codice del vocabolario, poi lookup per riga
+    m = batch.modulazioni
+    pos = batch.posizioni("modulazioni")
+    sorgente_ok = np.array([n in NOMI_SORGENTI for n in nomi], dtype=bool)
+    destinazione_ok = np.array([n in NOMI_DESTINAZIONI for n in nomi], dtype=bool)
+    aux_ok = sorgente_ok.copy()
+    aux_ok[0] = True  # nessuna aux
+    nomi_errati = ~(sorgente_ok[m["sorgente"]] & destinazione_ok[m["destinazione"]] & aux_ok[m["aux"]])
+    for k in np.flatnonzero(nomi_errati):
+        _, src, dst, qty, aux = m[k].tolist()
+        mod = ModulazioneInput(nomi[src], nomi[dst], qty, nomi[aux])
+        errori += [(int(m["preset"][k]), 2, int(pos[k]), ordine, e) for ordine, e in _errori_nomi(mod)]
+
+    # Range: ~(dentro) conta anche i NaN come fuori range, come nei controlli singoli
+    q = m["quantita"]
+    for k in np.flatnonzero(~((q >= -1.0) & (q <= 1.0))):
+        src, dst = nomi[m["sorgente"][k]], nomi[m["destinazione"][k]]
+        errori.append((int(m["preset"][k]), 2, int(pos[k]), 2,
+                       f"Modulazione {src}→{dst}: quantità {float(q[k])} fuori range [-1.0, 1.0]"))
+
+    p = batch.parametri
+    pos = batch.posizioni("parametri")
+    v = p["valore"]
+    for k in np.flatnonzero(~((v >= 0.0) & (v <= 1.0))):
+        errori.append((int(p["preset"][k]), 3, int(pos[k]), 0,
+                       f"Parametro '{nomi[p['nome'][k]]}': valore {float(v[k])} fuori range [0.0, 1.0]"))
+
+    e = batch.envelopes
+    pos = batch.posizioni("envelopes")
+    fuori = np.column_stack([e[c] < 0 for c in _CAMPI_TEMPO]
+                            + [~((e["sustain"] >= 0.0) & (e["sustain"] <= 1.0))])
+    for k, campo in np.argwhere(fuori):
+        target = nomi[e["target"][k]]
+        if campo < len(_CAMPI_TEMPO):
+            messaggio = f"Envelope {target}: {_CAMPI_TEMPO[campo]} non può essere negativo"
+        else:
+            messaggio = f"Envelope {target}: sustain {float(e['sustain'][k])} fuori range [0.0, 1.0]"
+        errori.append((int(e["preset"][k]), 4, int(pos[k]), int(campo), messaggio))
+
+    report: dict[int, list[str]] = {}
+    for i, *_, messaggio in sorted(errori, key=lambda r: r[:4]):
+        report.setdefault(i, []).append(messaggio)
+    return report
+
+
+def suggerisci(nome: str, validi: Iterable[str]) -> str:
+    """Il nome valido più simile a nome (maiuscole ignorate), oppure stringa vuota."""
+    return _suggerisci(str(nome), validi if isinstance(validi, frozenset) else frozenset(validi))
+
+
+@lru_cache(maxsize=1024)
+def _suggerisci(nome: str, validi: frozenset) -> str:
+    from difflib import get_close_matches  # solo quando c'è davvero un nome sbagliato
+    per_chiave = {v.upper(): v for v in validi}
+    simili = get_close_matches(nome.upper(), per_chiave, n=1, cutoff=0.6)
+    return per_chiave[simili[0]] if simili else ""
+
+
+def _forse(nome: str, validi: frozenset) -> str:
+    simile = suggerisci(nome, validi)
+    return f" Forse '{simile}'?" if simile else ""
+
+
+def _esiste_in_cache() -> Callable[[str], bool]:
+    """os.path.exists con memoria dei path già controllati (vale per una sola validazione)."""
+    visti: dict[str, bool] = {}
+
+    def esiste(path: str) -> bool:
+        if path not in visti:
+            visti[path] = os.path.exists(path)
+        return visti[path]
+    return esiste
+
+
+def _valida_wavetable(wt: WavetableInput, esiste: Callable[[str], bool] = os.path.exists) -> list[str]:
+    errori = []
+    fonti = [wt.funzione, wt.campioni, wt.file_wav, wt.spettro, wt.morph]
     n_fonti = sum(f is not None for f in fonti)
 
     if n_fonti == 0:
-        errori.append("WavetableInput: nessuna sorgente specificata (funzione, campioni o file_wav)")
+        errori.append("WavetableInput: nessuna sorgente specificata "
+                      "(funzione, campioni, file_wav, spettro o morph)")
     elif n_fonti > 1:
         errori.append("WavetableInput: specifica esattamente UNA sorgente")
 
-    if wt.file_wav and not os.path.exists(wt.file_wav):
+    if wt.file_wav and not esiste(wt.file_wav):
         errori.append(f"WavetableInput: file non trovato: {wt.file_wav}")
 
     if wt.n_frame < 1 or wt.n_frame > 256:
         errori.append(f"WavetableInput: n_frame deve essere tra 1 e 256 (ricevuto {wt.n_frame})")
 
+    if wt.spettro is not None:
+        errori += _valida_spettro(wt.spettro)
+    if wt.morph is not None:
+        errori += _valida_morph(wt.morph, esiste)
+
     return errori
 
 
-def _valida_modulazione(mod: ModulazioneInput) -> list[str]:
+def valida_anteprima(ap: AnteprimaInput) -> list[str]:
+    """Errori nelle impostazioni dell'anteprima (usato anche dal comando 'anteprima')."""
+    errori = []
+    if not 0 <= ap.nota <= 127:
+        errori.append(f"Anteprima: nota MIDI {ap.nota} fuori range (0 – 127)")
+    if not 0 < ap.durata <= DURATA_MAX_ANTEPRIMA:
+        errori.append(f"Anteprima: durata {ap.durata}s fuori range (0 – {DURATA_MAX_ANTEPRIMA:g}s)")
+    if not 8000 <= ap.rate <= 192000:
+        errori.append(f"Anteprima: sample rate {ap.rate} fuori range (8000 – 192000)")
+    return errori
+
+
+def _valida_morph(morph: MorphInput, esiste: Callable[[str], bool] = os.path.exists) -> list[str]:
     errori = []
+    if not morph.chiavi:
+        errori.append("MorphInput: nessun frame chiave")
+    if morph.modo not in MODI_MORPH:
+        errori.append(f"MorphInput: modo '{morph.modo}' sconosciuto. Disponibili: {list(MODI_MORPH)}")
+    for chiave in morph.chiavi or []:
+        if isinstance(chiave, str):
+            path = chiave.partition("#")[0]
+            if not esiste(path):
+                errori.append(f"MorphInput: file non trovato: {path}")
+    if morph.posizioni is not None:
+        p = list(morph.posizioni)
+        if any(not 0.0 <= v <= 1.0 for v in p) or p != sorted(p):
+            errori.append(f"MorphInput: le posizioni devono essere crescenti tra 0 e 1 (ricevute {p})")
+    return errori
 
-    if mod.sorgente not in SORGENTI:
-        errori.append(f"Modulazione: sorgente sconosciuta '{mod.sorgente}'. "
-                      f"Disponibili: {list(SORGENTI.keys())}")
 
-    if mod.destinazione not in DESTINAZIONI:
-        errori.append(f"Modulazione: destinazione sconosciuta '{mod.destinazione}'. "
-                      f"Disponibili: {list(DESTINAZIONI.keys())}")
+def _valida_spettro(sp: SpettroInput) -> list[str]:
+    errori = []
+    if sp.ampiezze is None:
+        errori.append("SpettroInput: ampiezze mancanti")
+    if sp.limite is not None and not 1 <= sp.limite <= MAX_ARMONICHE:
+        errori.append(f"SpettroInput: limite deve essere tra 1 e {MAX_ARMONICHE} (ricevuto {sp.limite})")
+
+    righe = {}
+    for nome, valori in (("ampiezze", sp.ampiezze), ("fasi", sp.fasi)):
+        if valori is None or callable(valori):
+            continue
+        forma = _forma(valori)
+        if forma is None or len(forma) not in (1, 2):
+            errori.append(f"SpettroInput: {nome} deve essere un vettore, una matrice "
+                          f"(frame × armoniche) o una funzione di k e t")
+            continue
+        if forma[-1] > MAX_ARMONICHE:
+            errori.append(f"SpettroInput: {forma[-1]} armoniche in {nome}, massimo {MAX_ARMONICHE}")
+        if len(forma) == 2:
+            righe[nome] = forma[0]
+    if len(set(righe.values())) > 1:
+        errori.append(f"SpettroInput: ampiezze e fasi hanno un numero di frame diverso "
+                      f"({righe['ampiezze']} e {righe['fasi']})")
+    return errori
 
+
+def _forma(valori):
+    """Forma di un array o di liste annidate (senza importare numpy); None se irregolare."""
+    if hasattr(valori, "shape"):
+        return tuple(valori.shape)
+    if not isinstance(valori, (list, tuple)):
+        return None
+    if not valori or not isinstance(valori[0], (list, tuple)):
+        return (len(valori),)  # vettore (anche di funzioni di t)
+    lunghezze = {len(r) if isinstance(r, (list, tuple)) else -1 for r in valori}
+    if len(lunghezze) != 1 or -1 in lunghezze:
+        return None
+    return (len(valori), lunghezze.pop())
+
+
+def _valida_modulazione(mod: ModulazioneInput) -> list[str]:
+    errori = dict(_errori_nomi(mod))
     if not -1.0 <= mod.quantita <= 1.0:
-        errori.append(f"Modulazione {mod.sorgente}→{mod.destinazione}: "
-                      f"quantità {mod.quantita} fuori range [-1.0, 1.0]")
+        errori[2] = (f"Modulazione {mod.sorgente}→{mod.destinazione}: "
+                     f"quantità {mod.quantita} fuori range [-1.0, 1.0]")
+    return [errori[k] for k in sorted(errori)]
+
 
-    if mod.aux and mod.aux not in SORGENTI:
-        errori.append(f"Modulazione: aux sorgente sconosciuta '{mod.aux}'")
+def _errori_nomi(mod: ModulazioneInput) -> list[tuple[int, str]]:
+    """Errori sui nomi di una modulazione, con la loro posizione tra i controlli (2 = quantità)."""
+    errori = []
+
+    if mod.sorgente not in NOMI_SORGENTI:
+        errori.append((0, f"Modulazione: sorgente sconosciuta '{mod.sorgente}'."
+                          f"{_forse(mod.sorgente, NOMI_SORGENTI)} Disponibili: {_ELENCO_SORGENTI}"))
+
+    if mod.destinazione not in NOMI_DESTINAZIONI:
+        errori.append((1, f"Modulazione: destinazione sconosciuta '{mod.destinazione}'."
+                          f"{_forse(mod.destinazione, NOMI_DESTINAZIONI)} Disponibili: {_ELENCO_DESTINAZIONI}"))
+
+    if mod.aux and mod.aux not in NOMI_SORGENTI:
+        errori.append((3, f"Modulazione: aux sorgente sconosciuta '{mod.aux}'."
+                          f"{_forse(mod.aux, NOMI_SORGENTI)}"))
 
     return errori
 
@@ -84,6 +290,9 @@ def _valida_parametro(par: ParametroInput) -> list[str]:
     return []
 
 
+_CAMPI_TEMPO = ("attack", "decay", "release")
+
+
 def _valida_envelope(env) -> list[str]:
     errori = []
     campi_tempo = {"attack": env.attack, "decay": env.decay, "release": env.release}
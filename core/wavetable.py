@@ -1,70 +1,481 @@
+import inspect
+import math
+import os
+import pickle
+import struct
+import sys
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional
+
 import numpy as np
-from scipy.io import wavfile
-from models.input_schema import PresetInput, WavetableInput
+from models.input_schema import PresetInput, WavetableInput, SpettroInput, MorphInput
+from core.cache_wavetable import CACHE_WAVETABLE
+from core.memo import stadio
+from core.metriche import conta
 
 FRAME_SIZE = 2048  # dimensione standard di Serum
+CHUNK_FRAME = 64   # frame convertiti per blocco nella lettura dei .wav
+MAX_ARMONICHE = FRAME_SIZE // 2 - 1  # l'armonica FRAME_SIZE/2 (Nyquist) è nulla per un seno
+MODI_MORPH = ("lineare", "spettrale")
+MODI_PARALLELO = ("thread", "processi")
+BLOCCHI_PER_WORKER = 4  # blocchi di frame per worker: bilancia funzioni con costo variabile su t
+
+# Render parallelo attivo (vedi rendering_parallelo), None = frame valutati in sequenza
+_RENDER: Optional["RenderParallelo"] = None
 
 
+@stadio(dipende_da=("wavetable",), produce=("wavetable",))
 def risolvi_wavetable(preset: PresetInput) -> PresetInput:
     """
     Stadio 2 della pipeline.
     Converte qualsiasi tipo di sorgente wavetable in un np.ndarray
     di frame normalizzati da FRAME_SIZE campioni ciascuno.
     Il risultato viene salvato in preset.wavetable.campioni.
+    Se la sorgente è già stata risolta in passato i frame arrivano
+    dalla cache su disco (CACHE_WAVETABLE).
     """
     if not preset.wavetable:
         return preset
 
     wt = preset.wavetable
 
-    if wt.funzione:
-        frames = _da_funzione(wt.funzione, wt.n_frame)
-    elif wt.campioni is not None:
-        frames = _da_campioni(wt.campioni)
-    elif wt.file_wav:
-        frames = _da_file(wt.file_wav)
+    chiave = CACHE_WAVETABLE.chiave(wt, FRAME_SIZE) if CACHE_WAVETABLE.attiva else None
+    frames = CACHE_WAVETABLE.leggi(chiave) if chiave else None
+
+    if frames is None:
+        if wt.funzione:
+            frames = _da_funzione(wt.funzione, wt.n_frame)
+        elif wt.campioni is not None:
+            frames = _da_campioni(wt.campioni)
+        elif wt.file_wav:
+            frames = _da_file(wt.file_wav)
+        elif wt.spettro is not None:
+            frames = _da_spettro(wt.spettro, wt.n_frame)
+        elif wt.morph is not None:
+            frames = _da_morph(wt.morph, wt.n_frame)
+        conta("frame_renderizzati", len(frames) // FRAME_SIZE)
+        if chiave:
+            CACHE_WAVETABLE.scrivi(chiave, frames)
 
     # Salva i frame risolti come campioni (sovrascrive la sorgente originale)
     preset.wavetable.campioni = frames
     preset.wavetable.funzione = None
     preset.wavetable.file_wav = None
+    preset.wavetable.spettro = None
+    preset.wavetable.morph = None
 
     return preset
 
 
 def _da_funzione(f, n_frame: int) -> np.ndarray:
-    """Genera n_frame frame applicando la funzione su [0, 2π]."""
+    """
+    Genera n_frame frame applicando la funzione su [0, 2π].
+    Se la funzione accetta anche t, la valuta una sola volta su una griglia
+    (n_frame, FRAME_SIZE) con x e t in broadcast; se non supporta il broadcast
+    ripiega sulla valutazione frame per frame.
+    """
     x = np.linspace(0, 2 * np.pi, FRAME_SIZE, endpoint=False)
-    frames = []
-    for i in range(n_frame):
-        # Interpola parametricamente se la funzione accetta due argomenti
+    frames = np.empty((n_frame, FRAME_SIZE), dtype=np.float32)
+    usa_t = _accetta_t(f)
+
+    if usa_t is False:
+        # Senza t tutti i frame sono uguali: una sola valutazione
+        _normalizza_righe(np.broadcast_to(f(x), (1, FRAME_SIZE)), frames[:1])
+        frames[1:] = frames[0]
+        return frames.reshape(-1)
+
+    if usa_t:
+        t = np.linspace(0.0, 1.0, n_frame) if n_frame > 1 else np.zeros(1)
         try:
-            t = i / max(n_frame - 1, 1)  # t va da 0 a 1
+            campioni = f(x[np.newaxis, :], t[:, np.newaxis])
+            campioni = np.broadcast_to(campioni, (n_frame, FRAME_SIZE))
+        except Exception:
+            campioni = None  # funzione non vettorizzabile su t
+        if campioni is not None:
+            _normalizza_righe(campioni, frames)
+            return frames.reshape(-1)
+
+    # Funzione non vettorizzabile: un frame alla volta, su un pool se richiesto
+    render = _RENDER
+    if render is not None and n_frame > 1:
+        render.frame(f, usa_t, n_frame, frames)
+    else:
+        _blocco_da_funzione(f, usa_t, 0, n_frame, n_frame, frames)
+    return frames.reshape(-1)
+
+
+def _blocco_da_funzione(f, usa_t, inizio: int, fine: int, n_frame: int,
+                        out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Frame da inizio a fine (escluso) valutando f frame per frame; scrive in
+    out[inizio:fine] se indicato, altrimenti restituisce un nuovo array.
+    Ogni frame dipende solo da x e dal proprio t: il risultato non cambia
+    con l'ordine o la suddivisione dei blocchi.
+    """
+    x = np.linspace(0, 2 * np.pi, FRAME_SIZE, endpoint=False)
+    blocco = out[inizio:fine] if out is not None else np.empty((fine - inizio, FRAME_SIZE), np.float32)
+    for j, i in enumerate(range(inizio, fine)):
+        t = i / max(n_frame - 1, 1)  # t va da 0 a 1
+        if usa_t is None:
+            # Firma non ispezionabile: prova con due argomenti
+            try:
+                campioni = f(x, t)
+            except TypeError:
+                campioni = f(x)
+        else:
             campioni = f(x, t)
-        except TypeError:
-            campioni = f(x)
-        frames.append(_normalizza(campioni))
-    return np.concatenate(frames).astype(np.float32)
+        blocco[j] = _normalizza(campioni)
+    return blocco
+
+
+class RenderParallelo:
+    """
+    Pool per le funzioni wavetable che non si vettorizzano su t (modelli fisici
+    campione per campione, filtri scipy, ...). I frame sono divisi in blocchi
+    contigui valutati in parallelo e ricomposti nell'ordine dei frame:
+      - "thread":   ThreadPoolExecutor, per codice numpy/scipy che rilascia il GIL;
+                    i blocchi scrivono direttamente nel buffer di uscita
+      - "processi": ProcessPoolExecutor, per funzioni in puro Python; la funzione
+                    deve essere serializzabile con pickle (es. definita a livello
+                    di modulo), altrimenti si ripiega sui thread con un avviso
+    La funzione deve calcolare ogni frame solo da (x, t): con questa condizione
+    il risultato è identico a quello sequenziale, per qualunque numero di worker.
+    """
+
+    def __init__(self, workers: int, modo: str = "thread"):
+        if modo not in MODI_PARALLELO:
+            raise ValueError(f"Modo di render '{modo}' non valido: usare {' o '.join(MODI_PARALLELO)}")
+        self.workers = max(1, workers)
+        self.modo = modo
+        self._pool: Optional[Executor] = None
+        self._pool_thread: Optional[ThreadPoolExecutor] = None
+
+    def frame(self, f, usa_t, n_frame: int, out: np.ndarray):
+        """Riempie out (n_frame, FRAME_SIZE) valutando f su tutti i frame."""
+        passo = max(1, math.ceil(n_frame / (self.workers * BLOCCHI_PER_WORKER)))
+        blocchi = [(i, min(i + passo, n_frame)) for i in range(0, n_frame, passo)]
+
+        if self.modo == "processi" and _serializzabile(f):
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            futures = [self._pool.submit(_blocco_da_funzione, f, usa_t, inizio, fine, n_frame)
+                       for inizio, fine in blocchi]
+            for (inizio, fine), futura in zip(blocchi, futures):
+                out[inizio:fine] = futura.result()
+            return
+
+        if self.modo == "processi":
+            print(f"[WARN] Funzione wavetable {f!r} non serializzabile: render su thread.", file=sys.stderr)
+        if self._pool_thread is None:
+            self._pool_thread = ThreadPoolExecutor(max_workers=self.workers)
+        futures = [self._pool_thread.submit(_blocco_da_funzione, f, usa_t, inizio, fine, n_frame, out)
+                   for inizio, fine in blocchi]
+        for futura in futures:
+            futura.result()
+
+    def chiudi(self):
+        for pool in (self._pool, self._pool_thread):
+            if pool is not None:
+                pool.shutdown(wait=True)
+        self._pool = self._pool_thread = None
+
+
+@contextmanager
+def rendering_parallelo(workers: int, modo: str = "thread"):
+    """
+    Durante il blocco le funzioni wavetable non vettorizzabili sono valutate
+    su un pool di workers thread o processi (vedi RenderParallelo).
+    """
+    global _RENDER
+    precedente = _RENDER
+    render = RenderParallelo(workers, modo)
+    _RENDER = render
+    try:
+        yield render
+    finally:
+        _RENDER = precedente
+        render.chiudi()
+
+
+def _serializzabile(f) -> bool:
+    try:
+        pickle.dumps(f)
+    except Exception:
+        return False
+    return True
+
+
+def _da_spettro(spettro: SpettroInput, n_frame: int) -> np.ndarray:
+    """
+    Sintesi additiva di tutti i frame con una sola irfft su uno spettro
+    (n_frame, FRAME_SIZE//2 + 1): il costo non dipende dal numero di armoniche.
+    L'armonica k con ampiezza a e fase φ produce a·sin(k·x + φ), come sin(k*x)
+    in --funzione. Con una matrice esplicita n_frame è il numero di righe.
+    Le armoniche oltre quelle elencate in fasi hanno fase 0.
+    """
+    limite = min(spettro.limite or MAX_ARMONICHE, MAX_ARMONICHE)
+    ampiezze = _matrice_armoniche(spettro.ampiezze, n_frame, limite)
+    n_frame = ampiezze.shape[0]
+    n_arm = min(ampiezze.shape[1], limite)
+
+    bins = np.zeros((n_frame, FRAME_SIZE // 2 + 1), dtype=np.complex128)
+    # irfft divide per FRAME_SIZE: X[k] = -i·a·N/2·e^{iφ} dà a·sin(k·x + φ)
+    np.multiply(ampiezze[:, :n_arm], -0.5j * FRAME_SIZE, out=bins[:, 1:n_arm + 1])
+    if spettro.fasi is not None:
+        fasi = _matrice_armoniche(spettro.fasi, n_frame, limite)[:, :n_arm]
+        if fasi.shape[1] < n_arm:
+            fasi = np.pad(fasi, ((0, 0), (0, n_arm - fasi.shape[1])))
+        bins[:, 1:n_arm + 1] *= np.exp(1j * fasi)
+
+    frames = np.fft.irfft(bins, n=FRAME_SIZE, axis=1)
+    out = np.empty((n_frame, FRAME_SIZE), dtype=np.float32)
+    return _normalizza_righe(frames, out).reshape(-1)
+
+
+def _da_morph(morph: MorphInput, n_frame: int) -> np.ndarray:
+    """
+    Interpola i frame chiave fino a n_frame frame.
+    Per ogni frame di uscita si trovano la coppia di chiavi che lo circonda e il
+    peso w; l'interpolazione di tutti i frame è poi un'unica operazione in
+    broadcast sul buffer float32 di uscita:
+      - lineare:   crossfade  a + w·(b − a)
+      - spettrale: modulo interpolato linearmente e fase lungo l'arco più breve,
+                   poi una sola irfft per tutti i frame
+    """
+    chiavi = _frame_chiave(morph.chiavi)
+    n_chiavi = len(chiavi)
+    if morph.posizioni is not None:
+        posizioni = np.asarray(morph.posizioni, dtype=np.float64)
+        if len(posizioni) != n_chiavi:
+            raise ValueError(f"Morph: {len(posizioni)} posizioni per {n_chiavi} frame chiave")
+    else:
+        posizioni = np.linspace(0.0, 1.0, n_chiavi) if n_chiavi > 1 else np.zeros(1)
+
+    out = np.empty((n_frame, FRAME_SIZE), dtype=np.float32)
+    if n_chiavi == 1:
+        out[:] = chiavi[0]
+        return out.reshape(-1)
+
+    t = np.linspace(0.0, 1.0, n_frame) if n_frame > 1 else np.zeros(1)
+    i = np.clip(np.searchsorted(posizioni, t, side="right") - 1, 0, n_chiavi - 2)
+    ampiezza = posizioni[i + 1] - posizioni[i]
+    w = np.clip((t - posizioni[i]) / np.where(ampiezza > 0, ampiezza, 1.0), 0.0, 1.0)[:, np.newaxis]
+
+    if morph.modo == "spettrale":
+        spettri = np.fft.rfft(chiavi, axis=1)
+        modulo = np.abs(spettri)
+        fase = np.angle(spettri)
+        # Differenza di fase tra chiavi consecutive, riportata in (-π, π]
+        delta = np.angle(spettri[1:] * np.conj(spettri[:-1]))
+        bins = (modulo[i] + w * (modulo[i + 1] - modulo[i])) * np.exp(1j * (fase[i] + w * delta[i]))
+        return _normalizza_righe(np.fft.irfft(bins, n=FRAME_SIZE, axis=1), out).reshape(-1)
+
+    differenze = np.diff(chiavi, axis=0)
+    np.add(chiavi[i], w * differenze[i], out=out, casting="unsafe")
+    return out.reshape(-1)
+
+
+def _frame_chiave(chiavi: list) -> np.ndarray:
+    """Frame chiave (normalizzati) come matrice (n_chiavi, FRAME_SIZE) float64."""
+    frames = []
+    for chiave in chiavi:
+        if isinstance(chiave, str):
+            frames.append(_frame_da_wav(chiave))
+        elif callable(chiave):
+            frames.append(_da_funzione(chiave, 1).reshape(1, FRAME_SIZE))
+        else:
+            frames.append(_da_campioni(chiave).reshape(-1, FRAME_SIZE))
+    if not frames:
+        raise ValueError("Morph: nessun frame chiave")
+    return np.concatenate(frames).astype(np.float64)
+
+
+def _frame_da_wav(riferimento: str) -> np.ndarray:
+    """'banco.wav', 'banco.wav#3' o 'banco.wav#2:5' → frame (n, FRAME_SIZE)."""
+    path, _, selezione = riferimento.partition("#")
+    frames = _da_file(path).reshape(-1, FRAME_SIZE)
+    if not selezione:
+        return frames
+    try:
+        if ":" in selezione:
+            inizio, fine = (int(v) if v else None for v in selezione.split(":", 1))
+            scelti = frames[inizio:fine]
+        else:
+            indice = int(selezione)
+            scelti = frames[indice:indice + 1] if indice >= 0 else frames[indice:][:1]
+    except ValueError:
+        raise ValueError(f"Morph: selezione di frame non valida '{riferimento}'")
+    if len(scelti) == 0:
+        raise ValueError(f"Morph: nessun frame in '{riferimento}' ({len(frames)} frame nel file)")
+    return scelti
+
+
+def _matrice_armoniche(valori, n_frame: int, n_arm: int) -> np.ndarray:
+    """
+    Ampiezze o fasi come matrice (n_frame, armoniche).
+    Le funzioni f(k, t) sono valutate una sola volta sulla griglia k × t in broadcast.
+    """
+    t = np.linspace(0.0, 1.0, n_frame) if n_frame > 1 else np.zeros(1)
+    if callable(valori):
+        k = np.arange(1, n_arm + 1, dtype=np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            matrice = np.broadcast_to(valori(k[np.newaxis, :], t[:, np.newaxis]), (n_frame, n_arm))
+        return np.nan_to_num(matrice, nan=0.0, posinf=0.0, neginf=0.0)
+
+    if isinstance(valori, (list, tuple)) and any(callable(v) for v in valori):
+        # Una funzione di t per armonica (o un numero costante); le espressioni
+        # compilate ricevono anche k
+        matrice = np.empty((n_frame, len(valori)), dtype=np.float64)
+        for i, v in enumerate(valori):
+            if hasattr(v, "variabili"):
+                v = v(float(i + 1), t)
+            elif callable(v):
+                v = v(t)
+            matrice[:, i] = v
+        return matrice
+
+    matrice = np.asarray(valori, dtype=np.float64)
+    if matrice.ndim == 1:
+        return np.broadcast_to(matrice, (n_frame, len(matrice)))
+    return matrice
+
+
+def _accetta_t(f):
+    """
+    True se f può ricevere (x, t), False se accetta solo x,
+    None se la firma non è ispezionabile (es. funzioni C).
+    """
+    if hasattr(f, "usa_t"):
+        return f.usa_t  # Espressione compilata: sa già se usa t
+    if isinstance(f, np.ufunc):
+        return f.nin >= 2
+    try:
+        firma = inspect.signature(f)
+    except (TypeError, ValueError):
+        return None
+    posizionali = 0
+    for p in firma.parameters.values():
+        if p.kind == p.VAR_POSITIONAL:
+            return True
+        if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD):
+            posizionali += 1
+    return posizionali >= 2
 
 
 def _da_campioni(campioni: np.ndarray) -> np.ndarray:
     """Adatta un array grezzo a multipli di FRAME_SIZE."""
+    campioni = np.asarray(campioni).reshape(-1)
     # Ritaglia o padda per avere multipli esatti di FRAME_SIZE
     n_frame = max(1, len(campioni) // FRAME_SIZE)
-    campioni = campioni[:n_frame * FRAME_SIZE]
-    frames = campioni.reshape(n_frame, FRAME_SIZE)
-    normalizzati = np.array([_normalizza(f) for f in frames])
-    return normalizzati.flatten().astype(np.float32)
+    if len(campioni) < FRAME_SIZE:
+        campioni = np.pad(campioni, (0, FRAME_SIZE - len(campioni)))
+    frames = campioni[:n_frame * FRAME_SIZE].reshape(n_frame, FRAME_SIZE)
+    out = np.empty((n_frame, FRAME_SIZE), dtype=np.float32)
+    return _normalizza_righe(frames, out).reshape(-1)
 
 
 def _da_file(path: str) -> np.ndarray:
-    """Legge un .wav e lo tratta come wavetable multi-frame."""
-    rate, data = wavfile.read(path)
-    if data.ndim > 1:
-        data = data[:, 0]  # prendi solo il canale sinistro
-    data = data.astype(np.float32)
-    data /= np.iinfo(np.int16).max if data.max() > 1.0 else 1.0
-    return _da_campioni(data)
+    """
+    Legge un .wav e lo tratta come wavetable multi-frame.
+    I campioni sono letti tramite memory-map e convertiti a blocchi di
+    CHUNK_FRAME frame interi, così la memoria usata resta limitata
+    anche per banchi di centinaia di MB.
+    """
+    dati, scala = _apri_wav(path)
+    conta("bytes_letti", dati.nbytes)
+    n_campioni = dati.shape[0]
+    if n_campioni < FRAME_SIZE:
+        return _da_campioni(_converti_blocco(dati, scala))
+
+    n_frame = n_campioni // FRAME_SIZE
+    out = np.empty((n_frame, FRAME_SIZE), dtype=np.float32)
+    for inizio in range(0, n_frame, CHUNK_FRAME):
+        fine = min(inizio + CHUNK_FRAME, n_frame)
+        blocco = _converti_blocco(dati[inizio * FRAME_SIZE:fine * FRAME_SIZE], scala)
+        _normalizza_righe(blocco.reshape(-1, FRAME_SIZE), out[inizio:fine])
+    return out.reshape(-1)
+
+
+def _apri_wav(path: str) -> tuple[np.ndarray, float]:
+    """
+    Mappa in memoria il chunk 'data' di un .wav (PCM 8/16/24/32 bit o float 32/64).
+    Restituisce un array (n_campioni, canali) — per i 24 bit (n_campioni, canali, 3)
+    byte — e il fattore di scala ricavato dal tipo dei campioni.
+    """
+    with open(path, "rb") as f:
+        riff, _, wave = struct.unpack("<4sI4s", f.read(12))
+        if riff not in (b"RIFF", b"RIFX") or wave != b"WAVE":
+            raise ValueError(f"File non WAV: {path}")
+        if riff == b"RIFX":
+            raise ValueError(f"WAV big-endian (RIFX) non supportato: {path}")
+
+        formato = None
+        while True:
+            intestazione = f.read(8)
+            if len(intestazione) < 8:
+                raise ValueError(f"WAV senza chunk 'data': {path}")
+            nome, dimensione = struct.unpack("<4sI", intestazione)
+            if nome == b"fmt ":
+                fmt = f.read(dimensione)
+                tag, canali, _, _, _, bits = struct.unpack("<HHIIHH", fmt[:16])
+                if tag == 0xFFFE and len(fmt) >= 26:  # WAVE_FORMAT_EXTENSIBLE
+                    tag = struct.unpack("<H", fmt[24:26])[0]
+                formato = (tag, canali, bits)
+                f.seek(dimensione % 2, 1)
+            elif nome == b"data":
+                if formato is None:
+                    raise ValueError(f"WAV con chunk 'data' prima di 'fmt ': {path}")
+                offset = f.tell()
+                break
+            else:
+                f.seek(dimensione + dimensione % 2, 1)
+
+    tag, canali, bits = formato
+    larghezza = bits // 8
+    # Alcuni encoder in streaming lasciano la dimensione a 0xFFFFFFFF: si limita al file
+    dimensione = min(dimensione, os.path.getsize(path) - offset)
+    n_campioni = dimensione // (larghezza * canali)
+
+    if tag == 3 and bits in (32, 64):
+        dtype, scala = (np.float32 if bits == 32 else np.float64), 1.0
+    elif tag == 1 and bits in (8, 16, 32):
+        dtype = {8: np.uint8, 16: np.int16, 32: np.int32}[bits]
+        scala = float(2 ** (bits - 1))
+    elif tag == 1 and bits == 24:
+        dati = np.memmap(path, dtype=np.uint8, mode="r", offset=offset,
+                         shape=(n_campioni, canali, 3))
+        return dati, float(2 ** 23)
+    else:
+        raise ValueError(f"Formato WAV non supportato (tag {tag}, {bits} bit): {path}")
+
+    dati = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(n_campioni, canali))
+    return dati, scala
+
+
+def _converti_blocco(dati: np.ndarray, scala: float) -> np.ndarray:
+    """Canale sinistro di un blocco di campioni → float32 tra -1.0 e 1.0."""
+    if dati.ndim == 3:
+        # 24 bit little-endian: ricompone i 3 byte in int32 con estensione del segno
+        b = dati[:, 0, :].astype(np.int32)
+        sinistro = ((b[:, 0] << 8) | (b[:, 1] << 16) | (b[:, 2] << 24)) >> 8
+    else:
+        sinistro = dati[:, 0]
+
+    blocco = sinistro.astype(np.float32)
+    if dati.dtype == np.uint8 and dati.ndim == 2:
+        blocco -= 128.0  # PCM 8 bit è senza segno
+    if scala != 1.0:
+        blocco *= np.float32(1.0 / scala)
+    return blocco
+
+
+def _normalizza_righe(campioni: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """Normalizza ogni riga tra -1.0 e 1.0 scrivendo in out; le righe silenziose restano invariate."""
+    massimi = np.max(np.abs(campioni), axis=1, keepdims=True)
+    massimi[massimi < 1e-10] = 1.0
+    np.divide(campioni, massimi, out=out, casting="unsafe")
+    return out
 
 
 def _normalizza(campioni: np.ndarray) -> np.ndarray:
@@ -32,7 +32,7 @@ def esempio():
         parametri=[
             ParametroInput("filter_cutoff", 0.4),
             ParametroInput("filter_res",    0.55),
-            ParametroInput("master_vol",    0.85),
+            ParametroInput("filter_drive",  0.2),
         ],
 
         # --- Modulazioni (collegamento sorgente → destinazione) ---
@@ -1,25 +1,65 @@
+"""
+Input dei preset. Le classi usano __slots__: anche milioni di istanze (es. le
+varianti di uno sweep) non hanno un __dict__ per oggetto e gli attributi non
+dichiarati sono un errore. Per tenere in memoria molti preset insieme vedi
+models/preset_batch.py.
+"""
+
 from dataclasses import dataclass, field
-from typing import Callable, Optional
-import numpy as np
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+if TYPE_CHECKING:  # numpy si carica solo negli stadi che lo usano
+    import numpy as np
+
+
+@dataclass(slots=True)
+class SpettroInput:
+    """
+    Wavetable additiva: ampiezza (e fase) di ogni armonica per ogni frame.
+    ampiezze e fasi accettano:
+      - una matrice (n_frame, n_armoniche), oppure un vettore uguale per tutti i frame
+      - una funzione f(k, t) dell'indice dell'armonica k (1, 2, ...) e di t (0 – 1)
+      - una lista di funzioni di t, una per armonica
+    """
+    ampiezze: Any
+    fasi: Any = None                        # radianti; None = tutte a 0 (serie di seni)
+    limite: Optional[int] = None            # band-limit: armoniche oltre l'indice azzerate
+
 
+@dataclass(slots=True)
+class MorphInput:
+    """
+    Wavetable da pochi frame chiave, interpolati fino a n_frame frame.
+    Ogni chiave può essere:
+      - una funzione/espressione di x (un frame)
+      - un array: ogni blocco di FRAME_SIZE campioni è una chiave
+      - un riferimento a un .wav: "banco.wav" (tutti i frame), "banco.wav#3"
+        (frame 3) oppure "banco.wav#2:5" (frame da 2 a 4)
+    """
+    chiavi: list
+    posizioni: Optional[list[float]] = None # t (0 – 1) di ogni chiave, default equispaziate
+    modo: str = "lineare"                   # "lineare" (crossfade) | "spettrale" (modulo/fase)
 
-@dataclass
+
+@dataclass(slots=True)
 class WavetableInput:
     """Definisce la forma d'onda. Specifica esattamente UNA sorgente."""
     funzione: Optional[Callable] = None     # es. lambda x: np.sin(x)
-    campioni: Optional[np.ndarray] = None   # array grezzo
+    campioni: Optional["np.ndarray"] = None # array grezzo
     file_wav: Optional[str] = None          # path a .wav esistente
-    n_frame: int = 8                        # quanti frame generare (se da funzione)
+    spettro: Optional[SpettroInput] = None  # ampiezze/fasi delle armoniche
+    morph: Optional[MorphInput] = None      # frame chiave da interpolare
+    n_frame: int = 8                        # quanti frame generare (funzione, spettro, morph)
 
 
-@dataclass
+@dataclass(slots=True)
 class ParametroInput:
     """Un singolo parametro statico di Serum (valore 0.0 – 1.0)."""
     nome: str
     valore: float
 
 
-@dataclass
+@dataclass(slots=True)
 class ModulazioneInput:
     """Un collegamento nella mod matrix di Serum."""
     sorgente: str                           # es. "LFO1"
@@ -28,7 +68,7 @@ class ModulazioneInput:
     aux: Optional[str] = None              # sorgente secondaria opzionale
 
 
-@dataclass
+@dataclass(slots=True)
 class EnvelopeInput:
     """Forma ADSR di un envelope."""
     attack: float = 0.01
@@ -38,7 +78,15 @@ class EnvelopeInput:
     target: str = "ENV1"                   # quale envelope di Serum
 
 
-@dataclass
+@dataclass(slots=True)
+class AnteprimaInput:
+    """Anteprima audio della wavetable: un oscillatore che percorre tutti i frame."""
+    nota: float = 48.0                     # nota MIDI (60 = C4), anche frazionaria
+    durata: float = 2.0                    # secondi: i frame sono percorsi dal primo all'ultimo
+    rate: int = 44100                      # sample rate del .wav di anteprima
+
+
+@dataclass(slots=True)
 class PresetInput:
     """Input completo per generare un preset .fxp di Serum."""
     nome: str
@@ -47,3 +95,14 @@ class PresetInput:
     parametri: list[ParametroInput] = field(default_factory=list)
     modulazioni: list[ModulazioneInput] = field(default_factory=list)
     envelopes: list[EnvelopeInput] = field(default_factory=list)
+    anteprima: Optional[AnteprimaInput] = None  # se presente, scrive anche <nome>_anteprima.wav
+
+    # Opzioni e risultati intermedi, scritti dalla CLI e dagli stadi (non fanno parte dell'input)
+    _output_dir: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+    _silenzioso: bool = field(default=False, init=False, repr=False, compare=False)  # niente [OK] da scrivi_output
+    _mod_bytes: Optional[bytes | memoryview] = field(default=None, init=False, repr=False, compare=False)
+    _param_patch: Optional[dict[int, float]] = field(default=None, init=False, repr=False, compare=False)
+    _fxp_bytes: Optional[bytearray] = field(default=None, init=False, repr=False, compare=False)
+    _anteprima: Optional["np.ndarray"] = field(default=None, init=False, repr=False, compare=False)
+    _stadi_saltati: list[str] = field(default_factory=list, init=False, repr=False, compare=False)
+    _scritture: list = field(default_factory=list, init=False, repr=False, compare=False)
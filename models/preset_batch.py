@@ -0,0 +1,186 @@
+"""
+Rappresentazione colonnare di molti preset.
+Invece di una lista di PresetInput (un oggetto per ogni modulazione, parametro
+ed envelope) PresetBatch tiene tre array strutturati numpy, una riga per
+elemento, con la colonna "preset" che indica a quale preset appartiene:
+
+    modulazioni  (preset, sorgente, destinazione, quantita, aux)
+    parametri    (preset, nome, valore)
+    envelopes    (preset, target, attack, decay, sustain, release)
+
+Le righe di uno stesso preset sono contigue e nell'ordine originale. I nomi
+(sorgenti, destinazioni, parametri, target) sono codici interi in un
+vocabolario condiviso; il codice 0 è riservato a "nessuno" (aux assente).
+Gli stadi che lavorano sul batch intero usano le colonne; batch[i] ricostruisce
+il PresetInput del preset i per il codice che lavora un preset alla volta.
+"""
+
+from typing import Iterable, Iterator, Optional, Sequence
+
+import numpy as np
+
+from models.input_schema import (
+    PresetInput, WavetableInput, ModulazioneInput, ParametroInput, EnvelopeInput,
+)
+
+DTYPE_MODULAZIONI = np.dtype([("preset", "<i4"), ("sorgente", "<i4"), ("destinazione", "<i4"),
+                              ("quantita", "<f8"), ("aux", "<i4")])
+DTYPE_PARAMETRI = np.dtype([("preset", "<i4"), ("nome", "<i4"), ("valore", "<f8")])
+DTYPE_ENVELOPES = np.dtype([("preset", "<i4"), ("target", "<i4"), ("attack", "<f8"),
+                            ("decay", "<f8"), ("sustain", "<f8"), ("release", "<f8")])
+
+CAMPI_ENVELOPE = ("attack", "decay", "sustain", "release")
+
+# Colonne che contengono codici del vocabolario
+_CAMPI_NOME = frozenset({"sorgente", "destinazione", "aux", "nome", "target"})
+
+
+class Vocabolario:
+    """Nomi ↔ codici interi; il codice 0 è None."""
+
+    __slots__ = ("nomi", "_codici")
+
+    def __init__(self, nomi: Iterable[str] = ()):
+        self.nomi: list[Optional[str]] = [None]
+        self._codici: dict[Optional[str], int] = {None: 0}
+        for nome in nomi:
+            self.codice(nome)
+
+    def codice(self, nome: Optional[str]) -> int:
+        codice = self._codici.get(nome)
+        if codice is None:
+            codice = self._codici[nome] = len(self.nomi)
+            self.nomi.append(nome)
+        return codice
+
+    def __getitem__(self, codice: int) -> Optional[str]:
+        return self.nomi[codice]
+
+    def __len__(self) -> int:
+        return len(self.nomi)
+
+
+class PresetBatch:
+    """
+    Molti preset in forma colonnare.
+    nomi, basi, wavetable e output_dir hanno un elemento per preset (oggetti
+    uguali possono essere condivisi, es. la stessa wavetable per tutto uno sweep).
+    """
+
+    __slots__ = ("nomi", "basi", "wavetable", "output_dir", "modulazioni", "parametri",
+                 "envelopes", "vocabolario", "_inizi")
+
+    def __init__(self, nomi: Sequence[str], basi: Sequence[str],
+                 modulazioni: np.ndarray, parametri: np.ndarray, envelopes: np.ndarray,
+                 vocabolario: Vocabolario,
+                 wavetable: Optional[Sequence[Optional[WavetableInput]]] = None,
+                 output_dir: Optional[Sequence[Optional[str]]] = None):
+        n = len(nomi)
+        if len(basi) != n:
+            raise ValueError(f"PresetBatch: {n} nomi ma {len(basi)} file base")
+        self.nomi = list(nomi)
+        self.basi = list(basi)
+        self.wavetable = list(wavetable) if wavetable is not None else [None] * n
+        self.output_dir = list(output_dir) if output_dir is not None else [None] * n
+        self.modulazioni = np.asarray(modulazioni, dtype=DTYPE_MODULAZIONI)
+        self.parametri = np.asarray(parametri, dtype=DTYPE_PARAMETRI)
+        self.envelopes = np.asarray(envelopes, dtype=DTYPE_ENVELOPES)
+        self.vocabolario = vocabolario
+        for nome, tabella in self._tabelle().items():
+            if len(tabella) > 1 and np.any(np.diff(tabella["preset"]) < 0):
+                raise ValueError(f"PresetBatch: righe di {nome} non ordinate per preset")
+        # Primo indice di riga di ogni preset (n + 1 valori) per ciascuna tabella
+        self._inizi = {nome: np.searchsorted(tabella["preset"], np.arange(n + 1))
+                       for nome, tabella in self._tabelle().items()}
+
+    @classmethod
+    def da_preset(cls, presets: Iterable[PresetInput]) -> "PresetBatch":
+        """Converte una sequenza di PresetInput."""
+        presets = list(presets)
+        voc = Vocabolario()
+        mod = [m for p in presets for m in p.modulazioni]
+        par = [x for p in presets for x in p.parametri]
+        env = [e for p in presets for e in p.envelopes]
+        indici = np.arange(len(presets), dtype=np.int32)
+        return cls(
+            nomi=[p.nome for p in presets],
+            basi=[p.base_fxp for p in presets],
+            modulazioni=_tabella(DTYPE_MODULAZIONI, voc, {
+                "preset": np.repeat(indici, [len(p.modulazioni) for p in presets]),
+                "sorgente": [m.sorgente for m in mod],
+                "destinazione": [m.destinazione for m in mod],
+                "quantita": [m.quantita for m in mod],
+                "aux": [m.aux or None for m in mod],
+            }),
+            parametri=_tabella(DTYPE_PARAMETRI, voc, {
+                "preset": np.repeat(indici, [len(p.parametri) for p in presets]),
+                "nome": [x.nome for x in par],
+                "valore": [x.valore for x in par],
+            }),
+            envelopes=_tabella(DTYPE_ENVELOPES, voc, {
+                "preset": np.repeat(indici, [len(p.envelopes) for p in presets]),
+                "target": [e.target for e in env],
+                **{c: [getattr(e, c) for e in env] for c in CAMPI_ENVELOPE},
+            }),
+            vocabolario=voc,
+            wavetable=[p.wavetable for p in presets],
+            output_dir=[p._output_dir for p in presets],
+        )
+
+    def __len__(self) -> int:
+        return len(self.nomi)
+
+    def __getitem__(self, i: int) -> PresetInput:
+        """PresetInput del preset i, ricostruito dalle colonne."""
+        if not -len(self) <= i < len(self):
+            raise IndexError(f"PresetBatch: indice {i} fuori range (0 – {len(self) - 1})")
+        i %= len(self)
+        nome = self.vocabolario.nomi
+        preset = PresetInput(
+            nome=self.nomi[i],
+            base_fxp=self.basi[i],
+            wavetable=self.wavetable[i],
+            # tolist() restituisce tuple di tipi Python (float, int), non scalari numpy
+            modulazioni=[ModulazioneInput(nome[src], nome[dst], qty, nome[aux])
+                         for _, src, dst, qty, aux in self.righe("modulazioni", i).tolist()],
+            parametri=[ParametroInput(nome[par], valore)
+                       for _, par, valore in self.righe("parametri", i).tolist()],
+            envelopes=[EnvelopeInput(a, d, s, r, nome[target])
+                       for _, target, a, d, s, r in self.righe("envelopes", i).tolist()],
+        )
+        preset._output_dir = self.output_dir[i]
+        return preset
+
+    def __iter__(self) -> Iterator[PresetInput]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def righe(self, tabella: str, i: int) -> np.ndarray:
+        """Le righe della tabella ("modulazioni", "parametri", "envelopes") del preset i (vista)."""
+        inizi = self._inizi[tabella]
+        return getattr(self, tabella)[inizi[i]:inizi[i + 1]]
+
+    def posizioni(self, tabella: str) -> np.ndarray:
+        """Per ogni riga della tabella, la sua posizione all'interno del proprio preset (0, 1, ...)."""
+        preset = getattr(self, tabella)["preset"]
+        return np.arange(len(preset)) - self._inizi[tabella][preset]
+
+    def conteggi(self, tabella: str) -> np.ndarray:
+        """Numero di righe della tabella per ogni preset."""
+        return np.diff(self._inizi[tabella])
+
+    def _tabelle(self) -> dict[str, np.ndarray]:
+        return {"modulazioni": self.modulazioni, "parametri": self.parametri,
+                "envelopes": self.envelopes}
+
+
+def _tabella(dtype: np.dtype, voc: Vocabolario, colonne: dict) -> np.ndarray:
+    """Array strutturato riempito colonna per colonna; i nomi diventano codici di voc."""
+    n = len(colonne["preset"])
+    tabella = np.empty(n, dtype=dtype)
+    for campo, valori in colonne.items():
+        if campo in _CAMPI_NOME:
+            codici = {v: voc.codice(v) for v in dict.fromkeys(valori)}  # ordine di prima comparsa
+            valori = map(codici.__getitem__, valori)
+        tabella[campo] = np.fromiter(valori, dtype=dtype[campo], count=n)
+    return tabella
@@ -0,0 +1,224 @@
+"""
+Output in un unico archivio .zip o .tar invece di un file per preset.
+Dentro scrittura_in_archivio() (output_io/writer.py) scrivi_output accoda
+ogni risultato all'archivio aperto:
+
+    preset/<nome>.fxp
+    wavetable/<sha256>.wav        una sola copia per contenuto
+    anteprima/<sha256>.wav        anteprime audio, deduplicate allo stesso modo
+    indice/<sessione>.jsonl       una riga per preset scritto nella sessione
+
+Le wavetable sono identificate dall'hash dei campioni (e del sample rate):
+due preset con la stessa wavetable puntano allo stesso membro, che viene
+codificato e scritto una volta sola. Ogni apertura di un archivio esistente
+è una nuova sessione che aggiunge membri in coda senza riscrivere i
+precedenti; leggi_indice() unisce gli indici di tutte le sessioni (per uno
+stesso nome vale l'ultima). Un archivio nuovo viene scritto su un temporaneo
+e rinominato alla chiusura; un'aggiunta avviene sul file esistente.
+"""
+
+import hashlib
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+import zipfile
+from typing import TYPE_CHECKING, Optional
+
+from output_io.writer import SAMPLE_RATE, _scrivi_wav, _path_temporaneo
+
+if TYPE_CHECKING:
+    import numpy as np
+
+FORMATI = ("zip", "tar")
+
+
+class ArchivioOutput:
+    """Archivio aperto in scrittura; i metodi sono thread-safe."""
+
+    def __init__(self, path: str, formato: Optional[str] = None, comprimi: bool = False):
+        self.path = path
+        self.formato = formato or formato_da_path(path)
+        if self.formato not in FORMATI:
+            raise ValueError(f"Formato di archivio non supportato: '{self.formato}' "
+                             f"(supportati: {', '.join(FORMATI)})")
+        self._lock = threading.Lock()
+        self._membri: set[str] = set()
+        self._wavetable: dict[str, str] = {}             # hash → membro
+        self._anteprime: dict[str, str] = {}             # hash → membro
+        self._fxp: dict[str, tuple[str, str]] = {}       # nome → (membro, hash)
+        self._ultimo_hash: dict[str, tuple] = {}         # tipo → (array, rate, hash) dell'ultimo wav
+        self._righe: list[dict] = []
+        self.wavetable_riusate = 0
+
+        aggiunta = os.path.exists(path) and os.path.getsize(path) > 0
+        sessioni = self._carica(path) if aggiunta else 0
+        self.sessione = f"{sessioni + 1:04d}"
+        self._destinazione = path if aggiunta else _path_temporaneo(path)
+        if self.formato == "zip":
+            self._zip = zipfile.ZipFile(self._destinazione, "a" if aggiunta else "w",
+                                        zipfile.ZIP_DEFLATED if comprimi else zipfile.ZIP_STORED)
+        else:
+            if comprimi:
+                raise ValueError("Archivi tar compressi non supportati (non si possono estendere)")
+            self._tar = tarfile.open(self._destinazione, "a" if aggiunta else "w")
+        self._chiuso = False
+
+    def aggiungi(self, nome: str, fxp: Optional[bytes] = None,
+                 campioni: Optional["np.ndarray"] = None, rate: int = SAMPLE_RATE,
+                 anteprima: Optional["np.ndarray"] = None, rate_anteprima: int = SAMPLE_RATE) -> dict:
+        """Scrive i file di un preset e restituisce la sua riga di indice."""
+        hash_wav = self._hash_campioni("wavetable", campioni, rate) if campioni is not None else None
+        hash_ant = (self._hash_campioni("anteprima", anteprima, rate_anteprima)
+                    if anteprima is not None else None)
+        hash_fxp = hashlib.sha256(fxp).hexdigest() if fxp is not None else None
+        with self._lock:
+            if self._chiuso:
+                raise RuntimeError("ArchivioOutput già chiuso")
+            riga = {"nome": nome, "fxp": None, "wavetable": None,
+                    "sha256_fxp": hash_fxp, "sha256_wavetable": hash_wav}
+
+            if hash_wav is not None:
+                membro = self._wavetable.get(hash_wav)
+                if membro is None:
+                    membro = self._wavetable[hash_wav] = f"wavetable/{hash_wav}.wav"
+                    self._scrivi_wav(membro, campioni, rate)
+                else:
+                    self.wavetable_riusate += 1
+                riga["wavetable"] = membro
+
+            if hash_ant is not None:
+                membro = self._anteprime.get(hash_ant)
+                if membro is None:
+                    membro = self._anteprime[hash_ant] = f"anteprima/{hash_ant}.wav"
+                    self._scrivi_wav(membro, anteprima, rate_anteprima)
+                riga["anteprima"] = membro
+                riga["sha256_anteprima"] = hash_ant
+
+            if hash_fxp is not None:
+                precedente = self._fxp.get(nome)
+                if precedente is not None and precedente[1] == hash_fxp:
+                    membro = precedente[0]  # stesso preset già presente: nessuna copia
+                else:
+                    membro = self._membro_libero(f"preset/{nome}", ".fxp")
+                    self._scrivi(membro, bytes(fxp))
+                    self._fxp[nome] = (membro, hash_fxp)
+                riga["fxp"] = membro
+
+            self._righe.append(riga)
+            return riga
+
+    def chiudi(self):
+        """Scrive l'indice della sessione e chiude l'archivio."""
+        with self._lock:
+            if self._chiuso:
+                return
+            self._chiuso = True
+            try:
+                if self._righe:
+                    indice = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in self._righe)
+                    self._scrivi(f"indice/{self.sessione}.jsonl", indice.encode("utf-8"))
+            finally:
+                (self._zip if self.formato == "zip" else self._tar).close()
+            if self._destinazione != self.path:
+                os.replace(self._destinazione, self.path)
+
+    def __len__(self) -> int:
+        return len(self._righe)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.chiudi()
+
+    def _carica(self, path: str) -> int:
+        """Membri e indici delle sessioni precedenti; restituisce quante sessioni."""
+        membri, indici = _leggi_membri(path, self.formato)
+        self._membri.update(membri)
+        for riga in _unisci_indici(indici).values():
+            if riga.get("wavetable") and riga.get("sha256_wavetable"):
+                self._wavetable[riga["sha256_wavetable"]] = riga["wavetable"]
+            if riga.get("anteprima") and riga.get("sha256_anteprima"):
+                self._anteprime[riga["sha256_anteprima"]] = riga["anteprima"]
+            if riga.get("fxp") and riga.get("sha256_fxp"):
+                self._fxp[riga["nome"]] = (riga["fxp"], riga["sha256_fxp"])
+        return len(indici)
+
+    def _hash_campioni(self, tipo: str, campioni: "np.ndarray", rate: int) -> str:
+        # Uno sweep passa lo stesso array per ogni variante: l'hash si calcola una volta
+        ultimo = self._ultimo_hash.get(tipo)
+        if ultimo is not None and ultimo[0] is campioni and ultimo[1] == rate:
+            return ultimo[2]
+        import numpy as np
+        contigui = np.ascontiguousarray(campioni)
+        h = hashlib.sha256(f"{rate}:{contigui.dtype.str}:{contigui.shape}:".encode())
+        h.update(memoryview(contigui).cast("B"))
+        digest = h.hexdigest()
+        self._ultimo_hash[tipo] = (campioni, rate, digest)
+        return digest
+
+    def _scrivi_wav(self, membro: str, campioni: "np.ndarray", rate: int):
+        wav = io.BytesIO()
+        _scrivi_wav(wav, rate, campioni)
+        self._scrivi(membro, wav.getvalue())
+
+    def _membro_libero(self, radice: str, estensione: str) -> str:
+        membro, n = f"{radice}{estensione}", 1
+        while membro in self._membri:
+            n += 1
+            membro = f"{radice}.{n}{estensione}"
+        return membro
+
+    def _scrivi(self, membro: str, dati: bytes):
+        self._membri.add(membro)
+        if self.formato == "zip":
+            info = zipfile.ZipInfo(membro, date_time=time.localtime()[:6])
+            info.compress_type = self._zip.compression
+            self._zip.writestr(info, dati)
+        else:
+            info = tarfile.TarInfo(membro)
+            info.size = len(dati)
+            info.mtime = int(time.time())
+            info.mode = 0o644
+            self._tar.addfile(info, io.BytesIO(dati))
+
+
+def formato_da_path(path: str) -> str:
+    """'zip' o 'tar' dall'estensione del file."""
+    estensione = os.path.splitext(path)[1].lower().lstrip(".")
+    if estensione not in FORMATI:
+        raise ValueError(f"Estensione di archivio non riconosciuta: '{path}' (usare .zip o .tar)")
+    return estensione
+
+
+def leggi_indice(path: str, formato: Optional[str] = None) -> dict[str, dict]:
+    """Indice dell'archivio: nome del preset → riga (ultima sessione che lo ha scritto)."""
+    _, indici = _leggi_membri(path, formato or formato_da_path(path))
+    return _unisci_indici(indici)
+
+
+def _leggi_membri(path: str, formato: str) -> tuple[list[str], list[bytes]]:
+    """Nomi di tutti i membri e contenuto degli indici, in ordine di sessione."""
+    if formato == "zip":
+        with zipfile.ZipFile(path) as z:
+            membri = z.namelist()
+            indici = [z.read(m) for m in sorted(m for m in membri if m.startswith("indice/"))]
+    else:
+        with tarfile.open(path) as t:
+            membri = t.getnames()
+            indici = [t.extractfile(m).read()
+                      for m in sorted(m for m in membri if m.startswith("indice/"))]
+    return membri, indici
+
+
+def _unisci_indici(indici: list[bytes]) -> dict[str, dict]:
+    righe: dict[str, dict] = {}
+    for indice in indici:
+        for riga in indice.decode("utf-8").splitlines():
+            if riga.strip():
+                voce = json.loads(riga)
+                righe[voce["nome"]] = voce
+    return righe
@@ -0,0 +1,328 @@
+"""
+Lettura di preset .fxp esistenti, l'inverso di assembla_fxp.
+Il file viene aperto in memory-map: header e chunk sono decodificati solo
+quando servono, e parametri, envelope e mod matrix sono letti direttamente
+dalla mappa (struct.unpack_from su memoryview, numpy.frombuffer), agli
+offset del PatchPlan usato anche in scrittura. Rigenerare un preset letto,
+con il file stesso come base, produce gli stessi bytes.
+
+    with PresetFxp("output/Pad.fxp") as fxp:
+        fxp.header.nome, fxp.parametri(), fxp.modulazioni()
+        preset = fxp.preset()
+
+leggi_cartella() decodifica un'intera cartella in un PresetBatch: da ogni
+file viene copiata solo la finestra di byte con gli offset del layout, poi
+la decodifica avviene una volta sola sulla matrice di tutti i file.
+"""
+
+import mmap
+import os
+import struct
+import sys
+from dataclasses import dataclass
+from typing import Iterator, Optional, Sequence
+
+import numpy as np
+
+from models.input_schema import PresetInput, ModulazioneInput, ParametroInput, EnvelopeInput
+from models.preset_batch import (
+    PresetBatch, Vocabolario, DTYPE_MODULAZIONI, DTYPE_PARAMETRI, DTYPE_ENVELOPES, CAMPI_ENVELOPE,
+)
+from maps.sources import SORGENTI
+from maps.destinations import DESTINAZIONI
+from core.modulation import (
+    OFFSET_PARAMETRI, OFFSET_ENVELOPE, OFFSET_MOD_MATRIX, MAX_SLOT, SLOT_SIZE, SLOT_VUOTO,
+)
+
+# Header di un programma FXP (fxProgram del VST SDK), tutto big-endian
+_HEADER = struct.Struct(">4sI4sI4sII28s")
+_DIMENSIONE_CHUNK = struct.Struct(">I")
+_F32 = struct.Struct(">f")
+MAGIC = b"CcnK"
+TIPO_CHUNK = b"FPCh"      # stato opaco del plugin (Serum)
+TIPO_PARAMETRI = b"FxCk"  # lista di float, uno per parametro
+
+# Indice Serum → nome, precalcolato (None = indice sconosciuto)
+_NOME_SORGENTE: list[Optional[str]] = [None] * 256
+for _nome, _indice in SORGENTI.items():
+    _NOME_SORGENTE[_indice] = _nome
+_NOME_DESTINAZIONE: list[Optional[str]] = [None] * 256
+for _nome, _indice in DESTINAZIONI.items():
+    _NOME_DESTINAZIONE[_indice] = _nome
+
+_NOMI_PARAMETRI = sorted(OFFSET_PARAMETRI)
+_TARGET_ENVELOPE = sorted(OFFSET_ENVELOPE)
+_DEFAULT_ENVELOPE = EnvelopeInput()
+_FINE_MOD_MATRIX = OFFSET_MOD_MATRIX + MAX_SLOT * SLOT_SIZE
+
+# Finestra di byte che contiene tutti gli offset del layout (usata da leggi_cartella)
+_OFFSET_FLOAT = [OFFSET_PARAMETRI[n] for n in _NOMI_PARAMETRI] + [
+    OFFSET_ENVELOPE[t][c] for t in _TARGET_ENVELOPE for c in CAMPI_ENVELOPE if c in OFFSET_ENVELOPE[t]]
+_INIZIO_FINESTRA = min(_OFFSET_FLOAT + [OFFSET_MOD_MATRIX])
+_FINE_FINESTRA = max([o + 4 for o in _OFFSET_FLOAT] + [_FINE_MOD_MATRIX])
+
+
+@dataclass(frozen=True, slots=True)
+class HeaderFxp:
+    dimensione: int        # byte dopo i primi 8 (campo byteSize)
+    tipo: str              # "FPCh" (chunk) | "FxCk" (lista di parametri)
+    versione: int
+    fx_id: str             # identificativo del plugin, es. "XfsX" per Serum
+    fx_versione: int
+    n_parametri: int
+    nome: str              # nome del programma (max 28 byte)
+
+
+class PresetFxp:
+    """
+    Un .fxp aperto in memory-map, in sola lettura.
+    Ogni decodifica restituisce oggetti Python (nessun riferimento alla mappa),
+    tranne matrice_mod(), che è una vista valida finché il file è aperto.
+    """
+
+    __slots__ = ("path", "_file", "_mappa", "_dati", "_header")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            if os.fstat(self._file.fileno()).st_size < _HEADER.size:
+                raise ValueError(f"{path}: file troppo corto per un .fxp")
+            self._mappa = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            self._file.close()
+            raise
+        self._dati = memoryview(self._mappa)
+        self._header: Optional[HeaderFxp] = None
+        magic = bytes(self._dati[:4])
+        if magic != MAGIC:
+            self.chiudi()
+            raise ValueError(f"{path}: non è un file .fxp (magic {magic!r})")
+
+    @property
+    def header(self) -> HeaderFxp:
+        if self._header is None:
+            _, dimensione, tipo, versione, fx_id, fx_versione, n_parametri, nome = \
+                _HEADER.unpack_from(self._dati)
+            self._header = HeaderFxp(
+                dimensione=dimensione,
+                tipo=tipo.decode("latin-1"),
+                versione=versione,
+                fx_id=fx_id.decode("latin-1"),
+                fx_versione=fx_versione,
+                n_parametri=n_parametri,
+                nome=nome.split(b"\0", 1)[0].decode("latin-1"),
+            )
+        return self._header
+
+    @property
+    def chunk(self) -> memoryview:
+        """Dati del plugin dopo l'header (vista sulla mappa, nessuna copia)."""
+        if self.header.tipo == TIPO_CHUNK.decode():
+            (dimensione,) = _DIMENSIONE_CHUNK.unpack_from(self._dati, _HEADER.size)
+            inizio = _HEADER.size + _DIMENSIONE_CHUNK.size
+            return self._dati[inizio:inizio + dimensione]
+        return self._dati[_HEADER.size:_HEADER.size + 4 * self.header.n_parametri]
+
+    def parametri(self) -> list[ParametroInput]:
+        """Parametri mappati nel layout; quelli oltre la fine del file sono omessi."""
+        return [ParametroInput(nome, _F32.unpack_from(self._dati, OFFSET_PARAMETRI[nome])[0])
+                for nome in _NOMI_PARAMETRI if OFFSET_PARAMETRI[nome] + 4 <= len(self._dati)]
+
+    def envelopes(self) -> list[EnvelopeInput]:
+        """Envelope mappati; i campi non presenti nel layout restano al default."""
+        envelopes = []
+        for target in _TARGET_ENVELOPE:
+            offsets = OFFSET_ENVELOPE[target]
+            if max(offsets.values()) + 4 > len(self._dati):
+                continue
+            valori = {c: _F32.unpack_from(self._dati, o)[0] for c, o in offsets.items()}
+            envelopes.append(EnvelopeInput(
+                **{c: valori.get(c, getattr(_DEFAULT_ENVELOPE, c)) for c in CAMPI_ENVELOPE},
+                target=target))
+        return envelopes
+
+    def matrice_mod(self) -> Optional[np.ndarray]:
+        """Mod matrix (MAX_SLOT, 4) float32 big-endian: vista sulla mappa, None se il file è corto."""
+        if _FINE_MOD_MATRIX > len(self._dati):
+            return None
+        return np.frombuffer(self._mappa, dtype=">f4", count=MAX_SLOT * 4,
+                             offset=OFFSET_MOD_MATRIX).reshape(MAX_SLOT, 4)
+
+    def modulazioni(self) -> list[ModulazioneInput]:
+        """Slot usati della mod matrix, nell'ordine degli slot."""
+        matrice = self.matrice_mod()
+        if matrice is None:
+            return []
+        modulazioni, sconosciuti = [], []
+        for i, (src, dst, qty, aux) in enumerate(matrice.tolist()):
+            if src == SLOT_VUOTO[0]:
+                continue
+            sorgente, destinazione = _nome(_NOME_SORGENTE, src), _nome(_NOME_DESTINAZIONE, dst)
+            nome_aux = None if aux == SLOT_VUOTO[3] else _nome(_NOME_SORGENTE, aux)
+            if sorgente is None or destinazione is None or (aux != SLOT_VUOTO[3] and nome_aux is None):
+                sconosciuti.append(str(i))
+                continue
+            modulazioni.append(ModulazioneInput(sorgente, destinazione, qty * 2.0 - 1.0, nome_aux))
+        if sconosciuti:
+            print(f"[WARN] {self.path}: slot della mod matrix con indici sconosciuti, ignorati "
+                  f"({', '.join(sconosciuti)}).", file=sys.stderr)
+        return modulazioni
+
+    def preset(self, nome: Optional[str] = None) -> PresetInput:
+        """
+        PresetInput con i valori letti. La base è il file stesso: rieseguendo la
+        pipeline si ottengono gli stessi bytes, o una modifica se si cambiano i valori.
+        """
+        return PresetInput(
+            nome=nome or _nome_file(self.path),
+            base_fxp=self.path,
+            parametri=self.parametri(),
+            modulazioni=self.modulazioni(),
+            envelopes=self.envelopes(),
+        )
+
+    def chiudi(self):
+        self._dati.release()
+        try:
+            self._mappa.close()
+        except BufferError:
+            pass  # una vista di matrice_mod() è ancora in uso: la mappa si chiude con lei
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.chiudi()
+
+
+def leggi_fxp(path: str) -> PresetInput:
+    """Legge un .fxp come PresetInput."""
+    with PresetFxp(path) as fxp:
+        return fxp.preset()
+
+
+def leggi_cartella(cartella: str, ricorsiva: bool = False) -> PresetBatch:
+    """
+    Tutti i .fxp della cartella (ordinati per path) come PresetBatch, con il file
+    stesso come base di ogni preset. I file non leggibili, non .fxp o troppo
+    corti per il layout sono esclusi con un avviso.
+    """
+    return leggi_batch(sorted(trova_fxp(cartella, ricorsiva)))
+
+
+def leggi_batch(paths: Sequence[str]) -> PresetBatch:
+    """Più .fxp come PresetBatch, nell'ordine dato (stesse regole di leggi_cartella)."""
+    larghezza = _FINE_FINESTRA - _INIZIO_FINESTRA
+    finestre = np.empty((len(paths), larghezza), dtype=np.uint8)
+    letti, scartati = [], []
+    for path in paths:
+        try:
+            with open(path, "rb") as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mappa:
+                if mappa[:4] != MAGIC:
+                    raise ValueError("non è un file .fxp")
+                if len(mappa) < _FINE_FINESTRA:
+                    raise ValueError(f"file troppo corto ({len(mappa)} byte)")
+                finestre[len(letti)] = np.frombuffer(mappa, dtype=np.uint8, count=larghezza,
+                                                     offset=_INIZIO_FINESTRA)
+        except (OSError, ValueError) as e:
+            scartati.append(f"{path}: {e}")
+            continue
+        letti.append(path)
+    if scartati:
+        print(f"[WARN] {len(scartati)} file esclusi dalla lettura; es. {scartati[0]}", file=sys.stderr)
+    return _decodifica_finestre(finestre[:len(letti)], letti)
+
+
+def trova_fxp(cartella: str, ricorsiva: bool = False) -> Iterator[str]:
+    """Path dei .fxp nella cartella (e nelle sottocartelle con ricorsiva=True)."""
+    for voce in os.scandir(cartella):
+        if voce.is_dir() and ricorsiva:
+            yield from trova_fxp(voce.path, ricorsiva)
+        elif voce.is_file() and voce.name.lower().endswith(".fxp"):
+            yield voce.path
+
+
+def _decodifica_finestre(finestre: np.ndarray, paths: list[str]) -> PresetBatch:
+    """Decodifica vettoriale delle finestre di byte (una riga per file)."""
+    n = len(paths)
+    indici = np.arange(n, dtype=np.int32)
+    voc = Vocabolario()
+
+    def float_a(offset: int) -> np.ndarray:
+        inizio = offset - _INIZIO_FINESTRA
+        return finestre[:, inizio:inizio + 4].copy().view(">f4")[:, 0].astype(np.float64)
+
+    # Parametri: una colonna per nome
+    par = np.empty(n * len(_NOMI_PARAMETRI), dtype=DTYPE_PARAMETRI)
+    par["preset"] = np.repeat(indici, len(_NOMI_PARAMETRI))
+    par["nome"] = np.tile([voc.codice(x) for x in _NOMI_PARAMETRI], n)
+    if _NOMI_PARAMETRI:
+        par["valore"] = np.column_stack([float_a(OFFSET_PARAMETRI[x]) for x in _NOMI_PARAMETRI]).reshape(-1)
+
+    # Envelope: una riga per target, campi assenti dal layout al default
+    env = np.empty(n * len(_TARGET_ENVELOPE), dtype=DTYPE_ENVELOPES)
+    env["preset"] = np.repeat(indici, len(_TARGET_ENVELOPE))
+    env["target"] = np.tile([voc.codice(t) for t in _TARGET_ENVELOPE], n)
+    for campo in CAMPI_ENVELOPE:
+        if _TARGET_ENVELOPE:
+            env[campo] = np.column_stack([
+                float_a(OFFSET_ENVELOPE[t][campo]) if campo in OFFSET_ENVELOPE[t]
+                else np.full(n, getattr(_DEFAULT_ENVELOPE, campo))
+                for t in _TARGET_ENVELOPE]).reshape(-1)
+
+    # Mod matrix: (n, MAX_SLOT, 4), indici Serum → codici del vocabolario via tabelle da 256
+    inizio = OFFSET_MOD_MATRIX - _INIZIO_FINESTRA
+    slot = finestre[:, inizio:inizio + MAX_SLOT * SLOT_SIZE].copy().view(">f4").reshape(n, MAX_SLOT, 4)
+    # L'ultima voce (-1) raccoglie i valori non interi o fuori range
+    codice_sorgente = np.array([voc.codice(x) if x else -1 for x in _NOME_SORGENTE] + [-1],
+                               dtype=np.int32)
+    codice_destinazione = np.array([voc.codice(x) if x else -1 for x in _NOME_DESTINAZIONE] + [-1],
+                                   dtype=np.int32)
+    codice_aux = codice_sorgente.copy()
+    codice_aux[int(SLOT_VUOTO[3])] = 0
+
+    src = codice_sorgente[_indice_intero(slot[..., 0])]
+    dst = codice_destinazione[_indice_intero(slot[..., 1])]
+    aux = codice_aux[_indice_intero(slot[..., 3])]
+    occupati = slot[..., 0] != SLOT_VUOTO[0]
+    sconosciuti = occupati & ((src < 0) | (dst < 0) | (aux < 0))
+    if sconosciuti.any():
+        preset, numero = np.argwhere(sconosciuti)[0]
+        print(f"[WARN] {int(sconosciuti.sum())} slot della mod matrix con indici sconosciuti, "
+              f"ignorati; es. {paths[preset]} slot {numero}", file=sys.stderr)
+    usati = occupati & ~sconosciuti
+
+    mod = np.empty(int(usati.sum()), dtype=DTYPE_MODULAZIONI)
+    mod["preset"] = np.nonzero(usati)[0]  # ordine riga per riga: per preset, poi per slot
+    mod["sorgente"] = src[usati]
+    mod["destinazione"] = dst[usati]
+    mod["quantita"] = slot[..., 2][usati].astype(np.float64) * 2.0 - 1.0
+    mod["aux"] = aux[usati]
+
+    return PresetBatch(
+        nomi=[_nome_file(p) for p in paths],
+        basi=paths,
+        modulazioni=mod,
+        parametri=par,
+        envelopes=env,
+        vocabolario=voc,
+    )
+
+
+def _indice_intero(valori: np.ndarray) -> np.ndarray:
+    """Float → indice 0–255; valori non interi o fuori range diventano 256."""
+    validi = np.isfinite(valori) & (valori >= 0) & (valori < 256) & (valori == np.floor(valori))
+    return np.where(validi, valori, 256).astype(np.intp)
+
+
+def _nome(tabella: list[Optional[str]], valore: float) -> Optional[str]:
+    if 0 <= valore < 256 and valore == int(valore):
+        return tabella[int(valore)]
+    return None
+
+
+def _nome_file(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
@@ -1,27 +1,300 @@
 import os
-from scipy.io import wavfile
+import queue
+import threading
+import uuid
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Optional
+
 from models.input_schema import PresetInput
+from core.memo import stadio
+from core.metriche import conta
+from core.console import stampa
+
+if TYPE_CHECKING:
+    from output_io.archivio import ArchivioOutput
+
+SAMPLE_RATE = 44100
+
+# Scrittore in background attivo (vedi scrittura_in_background), None = scrittura sincrona
+_SCRITTORE: Optional["ScrittoreAsincrono"] = None
+
+# Archivio attivo (vedi scrittura_in_archivio): ha la precedenza sulla scrittura di file singoli
+_ARCHIVIO: Optional["ArchivioOutput"] = None
+
+# Funzioni chiamate con (path, bytes) per ogni .fxp scritto (es. aggiornamento dell'indice)
+_HOOK_FXP: list = []
+
 
+def aggiungi_hook_fxp(funzione):
+    _HOOK_FXP.append(funzione)
 
+
+def rimuovi_hook_fxp(funzione):
+    if funzione in _HOOK_FXP:
+        _HOOK_FXP.remove(funzione)
+
+
+@stadio(dipende_da=None)  # effetti collaterali: eseguito sempre
 def scrivi_output(preset: PresetInput) -> PresetInput:
     """
     Stadio 6 della pipeline — unico stadio con effetti collaterali.
-    Scrive su disco il file .fxp finale e, se presente, la wavetable .wav.
+    Scrive su disco il file .fxp finale e, se presenti, la wavetable .wav
+    e l'anteprima audio (<nome>_anteprima.wav), nella cartella preset._output_dir (default: output).
+    Ogni file viene scritto su un temporaneo e poi rinominato, così non
+    esiste mai un file di output scritto a metà.
+    Dentro scrittura_in_background() i file vengono solo accodati: le Future
+    delle scritture finiscono in preset._scritture.
+    Con preset._silenzioso (esegui_pipeline con verbose=False) non stampa le conferme [OK].
+    Dentro scrittura_in_archivio() .fxp, wavetable e anteprima vanno nell'archivio aperto.
     """
-    output_dir = "output"
+    log = _silenzio if preset._silenzioso else stampa
+    archivio = _ARCHIVIO
+    if archivio is not None:
+        return _scrivi_in_archivio(preset, archivio, log)
+
+    output_dir = preset._output_dir or "output"
     os.makedirs(output_dir, exist_ok=True)
+    scrittore = _SCRITTORE
+    scritture = []
 
     # Scrivi wavetable .wav
     if preset.wavetable and preset.wavetable.campioni is not None:
         wav_path = os.path.join(output_dir, f"{preset.nome}_wavetable.wav")
-        wavfile.write(wav_path, 44100, preset.wavetable.campioni)
-        print(f"[OK] Wavetable salvata: {wav_path}")
+        campioni = preset.wavetable.campioni
+        if scrittore:
+            scritture.append(scrittore.invia_wav(wav_path, campioni))
+        else:
+            _scrivi_atomico(wav_path, lambda f: _scrivi_wav(f, SAMPLE_RATE, campioni))
+        conta("bytes_scritti", campioni.nbytes + 44)
+        log(f"[OK] Wavetable salvata: {wav_path}")
+
+    # Scrivi anteprima .wav
+    if preset._anteprima is not None:
+        wav_path = os.path.join(output_dir, f"{preset.nome}_anteprima.wav")
+        audio, rate = preset._anteprima, preset.anteprima.rate
+        if scrittore:
+            scritture.append(scrittore.invia_wav(wav_path, audio, rate))
+        else:
+            _scrivi_atomico(wav_path, lambda f: _scrivi_wav(f, rate, audio))
+        conta("bytes_scritti", audio.nbytes + 44)
+        log(f"[OK] Anteprima salvata: {wav_path}")
 
     # Scrivi preset .fxp
-    if hasattr(preset, "_fxp_bytes"):
+    if preset._fxp_bytes is not None:
         fxp_path = os.path.join(output_dir, f"{preset.nome}.fxp")
-        with open(fxp_path, "wb") as f:
-            f.write(preset._fxp_bytes)
-        print(f"[OK] Preset salvato: {fxp_path}")
+        dati = preset._fxp_bytes
+        if scrittore:
+            scritture.append(scrittore.invia(fxp_path, dati))
+        else:
+            _scrivi_atomico(fxp_path, lambda f: f.write(dati))
+        conta("bytes_scritti", len(dati))
+        log(f"[OK] Preset salvato: {fxp_path}")
+        for hook in _HOOK_FXP:
+            hook(fxp_path, dati)
 
+    if scrittore:
+        preset._scritture = scritture
     return preset
+
+
+@contextmanager
+def scrittura_in_background(thread: int = 2, max_coda: int = 64,
+                            fsync: bool = True, fsync_ogni: int = 32):
+    """
+    Durante il blocco scrivi_output accoda i file a uno ScrittoreAsincrono.
+    All'uscita attende che tutte le scritture siano completate.
+    """
+    global _SCRITTORE
+    precedente = _SCRITTORE
+    scrittore = ScrittoreAsincrono(thread, max_coda, fsync, fsync_ogni)
+    _SCRITTORE = scrittore
+    try:
+        yield scrittore
+    finally:
+        _SCRITTORE = precedente
+        scrittore.chiudi()
+
+
+@contextmanager
+def scrittura_in_archivio(path: str, formato: Optional[str] = None, comprimi: bool = False):
+    """
+    Durante il blocco scrivi_output aggiunge i risultati all'archivio .zip/.tar
+    in path (creato o esteso, vedi output_io/archivio.py), che viene chiuso all'uscita.
+    """
+    from output_io.archivio import ArchivioOutput
+
+    global _ARCHIVIO
+    precedente = _ARCHIVIO
+    archivio = ArchivioOutput(path, formato, comprimi)
+    _ARCHIVIO = archivio
+    try:
+        yield archivio
+    finally:
+        _ARCHIVIO = precedente
+        archivio.chiudi()
+
+
+def in_archivio() -> bool:
+    """True dentro scrittura_in_archivio()."""
+    return _ARCHIVIO is not None
+
+
+def _scrivi_in_archivio(preset: PresetInput, archivio: "ArchivioOutput", log=stampa) -> PresetInput:
+    campioni = preset.wavetable.campioni if preset.wavetable else None
+    dati = preset._fxp_bytes
+    audio = preset._anteprima
+    if campioni is None and dati is None and audio is None:
+        return preset
+    rate_anteprima = preset.anteprima.rate if preset.anteprima else SAMPLE_RATE
+    riga = archivio.aggiungi(preset.nome, dati, campioni,
+                             anteprima=audio, rate_anteprima=rate_anteprima)
+    if campioni is not None:
+        conta("bytes_scritti", campioni.nbytes + 44)
+    if audio is not None:
+        conta("bytes_scritti", audio.nbytes + 44)
+    if dati is not None:
+        conta("bytes_scritti", len(dati))
+        log(f"[OK] Preset salvato: {archivio.path}:{riga['fxp']}")
+        for hook in _HOOK_FXP:
+            hook(os.path.join(archivio.path, riga["fxp"]), dati)
+    return preset
+
+
+class ScrittoreAsincrono:
+    """
+    Coda limitata di file da scrivere, svuotata da un gruppo di thread.
+    - backpressure: invia() si blocca quando la coda è piena
+    - ogni file va su un temporaneo nella cartella di destinazione, poi os.replace
+    - con fsync=True i temporanei vengono sincronizzati a gruppi di fsync_ogni
+      prima della rinomina, seguiti da un solo fsync per cartella
+    """
+
+    def __init__(self, thread: int = 2, max_coda: int = 64,
+                 fsync: bool = True, fsync_ogni: int = 32):
+        self.fsync = fsync
+        self.fsync_ogni = max(1, fsync_ogni)
+        self._coda: queue.Queue = queue.Queue(maxsize=max(1, max_coda))
+        self._thread = [threading.Thread(target=self._lavora, daemon=True)
+                        for _ in range(max(1, thread))]
+        for t in self._thread:
+            t.start()
+        self._chiuso = False
+
+    def invia(self, path: str, dati: bytes) -> Future:
+        """Accoda bytes da scrivere in path."""
+        return self._accoda(path, lambda f: f.write(dati))
+
+    def invia_wav(self, path: str, campioni, rate: int = SAMPLE_RATE) -> Future:
+        """Accoda una wavetable; la codifica WAV avviene nel thread di scrittura."""
+        return self._accoda(path, lambda f: _scrivi_wav(f, rate, campioni))
+
+    def chiudi(self):
+        """Attende lo svuotamento della coda e ferma i thread."""
+        if self._chiuso:
+            return
+        self._chiuso = True
+        for _ in self._thread:
+            self._coda.put(None)
+        for t in self._thread:
+            t.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.chiudi()
+
+    def _accoda(self, path: str, scrivi) -> Future:
+        if self._chiuso:
+            raise RuntimeError("ScrittoreAsincrono già chiuso")
+        futura = Future()
+        self._coda.put((path, scrivi, futura))  # blocca se il disco è indietro
+        return futura
+
+    def _lavora(self):
+        in_sospeso = []
+        while True:
+            lavoro = self._coda.get()
+            if lavoro is None:
+                self._completa(in_sospeso)
+                return
+            path, scrivi, futura = lavoro
+            temporaneo = _path_temporaneo(path)
+            try:
+                f = open(temporaneo, "wb")
+                try:
+                    scrivi(f)
+                    f.flush()
+                except BaseException:
+                    f.close()
+                    os.remove(temporaneo)
+                    raise
+            except Exception as e:
+                futura.set_exception(e)
+                continue
+            in_sospeso.append((f, temporaneo, path, futura))
+            if len(in_sospeso) >= self.fsync_ogni or self._coda.empty():
+                self._completa(in_sospeso)
+                in_sospeso = []
+
+    def _completa(self, in_sospeso: list):
+        """fsync (opzionale) dei temporanei, rinomina atomica, fsync delle cartelle."""
+        cartelle = set()
+        for f, temporaneo, path, futura in in_sospeso:
+            try:
+                if self.fsync:
+                    os.fsync(f.fileno())
+                f.close()
+                os.replace(temporaneo, path)
+                cartelle.add(os.path.dirname(os.path.abspath(path)))
+                futura.set_result(path)
+            except Exception as e:
+                f.close()
+                if os.path.exists(temporaneo):
+                    os.remove(temporaneo)
+                futura.set_exception(e)
+        if self.fsync:
+            for cartella in cartelle:
+                _fsync_cartella(cartella)
+
+
+def _silenzio(*args, **kwargs):
+    pass
+
+
+def _scrivi_wav(f, rate: int, campioni):
+    # scipy viene importato solo quando c'è davvero una wavetable da scrivere
+    from scipy.io import wavfile
+    wavfile.write(f, rate, campioni)
+
+
+def _path_temporaneo(path: str) -> str:
+    cartella, nome = os.path.split(path)
+    return os.path.join(cartella, f".{nome}.{uuid.uuid4().hex[:8]}.tmp")
+
+
+def _scrivi_atomico(path: str, scrivi):
+    """Scrive su un temporaneo nella stessa cartella e lo rinomina su path."""
+    temporaneo = _path_temporaneo(path)
+    try:
+        with open(temporaneo, "wb") as f:
+            scrivi(f)
+        os.replace(temporaneo, path)
+    except BaseException:
+        if os.path.exists(temporaneo):
+            os.remove(temporaneo)
+        raise
+
+
+def _fsync_cartella(cartella: str):
+    try:
+        fd = os.open(cartella, os.O_RDONLY)
+    except OSError:
+        return  # es. Windows: le cartelle non si possono aprire
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)